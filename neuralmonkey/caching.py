@@ -0,0 +1,173 @@
+"""Fingerprints of files and Python objects used as keys of on-disk caches.
+
+A cached result of data preprocessing is valid only as long as the input
+files and everything that processes them stay the same. This module computes
+stable string fingerprints of both, so they can be combined into cache keys.
+"""
+
+from typing import Any, Set
+import dis
+import hashlib
+import os
+import re
+import types
+
+import numpy as np
+
+
+def file_fingerprint(path: str) -> str:
+    """Get a fingerprint of a file.
+
+    The fingerprint is based on the absolute path, size and modification
+    time of the file, so the file does not need to be read.
+
+    Arguments:
+        path: The path to the file.
+
+    Returns:
+        Hexadecimal digest identifying the file version.
+    """
+    stat = os.stat(path)
+    return _digest("{}:{}:{}".format(
+        os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+
+
+def object_fingerprint(obj: Any) -> str:
+    """Get a fingerprint of a Python object.
+
+    The fingerprint is computed from the object value, not its identity, so it
+    is stable across runs. Functions are identified by their names, code,
+    default arguments, closures and the values of the global variables they
+    reference, other objects by their class and attributes. This way,
+    a fingerprint of a preprocessor reflects its parameters including e.g.
+    the loaded BPE merges.
+
+    Classes and modules are identified only by their names, so a change of
+    their code does not change the fingerprint. Neither do changes of the
+    functions called only through attributes of modules or objects, and of
+    the global values which cannot be fingerprinted.
+
+    Arguments:
+        obj: The object.
+
+    Returns:
+        Hexadecimal digest identifying the object value.
+
+    Raises:
+        ValueError if the object cannot be fingerprinted.
+    """
+    return _digest(_canonical_repr(obj, set()))
+
+
+def cache_key(*parts: str) -> str:
+    """Combine fingerprints into a single cache key.
+
+    Arguments:
+        parts: Fingerprints of everything the cached data depend on.
+
+    Returns:
+        Hexadecimal digest which can be used as a file name.
+    """
+    return _digest("|".join(parts))
+
+
+def _digest(string: str) -> str:
+    return hashlib.sha1(string.encode("utf-8")).hexdigest()
+
+
+# pylint: disable=too-many-return-statements
+def _canonical_repr(obj: Any, seen: Set[int]) -> str:
+    """Get a string representation of an object value stable across runs."""
+    if obj is None or isinstance(obj, (bool, int, float, str, bytes)):
+        return repr(obj)
+
+    if id(obj) in seen:
+        return "<cycle>"
+    seen = seen | {id(obj)}
+
+    if isinstance(obj, (list, tuple)):
+        return "{}[{}]".format(type(obj).__name__, ",".join(
+            _canonical_repr(item, seen) for item in obj))
+
+    if isinstance(obj, (set, frozenset)):
+        return "set[{}]".format(",".join(
+            sorted(_canonical_repr(item, seen) for item in obj)))
+
+    if isinstance(obj, dict):
+        return "dict[{}]".format(",".join(sorted(
+            "{}:{}".format(_canonical_repr(key, seen),
+                           _canonical_repr(value, seen))
+            for key, value in obj.items())))
+
+    if isinstance(obj, np.ndarray):
+        return "ndarray[{},{},{}]".format(
+            obj.dtype, obj.shape,
+            hashlib.sha1(np.ascontiguousarray(obj).tobytes()).hexdigest())
+
+    if isinstance(obj, (types.BuiltinFunctionType, type, types.ModuleType)):
+        return "{}.{}".format(getattr(obj, "__module__", ""),
+                              getattr(obj, "__qualname__", obj.__name__))
+
+    if isinstance(obj, types.MethodType):
+        return "method[{},{}]".format(_canonical_repr(obj.__func__, seen),
+                                      _canonical_repr(obj.__self__, seen))
+
+    if isinstance(obj, types.FunctionType):
+        closure = [cell.cell_contents for cell in obj.__closure__ or []]
+        return "function[{}.{},{},{},{},{}]".format(
+            obj.__module__, obj.__qualname__,
+            _canonical_repr(obj.__code__, seen),
+            _canonical_repr(obj.__defaults__, seen),
+            _canonical_repr(closure, seen),
+            _globals_repr(obj, seen))
+
+    if isinstance(obj, types.CodeType):
+        return "code[{},{},{}]".format(
+            hashlib.sha1(obj.co_code).hexdigest(),
+            _canonical_repr(obj.co_consts, seen),
+            _canonical_repr(obj.co_names, seen))
+
+    if isinstance(obj, type(re.compile(""))):
+        return "pattern[{},{}]".format(_canonical_repr(obj.pattern, seen),
+                                       obj.flags)
+
+    if hasattr(obj, "__dict__"):
+        return "{}.{}{}".format(type(obj).__module__, type(obj).__qualname__,
+                                _canonical_repr(vars(obj), seen))
+
+    raise ValueError("Cannot compute fingerprint of object of type {}"
+                     .format(type(obj)))
+
+
+def _globals_repr(function: types.FunctionType, seen: Set[int]) -> str:
+    """Get a representation of the global variables used by a function.
+
+    The names are collected also from the nested functions and lambdas. The
+    variables assigned by the function (e.g. counters) are its state, not its
+    parameters, so they are skipped. The values which cannot be fingerprinted
+    are represented by their type.
+    """
+    loaded = set()  # type: Set[str]
+    stored = set()  # type: Set[str]
+    codes = [function.__code__]
+    while codes:
+        code = codes.pop()
+        for instruction in dis.get_instructions(code):
+            if instruction.opname == "LOAD_GLOBAL":
+                loaded.add(instruction.argval)
+            elif instruction.opname in ("STORE_GLOBAL", "DELETE_GLOBAL"):
+                stored.add(instruction.argval)
+        codes.extend(const for const in code.co_consts
+                     if isinstance(const, types.CodeType))
+
+    values = []
+    for name in sorted(loaded - stored):
+        if name not in function.__globals__:
+            continue
+        value = function.__globals__[name]
+        try:
+            value_repr = _canonical_repr(value, seen)
+        except ValueError:
+            value_repr = "<{}>".format(type(value).__qualname__)
+        values.append("{}:{}".format(name, value_repr))
+    return "globals[{}]".format(",".join(values))
@@ -1,17 +1,34 @@
 """ Implementation of the dataset class. """
 
+import functools
 import random
 import re
 import collections
+import collections.abc
+import copy
+import itertools
 
-from typing import cast, Any, List, Callable, Iterable, Dict, Tuple, Union
+from typing import (cast, Any, List, Callable, Iterable, Iterator, Dict,
+                    Tuple, Union, Optional)
 
 import numpy as np
 from typeguard import check_argument_types
 
-from neuralmonkey.logging import log
+from neuralmonkey.caching import (cache_key, file_fingerprint,
+                                  object_fingerprint)
+from neuralmonkey.interned_series import (InternedSeries, StringTable,
+                                          intern_series)
+from neuralmonkey.logging import log, warn
+from neuralmonkey.parallel import (DEFAULT_CHUNK_SIZE, parallel_imap,
+                                   parallel_map)
+from neuralmonkey.readers.compiled_reader import TokenIdSeries
+from neuralmonkey.readers.compression import read_line_batches
+from neuralmonkey.readers.line_index import LineIndex
+from neuralmonkey.readers.numpy_reader import ShardedArray
 from neuralmonkey.readers.utils import Reader
 from neuralmonkey.readers.plain_text_reader import UtfPlainTextReader
+from neuralmonkey.series_cache import (CachedSeries, load_cached_series,
+                                       save_cached_series)
 
 
 class Dataset(collections.Sized):
@@ -20,10 +37,15 @@ class Dataset(collections.Sized):
     dataset, it also manages the vocabularies inferred from the data.
 
     A data series is either a list of strings or a numpy array.
+
+    The order of the instances is kept as an array of indices into the
+    series. Shuffling only permutes this array and the batches are views
+    sharing the series with the dataset, so neither of them copies the data.
     """
 
     def __init__(self, name: str, series: Dict[str, List],
-                 series_outputs: Dict[str, str]) -> None:
+                 series_outputs: Dict[str, str],
+                 indices: Optional[np.ndarray]=None) -> None:
         """Creates a dataset from the provided already preprocessed
         series of data.
 
@@ -31,10 +53,15 @@ class Dataset(collections.Sized):
             name: The name for the dataset
             series: Dictionary from the series name to the actual data.
             series_outputs: Output files for target series.
+            indices: Indices of the instances of the series which form the
+                dataset, in the order of the dataset. If None, the dataset
+                consists of all instances in the original order.
         """
         self.name = name
         self._series = series
         self.series_outputs = series_outputs
+        self._indices = indices
+        self._length_table = None  # type: Optional[np.ndarray]
 
         self._check_series_lengths()
 
@@ -44,12 +71,13 @@ class Dataset(collections.Sized):
         Raises:
             Exception when the lengths in the dataset do not match.
         """
-        lengths = [len(list(v)) for v in self._series.values()
-                   if isinstance(v, list) or isinstance(v, np.ndarray)]
+        lengths = [len(v) for v in self._series.values()
+                   if hasattr(v, "__len__")]
 
         if len(set(lengths)) > 1:
-            err_str = ["{}: {}".format(s, len(list(self._series[s])))
-                       for s in self._series]
+            err_str = ["{}: {}".format(s, len(v))
+                       for s, v in self._series.items()
+                       if hasattr(v, "__len__")]
             raise Exception("Lengths of data series must be equal. Instead: {}"
                             .format(", ".join(err_str)))
 
@@ -59,11 +87,11 @@ class Dataset(collections.Sized):
         Returns:
             The length of the dataset.
         """
-        if not list(self._series.values()):
+        if self._indices is not None:
+            return len(self._indices)
+        if not self._series:
             return 0
-        else:
-            first_series = next(iter(self._series.values()))
-            return len(list(first_series))
+        return len(next(iter(self._series.values())))
 
     def has_series(self, name: str) -> bool:
         """Check if the dataset contains a series of a given name.
@@ -79,6 +107,11 @@ class Dataset(collections.Sized):
     def get_series(self, name: str, allow_none: bool=False) -> Iterable:
         """Get the data series with a given name.
 
+        If the dataset is shuffled or it is a batch, numpy series (including
+        memory-mapped and sharded arrays) and interned series are indexed by
+        the instance indices, so only the rows of the batch are read. Other
+        series are returned as read-only views in the order of the dataset.
+
         Arguments:
             name: The name of the series to fetch.
             allow_none: If True, return None if the series does not exist.
@@ -90,21 +123,54 @@ class Dataset(collections.Sized):
             KeyError if the series does not exists and allow_none is False
         """
         if allow_none:
-            return self._series.get(name)
+            series = self._series.get(name)
         else:
-            return self._series[name]
+            series = self._series[name]
+
+        if series is None or self._indices is None:
+            return series
+        if isinstance(series, (np.ndarray, ShardedArray, InternedSeries)):
+            return series[self._indices]
+        return SeriesView(series, self._indices)
 
     @property
     def series_ids(self) -> Iterable[str]:
         return self._series.keys()
 
+    def _instance_order(self) -> np.ndarray:
+        """Get the indices of the instances in the order of the dataset."""
+        if self._indices is None:
+            return np.arange(len(self))
+        return self._indices
+
     def shuffle(self) -> None:
-        """Shuffle the dataset randomly """
-        keys = list(self._series.keys())
-        zipped = list(zip(*[self._series[k] for k in keys]))
-        random.shuffle(zipped)
-        for key, serie in zip(keys, list(zip(*zipped))):
-            self._series[key] = serie
+        """Shuffle the dataset randomly.
+
+        Only the instance indices are permuted, the series stay untouched.
+        """
+        self._indices = np.random.permutation(self._instance_order())
+
+    def shard(self, index: int, count: int) -> 'Dataset':
+        """Get a shard of the dataset.
+
+        The dataset is split into ``count`` contiguous parts of (almost) the
+        same size in its current order, so the outputs computed on the
+        shards can be concatenated. The shard is a view sharing the series
+        with this dataset. The paths of the output files get the shard index
+        as a suffix.
+
+        Arguments:
+            index: The index of the shard, from zero to ``count - 1``.
+            count: The number of shards.
+
+        Returns:
+            The dataset view with the instances of the shard.
+        """
+        start, end = _shard_bounds(len(self), index, count)
+        return Dataset(_shard_name(self.name, index, count),
+                       dict(self._series),
+                       _shard_outputs(self.series_outputs, index),
+                       indices=self._instance_order()[start:end])
 
     def batch_serie(self, serie_name: str,
                     batch_size: int) -> Iterable[Iterable]:
@@ -126,31 +192,124 @@ class Dataset(collections.Sized):
         if buf:
             yield buf
 
-    def batch_dataset(self, batch_size: int) -> Iterable['Dataset']:
+    def batch_dataset(
+            self, batch_size: Optional[int],
+            bucket_window: Optional[int]=None,
+            token_budget: Optional[int]=None) -> Iterable['Dataset']:
         """Split the dataset into a list of batched datasets.
 
+        The batches are views of this dataset given by the indices of their
+        instances, the series are not copied.
+
         Arguments:
-            batch_size: The size of a batch.
+            batch_size: The maximum number of instances in a batch. It can be
+                None only if the token budget is set.
+            bucket_window: If set, the instances are read in windows of
+                ``bucket_window`` batches. Each window is sorted by the
+                lengths of the sequence series and cut into batches, which
+                are yielded in a random order. Batches then contain
+                sentences of similar lengths and need less padding.
+            token_budget: If set, a batch is also closed before the number of
+                padded tokens (the number of instances times the length of
+                the longest sequence in the batch) would exceed this value.
 
         Returns:
             Generator yielding batched datasets.
         """
-        keys = list(self._series.keys())
-        batched_series = [self.batch_serie(key, batch_size) for key in keys]
+        _check_batching_arguments(batch_size, bucket_window, token_budget)
+
+        order = self._instance_order()
+        if bucket_window is None and token_budget is None:
+            index_batches = (
+                order[start:start + batch_size]
+                for start in range(0, len(order), batch_size)
+            )  # type: Iterable[Any]
+        else:
+            length_table = self._get_length_table()
 
-        batch_index = 0
-        for next_batches in zip(*batched_series):
-            batch_dict = {key: data for key, data in zip(keys, next_batches)}
-            dataset = Dataset(self.name + "-batch-{}".format(batch_index),
-                              batch_dict, {})
-            batch_index += 1
-            yield dataset
+            def lengths(index: int) -> Tuple[int, ...]:
+                return tuple(length_table[index])
+
+            if bucket_window is None:
+                index_batches = _batch_instances(
+                    order, batch_size, token_budget, lengths)
+            else:
+                index_batches = _bucket_instances(
+                    order, batch_size, bucket_window, token_budget, lengths)
+
+        for batch_index, indices in enumerate(index_batches):
+            yield Dataset(self.name + "-batch-{}".format(batch_index),
+                          dict(self._series), {},
+                          indices=np.asarray(indices, dtype=np.int64))
+
+    def _get_length_table(self) -> np.ndarray:
+        """Get the lengths of the sequence items of all instances.
+
+        The table is computed once and then cached.
+
+        Returns:
+            Matrix with a row for each instance (in the original order) and
+            a column for each series of sequences.
+        """
+        if self._length_table is None:
+            columns = [_series_lengths(series)
+                       for series in self._series.values()]
+            columns = [c for c in columns if c is not None]
+            if columns:
+                self._length_table = np.stack(columns, axis=1)
+            else:
+                self._length_table = np.zeros(
+                    (len(self._instance_order()), 0), dtype=np.int64)
+        return self._length_table
 
     def add_series(self, name: str, series: List[Any]) -> None:
         if name in self._series:
             raise ValueError(
                 "Can't series that already exist: {}".format(name))
+
+        if self._indices is not None:
+            if len(self._indices) != len(series):
+                raise ValueError("Lengths of data series must be equal.")
+            base_length = len(next(iter(self._series.values())))
+            if len(self._indices) != base_length:
+                raise ValueError(
+                    "Can't add series to a batch of dataset '{}'"
+                    .format(self.name))
+            # store the series in the original order of the instances
+            series_list = list(series)
+            unshuffled = [None] * base_length  # type: List[Any]
+            for index, item in zip(self._indices, series_list):
+                unshuffled[index] = item
+            series = unshuffled
+
         self._series[name] = series
+        self._length_table = None
+
+
+class SeriesView(collections.abc.Sequence):
+    """Read-only view of a data series in the order given by indices."""
+
+    def __init__(self, series: Any, indices: np.ndarray) -> None:
+        """Create a view of a series.
+
+        Arguments:
+            series: The underlying series supporting integer indexing.
+            indices: Indices of the items in the view.
+        """
+        self._series = series
+        self._indices = indices
+
+    def __len__(self) -> int:
+        return len(self._indices)
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return SeriesView(self._series, self._indices[index])
+        return self._series[int(self._indices[index])]
+
+    def __iter__(self) -> Iterator[Any]:
+        series = self._series
+        return (series[index] for index in self._indices.tolist())
 
 
 class LazyDataset(Dataset):
@@ -160,12 +319,38 @@ class LazyDataset(Dataset):
     that the contents of the file are not fully loaded to the memory.
     Instead, everytime the function ``get_series`` is called, a new file handle
     is created and a generator which yields lines from the file is returned.
+
+    If the dataset is indexed, byte offsets of the lines of all series files
+    are loaded (see ``neuralmonkey.readers.line_index``). The dataset then
+    knows its length, can be shuffled and can skip instances without reading
+    them. The lines are read from memory-mapped files in the current order.
+
+    A dataset which is not indexed can be shuffled approximately using a
+    shuffle buffer. The series are then read through a buffer of a given
+    size from which the instances are drawn randomly. All series use a random
+    generator with the same seed, so they stay aligned.
+
+    A shard of an indexed dataset reads only its own range of lines. A shard
+    of a dataset which is not indexed takes every n-th line of the files. It
+    parses only its own lines if the readers provide the ``parse_line``
+    function, but the files are still read (and decompressed) whole by every
+    shard, so the dataset should be indexed when it is sharded to many
+    workers.
+
+    If a cache directory is given, the preprocessed series are read from the
+    on-disk cache (see ``neuralmonkey.series_cache``) instead of being
+    preprocessed on the fly. Missing series are stored to the cache when the
+    dataset is created.
     """
 
+    # pylint: disable=too-many-arguments
     def __init__(self, name: str,
                  series_paths_and_readers: Dict[str, Tuple[List[str], Reader]],
                  series_outputs: Dict[str, str],
-                 preprocessors: List[Tuple[str, str, Callable]]=None) -> None:
+                 preprocessors: List[Tuple[str, str, Callable]]=None,
+                 index: bool=False,
+                 shuffle_buffer: int=0,
+                 cache_dir: Optional[str]=None) -> None:
         """Create a new instance of the lazy dataset.
 
         Arguments:
@@ -173,6 +358,13 @@ class LazyDataset(Dataset):
             of series name to its file series_outputs: Dictionary mapping
             series names to their output file preprocess: The preprocessor to
             apply to the read lines
+            index: Flag whether to index the series files. All series readers
+                must provide the ``parse_line`` function (as the plain text
+                readers do).
+            shuffle_buffer: Size of the buffer used for shuffling of the
+                dataset which is not indexed. Zero disables shuffling.
+            cache_dir: Directory with the cache of the preprocessed series.
+                If None, the series are not cached.
         """
         parent_series = dict()  # type: Dict[str, Any]
         parent_series.update({s: None for s in series_paths_and_readers})
@@ -194,17 +386,103 @@ class LazyDataset(Dataset):
                              src_id, func.__name__))
                 self.preprocess_series[tgt_id] = (src_id, func)
 
+        if shuffle_buffer < 0:
+            raise ValueError("Shuffle buffer size must be non-negative, "
+                             "was {}.".format(shuffle_buffer))
+        self.shuffle_buffer = shuffle_buffer
+        self._shuffle_seed = None  # type: Optional[int]
+
+        self._line_indices = None  # type: Optional[Dict[str, LineIndex]]
+        # lines of the indexed dataset (if it is a shard) and their order
+        self._lines = None  # type: Optional[np.ndarray]
+        self._order = None  # type: Optional[np.ndarray]
+        # index and count of the shard of the dataset which is not indexed
+        self._stride = None  # type: Optional[Tuple[int, int]]
+        if index:
+            self._create_line_indices()
+
+        self._cached_series = {}  # type: Dict[str, CachedSeries]
+        if cache_dir is not None:
+            self._load_cached_series(cache_dir)
+
+    def _create_line_indices(self) -> None:
+        """Load or build the line indices of all series files.
+
+        Raises:
+            Exception when a reader does not support reading of single lines
+            or when the series differ in the number of lines.
+        """
+        self._line_indices = {}
+        for name, (paths, reader) in self.series_paths_and_readers.items():
+            if not hasattr(reader, "parse_line"):
+                raise Exception(
+                    "Reader of series '{}' cannot read single lines, the "
+                    "series cannot be indexed.".format(name))
+            self._line_indices[name] = LineIndex(paths)
+
+        lengths = {name: len(index)
+                   for name, index in self._line_indices.items()}
+        if len(set(lengths.values())) > 1:
+            raise Exception("Lengths of data series must be equal. Instead: {}"
+                            .format(", ".join("{}: {}".format(name, length)
+                                              for name, length
+                                              in lengths.items())))
+
+    def _load_cached_series(self, cache_dir: str) -> None:
+        """Open the cached preprocessed series.
+
+        The series missing in the cache are preprocessed in a single pass
+        over the source files and stored to the cache first.
+
+        Arguments:
+            cache_dir: The cache directory.
+        """
+        for name, (src_id, func) in self.preprocess_series.items():
+            paths, reader = self.series_paths_and_readers[src_id]
+            key = _derived_series_key(func, _source_series_key(paths, reader))
+            if key is None:
+                continue
+
+            cached = load_cached_series(cache_dir, key)
+            if cached is None:
+                save_cached_series(cache_dir, key, map(func, reader(paths)))
+                cached = load_cached_series(cache_dir, key)
+            if cached is not None:
+                self._cached_series[name] = cached
+
+    @property
+    def indexed(self) -> bool:
+        """Flag whether the dataset has the line indices."""
+        return self._line_indices is not None
+
     def __len__(self):
-        """Length of the lazy dataset is unknown.
+        """Get the length of the dataset.
+
+        The length of the lazy dataset is known only if it is indexed. The
+        instances skipped by ``skip_instances`` are not counted.
 
-        TODO: reconsider the exception raising, maybe just write a warning
-        log message instead and return None or zero. Make the decision
-        consistent with the implementation of the ``shuffle`` function.
+        Returns:
+            The length of the dataset.
 
         Raises:
-            Exception every time this function is called.
+            Exception if the dataset is not indexed.
+        """
+        if self._line_indices is None:
+            raise Exception("Lazy dataset does not know its size")
+        if self._order is not None:
+            return len(self._order)
+        return self._num_lines()
+
+    def _num_lines(self) -> int:
+        """Get the number of lines of the indexed dataset.
+
+        Unlike the length, it includes the skipped instances.
         """
-        raise Exception("Lazy dataset does not know its size")
+        if self._lines is not None:
+            return len(self._lines)
+        if not self._line_indices:
+            return 0
+        return len(next(iter(self._line_indices.values())))
 
     def has_series(self, name: str) -> bool:
         """Check if the dataset contains a series of a given name.
@@ -241,22 +519,201 @@ class LazyDataset(Dataset):
             return None
 
         if name in self.series_paths_and_readers:
-            paths, reader = self.series_paths_and_readers[name]
-            return reader(paths)
+            return self._read_series(name)
+        elif name in self._cached_series:
+            return self._read_cached_series(name)
         elif name in self.preprocess_series:
             src_id, func = self.preprocess_series[name]
-            paths, reader = self.series_paths_and_readers[src_id]
-            src_series = reader(paths)
-            return map(func, src_series)
+            return map(func, self._read_series(src_id))
         else:
             raise Exception("Series '{}' is not in the dataset.".format(name))
 
+    def _read_series(self, name: str) -> Iterable:
+        """Read a series from its files.
+
+        Arguments:
+            name: The name of a series which is read from files.
+
+        Returns:
+            Generator of the series items in the current order.
+        """
+        paths, reader = self.series_paths_and_readers[name]
+
+        if self._line_indices is None:
+            if self._stride is not None and hasattr(reader, "parse_line"):
+                # only the raw lines of the shard are parsed
+                index, count = self._stride
+                lines = itertools.islice(_raw_lines(paths), index, None, count)
+                return self._shuffle_stream(
+                    map(reader.parse_line, lines))  # type: ignore
+            return self._read_stream(reader(paths))
+
+        lines = self._line_indices[name].read_lines(self._indexed_order())
+        return map(reader.parse_line, lines)  # type: ignore
+
+    def _read_cached_series(self, name: str) -> Iterable:
+        """Read a preprocessed series from the cache.
+
+        Arguments:
+            name: The name of a cached series.
+
+        Returns:
+            Generator of the series items in the current order.
+        """
+        cached = self._cached_series[name]
+
+        if self._line_indices is None:
+            if self._stride is not None:
+                index, count = self._stride
+                return self._shuffle_stream(
+                    cached[line] for line in range(index, len(cached), count))
+            return self._read_stream(cached)
+
+        return (cached[index] for index in self._indexed_order())
+
+    def _read_stream(self, items: Iterable[Any]) -> Iterable[Any]:
+        """Select and shuffle items of the dataset which is not indexed.
+
+        Arguments:
+            items: The items of a series in the order of the files.
+
+        Returns:
+            Generator of the items of the shard (if the dataset is a shard)
+            in the current order.
+        """
+        if self._stride is not None:
+            index, count = self._stride
+            items = itertools.islice(items, index, None, count)
+        return self._shuffle_stream(items)
+
+    def _shuffle_stream(self, items: Iterable[Any]) -> Iterable[Any]:
+        """Shuffle items of the dataset which is not indexed if it is set."""
+        if self._shuffle_seed is not None:
+            return _buffered_shuffle(items, self.shuffle_buffer,
+                                     self._shuffle_seed)
+        return items
+
+    def _all_lines(self) -> Iterable[int]:
+        """Get the lines of the indexed dataset in the original order."""
+        if self._lines is None:
+            return range(self._num_lines())
+        return self._lines
+
+    def _indexed_order(self) -> Iterable[int]:
+        """Get the current order of the lines of the indexed dataset."""
+        if self._order is None:
+            return self._all_lines()
+        return self._order
+
     def shuffle(self):
-        """Does nothing, not in-memory shuffle is impossible.
+        """Shuffle the dataset randomly.
 
-        TODO: this is related to the ``__len__`` method.
+        The indexed dataset is permuted. Otherwise, if the shuffle buffer is
+        set, a new seed for the buffered shuffling is drawn from the global
+        random generator (which is seeded with the experiment random seed).
+        Otherwise, it does nothing, the lazy dataset cannot be shuffled in
+        memory.
         """
-        pass
+        if self._line_indices is not None:
+            self._order = np.random.permutation(
+                np.asarray(self._all_lines()))
+        elif self.shuffle_buffer > 0:
+            self._shuffle_seed = random.getrandbits(32)
+
+    def skip_instances(self, count: int) -> None:
+        """Skip instances at the beginning of the current order.
+
+        The skipped instances are not read at all. The next call of
+        ``shuffle`` restores the full dataset.
+
+        Arguments:
+            count: Number of instances to skip.
+
+        Raises:
+            Exception if the dataset is not indexed.
+            ValueError if the dataset has fewer instances.
+        """
+        if self._line_indices is None:
+            raise Exception("Only indexed lazy dataset can skip instances")
+        if count > len(self):
+            raise ValueError("Trying to skip more instances than "
+                             "the size of the dataset")
+
+        if self._order is None:
+            self._order = np.asarray(self._all_lines())
+        self._order = self._order[count:]
+
+    def shard(self, index: int, count: int) -> 'LazyDataset':
+        """Get a shard of the dataset.
+
+        The indexed dataset is split into ``count`` contiguous ranges of
+        lines, the shard reads only the lines from its range. The shard of
+        the dataset which is not indexed takes every ``count``-th line
+        starting from the line ``index``; it still reads the whole files, so
+        only the indexed datasets avoid reading all the data in every shard.
+        The paths of the output files get the shard index as a suffix.
+
+        Arguments:
+            index: The index of the shard, from zero to ``count - 1``.
+            count: The number of shards.
+
+        Returns:
+            A lazy dataset reading the instances of the shard.
+        """
+        shard = copy.copy(self)
+        shard.name = _shard_name(self.name, index, count)
+        shard.series_outputs = _shard_outputs(self.series_outputs, index)
+        shard._order = None  # pylint: disable=protected-access
+
+        if self._line_indices is not None:
+            start, end = _shard_bounds(self._num_lines(), index, count)
+            # pylint: disable=protected-access
+            shard._lines = np.asarray(self._all_lines())[start:end]
+        else:
+            if self._stride is not None:
+                raise ValueError("Shard of a lazy dataset which is not "
+                                 "indexed cannot be sharded again.")
+            _shard_bounds(0, index, count)
+            shard._stride = (index, count)  # pylint: disable=protected-access
+
+        return shard
+
+    def batch_dataset(
+            self, batch_size: Optional[int],
+            bucket_window: Optional[int]=None,
+            token_budget: Optional[int]=None) -> Iterable[Dataset]:
+        """Split the dataset into a list of batched datasets.
+
+        The series are read in a single pass and each batch is collected
+        into a small in-memory dataset. See ``Dataset.batch_dataset`` for the
+        description of the arguments.
+
+        Returns:
+            Generator yielding batched datasets.
+        """
+        _check_batching_arguments(batch_size, bucket_window, token_budget)
+
+        keys = list(self.series_ids)
+
+        if bucket_window is None and token_budget is None:
+            batched_series = [self.batch_serie(key, batch_size)
+                              for key in keys]
+            batches = zip(*batched_series)  # type: Iterable[Iterable[List]]
+        else:
+            instances = zip(*[self.get_series(key) for key in keys])
+            if bucket_window is None:
+                instance_batches = _batch_instances(
+                    instances, batch_size, token_budget)
+            else:
+                instance_batches = _bucket_instances(
+                    instances, batch_size, bucket_window, token_budget)
+            batches = ([list(serie) for serie in zip(*instances_batch)]
+                       for instances_batch in instance_batches)
+
+        for batch_index, next_batches in enumerate(batches):
+            batch_dict = {key: data for key, data in zip(keys, next_batches)}
+            yield Dataset(self.name + "-batch-{}".format(batch_index),
+                          batch_dict, {})
 
     @property
     def series_ids(self) -> Iterable[str]:
@@ -268,6 +725,412 @@ class LazyDataset(Dataset):
             "Lazy dataset does not support adding series.")
 
 
+class MixedDataset(Dataset):
+    """Dataset streaming batches from several source datasets.
+
+    Each batch is drawn from a single source, which is sampled randomly for
+    every batch. The sampling probabilities are given by the weights of the
+    sources (by default, their lengths) raised to the power of one over the
+    temperature and normalized. A temperature higher than one makes the
+    distribution flatter, so small sources (e.g. in-domain data) are
+    oversampled without duplicating them on disk or in memory.
+
+    An epoch ends when the batches contain as many instances as the epoch
+    size. When a source runs out of batches before the end of the epoch, it
+    is shuffled and batched again.
+
+    The batches contain only the series of their source, so with a
+    ``MultiDecoder``, the decoders whose series are missing in the batch are
+    fed with dummy data.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, name: str,
+                 datasets: List[Dataset],
+                 weights: Optional[List[float]]=None,
+                 temperature: float=1.0,
+                 epoch_size: Optional[int]=None) -> None:
+        """Create a mixture of datasets.
+
+        Arguments:
+            name: The name of the dataset.
+            datasets: The source datasets.
+            weights: Sampling weights of the sources. If None, the lengths of
+                the sources are used, so the weights are required for
+                non-indexed lazy sources.
+            temperature: The temperature of the sampling distribution.
+            epoch_size: Number of instances in an epoch. If None, it is the
+                sum of the lengths of the sources, so the epoch size is
+                required for non-indexed lazy sources.
+
+        Raises:
+            ValueError if the arguments are invalid.
+        """
+        if not datasets:
+            raise ValueError("At least one source dataset must be given.")
+        if weights is not None and len(weights) != len(datasets):
+            raise ValueError("There are {} weights for {} datasets."
+                             .format(len(weights), len(datasets)))
+        if temperature <= 0:
+            raise ValueError("Temperature must be positive, was {}."
+                             .format(temperature))
+        if epoch_size is not None and epoch_size < 1:
+            raise ValueError("Epoch size must be positive, was {}."
+                             .format(epoch_size))
+
+        # pylint: disable=protected-access
+        streaming = [dataset.name for dataset in datasets
+                     if isinstance(dataset, LazyDataset)
+                     and dataset._line_indices is None]
+        # pylint: enable=protected-access
+        if streaming and (weights is None or epoch_size is None):
+            raise ValueError(
+                "The sizes of the non-indexed lazy datasets {} are not "
+                "known, so both weights and epoch_size must be given."
+                .format(", ".join(streaming)))
+
+        super().__init__(name, {}, {})
+        self.datasets = datasets
+        self.temperature = temperature
+        self.epoch_size = epoch_size
+
+        if weights is None:
+            weights = [len(dataset) for dataset in datasets]
+        weights_np = np.asarray(weights, dtype=np.float64)
+        if np.any(weights_np < 0) or not np.any(weights_np > 0):
+            raise ValueError("Weights must be non-negative and at least one "
+                             "of them positive, were {}.".format(weights))
+
+        scaled = weights_np ** (1. / temperature)
+        self.probabilities = scaled / scaled.sum()
+        log("Dataset '{}' samples from {}".format(
+            name, ", ".join("{} ({:.3f})".format(dataset.name, prob)
+                            for dataset, prob in zip(datasets,
+                                                     self.probabilities))))
+
+    def __len__(self) -> int:
+        """Get the number of instances in an epoch."""
+        if self.epoch_size is not None:
+            return self.epoch_size
+        return sum(len(dataset) for dataset in self.datasets)
+
+    def has_series(self, name: str) -> bool:
+        return any(dataset.has_series(name) for dataset in self.datasets)
+
+    def get_series(self, name: str, allow_none: bool=False) -> Iterable:
+        """Get the series concatenated from the sources which contain it.
+
+        Arguments:
+            name: The name of the series to fetch.
+            allow_none: If True, return None if no source has the series.
+
+        Returns:
+            Generator yielding the items of the series.
+
+        Raises:
+            KeyError if no source has the series and allow_none is False.
+        """
+        sources = [dataset for dataset in self.datasets
+                   if dataset.has_series(name)]
+        if not sources:
+            if allow_none:
+                return None
+            raise KeyError(name)
+        return itertools.chain.from_iterable(
+            dataset.get_series(name) for dataset in sources)
+
+    @property
+    def series_ids(self) -> Iterable[str]:
+        series_ids = []  # type: List[str]
+        for dataset in self.datasets:
+            series_ids.extend(s for s in dataset.series_ids
+                              if s not in series_ids)
+        return series_ids
+
+    def shuffle(self) -> None:
+        """Shuffle all source datasets."""
+        for dataset in self.datasets:
+            dataset.shuffle()
+
+    def shard(self, index: int, count: int) -> 'MixedDataset':
+        """Get a mixture of the shards of the sources.
+
+        The sampling probabilities stay the same, the epoch size (if set) is
+        divided among the shards.
+        """
+        epoch_size = None
+        if self.epoch_size is not None:
+            start, end = _shard_bounds(self.epoch_size, index, count)
+            epoch_size = max(end - start, 1)
+
+        shard = copy.copy(self)
+        shard.name = _shard_name(self.name, index, count)
+        shard.datasets = [dataset.shard(index, count)
+                          for dataset in self.datasets]
+        shard.epoch_size = epoch_size
+        return shard
+
+    def batch_dataset(
+            self, batch_size: Optional[int],
+            bucket_window: Optional[int]=None,
+            token_budget: Optional[int]=None) -> Iterable[Dataset]:
+        """Generate batches of an epoch from randomly chosen sources.
+
+        The sources are batched lazily, see ``Dataset.batch_dataset`` for
+        the description of the arguments.
+
+        Returns:
+            Generator yielding the batches of the source datasets.
+        """
+        _check_batching_arguments(batch_size, bucket_window, token_budget)
+
+        def source_batches(dataset: Dataset) -> Iterator[Dataset]:
+            return iter(dataset.batch_dataset(
+                batch_size, bucket_window=bucket_window,
+                token_budget=token_budget))
+
+        batches = [source_batches(dataset) for dataset in self.datasets]
+        epoch_size = len(self)
+        seen_instances = 0
+
+        while seen_instances < epoch_size:
+            source = np.random.choice(len(self.datasets),
+                                      p=self.probabilities)
+            batch = next(batches[source], None)
+
+            if batch is None:
+                dataset = self.datasets[source]
+                dataset.shuffle()
+                batches[source] = source_batches(dataset)
+                batch = next(batches[source], None)
+                if batch is None:
+                    raise ValueError("Source dataset '{}' is empty."
+                                     .format(dataset.name))
+
+            seen_instances += len(batch)
+            yield batch
+
+    def add_series(self, name: str, series: Iterable[Any]) -> None:
+        raise NotImplementedError(
+            "Mixed dataset does not support adding series.")
+
+
+def _raw_lines(paths: List[str]) -> Iterator[bytes]:
+    """Read the raw lines of text files which may be compressed.
+
+    The lines are not parsed, they are used by the shards of datasets which
+    are not indexed and by the parallel parsing of the series.
+    """
+    for path in paths:
+        for lines in read_line_batches(path):
+            yield from lines
+
+
+def _buffered_shuffle(items: Iterable[Any], buffer_size: int,
+                      seed: int) -> Iterable[Any]:
+    """Approximately shuffle a stream of items using a bounded buffer.
+
+    The buffer is filled with the first items. Then, for each of the next
+    items, a random item from the buffer is yielded and replaced by it.
+    Finally, the rest of the buffer is yielded in a random order. The order
+    depends only on the seed and the number of items, so streams of the same
+    length shuffled with the same seed are shuffled in the same way.
+
+    Arguments:
+        items: The stream of items.
+        buffer_size: The number of items held in the memory.
+        seed: Seed of the random generator.
+
+    Returns:
+        Generator yielding the shuffled items.
+    """
+    rng = random.Random(seed)
+    buffer = []  # type: List[Any]
+    for item in items:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+            continue
+        index = rng.randrange(buffer_size)
+        yield buffer[index]
+        buffer[index] = item
+
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+def _shard_bounds(length: int, index: int, count: int) -> Tuple[int, int]:
+    """Get the range of instances of a shard.
+
+    Arguments:
+        length: The number of instances.
+        index: The index of the shard.
+        count: The number of shards.
+
+    Returns:
+        The start and end of the shard.
+
+    Raises:
+        ValueError if the shard index or count is invalid.
+    """
+    if count < 1:
+        raise ValueError("Number of shards must be positive, was {}."
+                         .format(count))
+    if not 0 <= index < count:
+        raise ValueError("Shard index must be between 0 and {}, was {}."
+                         .format(count - 1, index))
+    return length * index // count, length * (index + 1) // count
+
+
+def _shard_name(name: str, index: int, count: int) -> str:
+    return "{}-shard-{}-of-{}".format(name, index, count)
+
+
+def _shard_outputs(series_outputs: Dict[str, str],
+                   index: int) -> Dict[str, str]:
+    return {name: "{}.{}".format(path, index)
+            for name, path in series_outputs.items()}
+
+
+def _check_batching_arguments(batch_size: Optional[int],
+                              bucket_window: Optional[int],
+                              token_budget: Optional[int]) -> None:
+    if batch_size is None and token_budget is None:
+        raise ValueError("Either batch size or token budget must be set.")
+    if bucket_window is not None and batch_size is None:
+        raise ValueError("Bucketing requires the batch size to be set.")
+
+
+def _series_lengths(series: Any) -> Optional[np.ndarray]:
+    """Get the lengths of the items of a series of sequences.
+
+    Arguments:
+        series: An in-memory data series.
+
+    Returns:
+        Array of the item lengths or None if the items are not sequences
+        (e.g. numpy arrays with images).
+    """
+    if isinstance(series, InternedSeries):
+        return series.lengths
+    if (series is None or isinstance(series, np.ndarray) or not series
+            or not isinstance(series[0], (list, tuple))):
+        return None
+    return np.array([len(item) for item in series], dtype=np.int64)
+
+
+def _instance_lengths(instance: Tuple) -> Tuple[int, ...]:
+    """Get the lengths of the sequence items of a dataset instance.
+
+    Items which are not sequences (e.g. numpy arrays with images) are ignored.
+
+    Arguments:
+        instance: A tuple of items of all series for a single data point.
+
+    Returns:
+        Tuple of lengths of the sequence items.
+    """
+    return tuple(len(item) for item in instance
+                 if isinstance(item, (list, tuple)))
+
+
+def _batch_instances(instances: Iterable[Any],
+                     batch_size: Optional[int],
+                     token_budget: Optional[int],
+                     lengths: Callable[[Any], Tuple[int, ...]]=
+                     _instance_lengths) -> Iterable[List[Any]]:
+    """Group consecutive instances into batches.
+
+    A batch is closed when it has ``batch_size`` instances or when adding the
+    next instance would make the number of padded tokens exceed the
+    ``token_budget``. An instance which alone exceeds the budget forms a batch
+    of its own.
+
+    Arguments:
+        instances: Iterable of dataset instances (tuples of series items or
+            indices of instances).
+        batch_size: The maximum number of instances in a batch or None.
+        token_budget: The maximum number of padded tokens or None.
+        lengths: Function returning the sequence lengths of an instance.
+
+    Returns:
+        Generator yielding lists of instances.
+    """
+    batch = []  # type: List[Any]
+    batch_max_len = 0
+    for instance in instances:
+        length = max(lengths(instance), default=1)
+        new_max_len = max(batch_max_len, length)
+
+        if batch and (
+                (batch_size is not None and len(batch) >= batch_size) or
+                (token_budget is not None and
+                 (len(batch) + 1) * new_max_len > token_budget)):
+            yield batch
+            batch = []
+            new_max_len = length
+
+        batch.append(instance)
+        batch_max_len = new_max_len
+    if batch:
+        yield batch
+
+
+# pylint: disable=too-many-arguments
+def _bucket_instances(instances: Iterable[Any], batch_size: int,
+                      bucket_window: int,
+                      token_budget: Optional[int]=None,
+                      lengths: Callable[[Any], Tuple[int, ...]]=
+                      _instance_lengths) -> Iterable[List[Any]]:
+    """Group instances into batches of instances of similar lengths.
+
+    Arguments:
+        instances: Iterable of dataset instances (tuples of series items or
+            indices of instances).
+        batch_size: The size of a batch.
+        bucket_window: How many batches are sorted together.
+        token_budget: The maximum number of padded tokens in a batch or None.
+        lengths: Function returning the sequence lengths of an instance.
+
+    Returns:
+        Generator yielding lists of instances.
+    """
+    if bucket_window < 1:
+        raise ValueError("Bucket window must be positive, was {}."
+                         .format(bucket_window))
+
+    window = []  # type: List[Any]
+    for instance in instances:
+        window.append(instance)
+        if len(window) >= batch_size * bucket_window:
+            yield from _sorted_batches(window, batch_size, token_budget,
+                                       lengths)
+            window = []
+    if window:
+        yield from _sorted_batches(window, batch_size, token_budget, lengths)
+
+
+def _sorted_batches(window: List[Any], batch_size: int,
+                    token_budget: Optional[int],
+                    lengths: Callable[[Any], Tuple[int, ...]]) -> List[
+                        List[Any]]:
+    """Sort a window of instances by length and cut it into shuffled batches.
+
+    Arguments:
+        window: List of dataset instances.
+        batch_size: The size of a batch.
+        token_budget: The maximum number of padded tokens in a batch or None.
+        lengths: Function returning the sequence lengths of an instance.
+
+    Returns:
+        List of batches in a random order.
+    """
+    window.sort(key=lengths)
+    batches = list(_batch_instances(window, batch_size, token_budget,
+                                    lengths))
+    random.shuffle(batches)
+    return batches
+
+
 # pylint: disable=invalid-name
 DatasetPreprocess = Callable[[Dataset], Iterable[Any]]
 DatasetPostprocess = Callable[[Dataset, Dict[str, Iterable[Any]]],
@@ -285,6 +1148,13 @@ PREPROCESSED_SERIES = re.compile("pre_([^_]*)$")
 def load_dataset_from_files(
         name: str=None, lazy: bool=False,
         preprocessors: List[Tuple[str, str, Callable]]=None,
+        index: bool=False,
+        shuffle_buffer: int=0,
+        preprocess_workers: int=0,
+        cache_dir: Optional[str]=None,
+        shard_index: int=0,
+        shard_count: int=1,
+        intern_tokens: bool=False,
         **kwargs) -> Dataset:
 
     """Load a dataset from the files specified by the provided arguments.
@@ -294,9 +1164,34 @@ def load_dataset_from_files(
         name: The name of the dataset to use. If None (default), the name will
               be inferred from the file names.
         lazy: Boolean flag specifying whether to use lazy loading (useful for
-              large files). Note that the lazy dataset cannot be shuffled.
-              Defaults to False.
+              large files). Note that the lazy dataset cannot be shuffled
+              unless it is indexed. Defaults to False.
         preprocessor: A callable used for preprocessing of the input sentences.
+        index: Flag whether to build (or load cached) line indices of the
+               files of a lazy dataset. The indexed lazy dataset knows its
+               length and can be shuffled. Defaults to False.
+        shuffle_buffer: Size of the buffer used to shuffle a lazy dataset
+               which is not indexed. Defaults to 0 (no shuffling).
+        preprocess_workers: Number of worker processes used to load an
+               in-memory dataset. The lines of plain text files are parsed,
+               and the preprocessors and dataset-level preprocessors are
+               applied in chunks in parallel. The dataset-level preprocessors
+               must then process the instances independently of each other.
+               Defaults to 0 (everything is done in the main process).
+        cache_dir: Directory with the on-disk cache of the preprocessed
+               series. The cached series are used as long as the input files,
+               the readers and the preprocessors (including their parameters,
+               e.g. BPE merges) stay the same. Defaults to None (no caching).
+        shard_index: Index of the shard of the data to load (see
+               ``Dataset.shard``). Defaults to 0.
+        shard_count: Number of shards the data are split into. An in-memory
+               dataset preprocesses only the instances of its shard.
+               Defaults to 1 (no sharding).
+        intern_tokens: Flag whether an in-memory dataset stores the
+               tokenized series compactly as arrays of indices into a table
+               of distinct tokens (see ``neuralmonkey.interned_series``).
+               The items of the series are still read as lists of tokens.
+               Defaults to False.
         kwargs: Dataset keyword argument specs. These parameters should begin
                 with 's_' prefix and may end with '_out' suffix.  For example,
                 a data series 'source' which specify the source sentences
@@ -330,14 +1225,50 @@ def load_dataset_from_files(
     if name is None:
         name = _get_name_from_paths(series_paths_and_readers)
 
+    if index and not lazy:
+        warn("Indexing has no effect on an in-memory dataset.")
+    if shuffle_buffer and not lazy:
+        warn("Shuffle buffer has no effect on an in-memory dataset.")
+    if preprocess_workers and lazy:
+        warn("Preprocessing workers have no effect on a lazy dataset.")
+    if intern_tokens and lazy:
+        warn("Interning tokens has no effect on a lazy dataset.")
+    table = StringTable() if intern_tokens and not lazy else None
+
     if lazy:
         dataset = LazyDataset(name, series_paths_and_readers, series_outputs,
-                              preprocessors)
+                              preprocessors, index=index,
+                              shuffle_buffer=shuffle_buffer,
+                              cache_dir=cache_dir)
         # type: Dataset
+        if shard_count > 1:
+            dataset = dataset.shard(shard_index, shard_count)
+        series_keys = {}  # type: Dict[str, Optional[str]]
+        if index:
+            log("Dataset length: {}".format(len(dataset)))
     else:
-        series = {key: list(reader(paths))
+        series = {key: _load_series(paths, reader, preprocess_workers,
+                                    table)
                   for key, (paths, reader) in series_paths_and_readers.items()}
 
+        series_keys = {}
+        if cache_dir is not None:
+            series_keys = {
+                key: _source_series_key(paths, reader)
+                for key, (paths, reader) in series_paths_and_readers.items()}
+
+        if shard_count > 1:
+            start, end = _shard_bounds(len(next(iter(series.values()))),
+                                       shard_index, shard_count)
+            series = {key: _shard_series(data, start, end)
+                      for key, data in series.items()}
+            shard_id = _shard_name("", shard_index, shard_count)
+            series_keys = {key: None if series_key is None
+                           else cache_key(series_key, shard_id)
+                           for key, series_key in series_keys.items()}
+            name = _shard_name(name, shard_index, shard_count)
+            series_outputs = _shard_outputs(series_outputs, shard_index)
+
         if preprocessors is not None:
             for src_id, tgt_id, function in preprocessors:
                 if src_id == tgt_id:
@@ -348,18 +1279,149 @@ def load_dataset_from_files(
                         ("The source series ({}) of the '{}' preprocessor "
                          "is not defined in the dataset.").format(
                              src_id, function.__name__))
-                series[tgt_id] = list(map(function, series[src_id]))
+                series_keys[tgt_id] = _derived_series_key(
+                    function, series_keys.get(src_id))
+                series[tgt_id] = _load_or_compute(
+                    cache_dir, series_keys[tgt_id],
+                    functools.partial(parallel_imap, function,
+                                      series[src_id], preprocess_workers),
+                    table)
 
         # pylint: disable=redefined-variable-type
         dataset = Dataset(name, series, series_outputs)
         # pylint: enable=redefined-variable-type
         log("Dataset length: {}".format(len(dataset)))
 
-    _preprocessed_datasets(dataset, kwargs)
+    _preprocessed_datasets(dataset, kwargs, preprocess_workers, cache_dir,
+                           series_keys, table)
 
     return dataset
 
 
+def _shard_series(data: Any, start: int, end: int) -> Any:
+    """Get a contiguous part of a loaded series.
+
+    The numpy arrays and the series compiled to vocabulary indices are not
+    copied.
+    """
+    if isinstance(data, TokenIdSeries):
+        return TokenIdSeries(data.ids, data.offsets[start:end + 1],
+                             data.table)
+    if isinstance(data, InternedSeries):
+        # copy the tokens of the shard, so the rest of the data is freed
+        return data[np.arange(start, end)]
+    return data[start:end]
+
+
+def _source_series_key(paths: List[str], reader: Reader) -> Optional[str]:
+    """Get the cache key of a series read from files.
+
+    Returns:
+        The key or None if the reader cannot be fingerprinted.
+    """
+    try:
+        return cache_key(object_fingerprint(reader),
+                         *[file_fingerprint(path) for path in paths])
+    except ValueError as exc:
+        warn("Series read from '{}' will not be cached: {}"
+             .format(", ".join(paths), exc))
+        return None
+
+
+def _derived_series_key(function: Callable,
+                        *source_keys: Optional[str]) -> Optional[str]:
+    """Get the cache key of a series computed by a preprocessor.
+
+    Arguments:
+        function: The preprocessor.
+        source_keys: Keys of the series the preprocessor depends on.
+
+    Returns:
+        The key or None if some of the source series is not cached or the
+        preprocessor cannot be fingerprinted.
+    """
+    if any(key is None for key in source_keys):
+        return None
+    try:
+        return cache_key(object_fingerprint(function),
+                         *cast(Tuple[str, ...], source_keys))
+    except ValueError as exc:
+        warn("Series preprocessed by {} will not be cached: {}"
+             .format(function, exc))
+        return None
+
+
+def _load_or_compute(cache_dir: Optional[str], key: Optional[str],
+                     compute: Callable[[], Iterable[Any]],
+                     table: Optional[StringTable]=None) -> Any:
+    """Load a series from the cache or compute it and store it there.
+
+    Arguments:
+        cache_dir: The cache directory or None if caching is disabled.
+        key: The key of the series or None if it cannot be cached.
+        compute: Function computing the series.
+        table: The token table if the series is interned, None otherwise.
+
+    Returns:
+        The series.
+    """
+    if cache_dir is None or key is None:
+        return _collect_series(compute(), table)
+
+    cached = load_cached_series(cache_dir, key)
+    if cached is not None:
+        return _collect_series(cached, table)
+
+    series = _collect_series(compute(), table)
+    save_cached_series(cache_dir, key, series)
+    return series
+
+
+def _collect_series(items: Iterable[Any],
+                    table: Optional[StringTable]) -> Any:
+    """Store the items of a series in the memory.
+
+    Arguments:
+        items: The items of the series.
+        table: The token table if the series is interned, None otherwise.
+
+    Returns:
+        The interned series or a list of the items.
+    """
+    if table is None:
+        return list(items)
+    return intern_series(items, table)
+
+
+def _load_series(paths: List[str], reader: Reader, num_workers: int,
+                 table: Optional[StringTable]=None) -> Iterable[Any]:
+    """Load series data to the memory.
+
+    Numpy arrays (which may be memory-mapped) and series compiled to
+    vocabulary indices are kept in their compact form, other data are
+    converted to lists or interned. If the reader can parse single lines,
+    the lines are parsed by the worker processes.
+
+    Arguments:
+        paths: The files of the series.
+        reader: The reader of the series.
+        num_workers: Number of worker processes.
+        table: The token table if the series is interned, None otherwise.
+
+    Returns:
+        The loaded series.
+    """
+    if num_workers > 0 and hasattr(reader, "parse_line"):
+        return _collect_series(
+            parallel_imap(reader.parse_line,  # type: ignore
+                          _raw_lines(paths), num_workers), table)
+
+    data = reader(paths)
+    if isinstance(data, (np.ndarray, ShardedArray, TokenIdSeries)):
+        return data
+    return _collect_series(data, table)
+
+
 def _get_name_from_paths(series_paths: Dict[str, Tuple[List[str],
                                                        Reader]]) -> str:
     """Construct name for a dataset using the paths to its files.
@@ -443,8 +1505,21 @@ def _get_series_outputs(series_config: SeriesConfig) -> Dict[str, str]:
 
 def _preprocessed_datasets(
         dataset: Dataset,
-        series_config: SeriesConfig) -> None:
-    """Apply dataset-level preprocessing."""
+        series_config: SeriesConfig,
+        num_workers: int=0,
+        cache_dir: Optional[str]=None,
+        series_keys: Optional[Dict[str, Optional[str]]]=None,
+        table: Optional[StringTable]=None) -> None:
+    """Apply dataset-level preprocessing.
+
+    If the cache directory is set, the new series of an in-memory dataset
+    are cached under a key derived from all series of the dataset (given by
+    ``series_keys``). If the token table is given, the new series are
+    interned.
+    """
+    if series_keys is None:
+        series_keys = {}
+
     keys = [key for key in series_config.keys()
             if PREPROCESSED_SERIES.match(key)]
 
@@ -453,7 +1528,51 @@ def _preprocessed_datasets(
         preprocessor = cast(DatasetPreprocess, series_config[key])
 
         if isinstance(dataset, Dataset):
-            new_series = list(preprocessor(dataset))
+            series_keys[name] = _derived_series_key(
+                preprocessor, *[series_keys.get(series_id)
+                                for series_id in sorted(dataset.series_ids)])
+            new_series = _load_or_compute(
+                cache_dir, series_keys[name],
+                functools.partial(_apply_dataset_preprocessor, dataset,
+                                  preprocessor, num_workers),
+                table)
             dataset.add_series(name, new_series)
         elif isinstance(dataset, LazyDataset):
             dataset.preprocess_series[name] = (None, preprocessor)
+
+
+def _apply_dataset_preprocessor(dataset: Dataset,
+                                preprocessor: DatasetPreprocess,
+                                num_workers: int) -> List[Any]:
+    """Apply a dataset-level preprocessor to an in-memory dataset.
+
+    If there are worker processes, the dataset is split into chunks which
+    are preprocessed in parallel. The chunks are views of the dataset
+    created before the workers are forked, so only the results are sent
+    between the processes. When the workers cannot be forked, the chunks
+    are pickled with the preprocessor, so they are processed in parallel
+    if the preprocessor can be pickled.
+
+    Arguments:
+        dataset: The in-memory dataset.
+        preprocessor: The preprocessor. If it runs in parallel, it must
+            process the instances independently.
+        num_workers: Number of worker processes.
+
+    Returns:
+        The new series.
+    """
+    if num_workers == 0:
+        return list(preprocessor(dataset))
+
+    chunks = list(dataset.batch_dataset(DEFAULT_CHUNK_SIZE))
+    processed_chunks = parallel_map(
+        functools.partial(_preprocess_chunk, preprocessor, chunks),
+        range(len(chunks)), num_workers, chunk_size=1)
+    return [item for chunk in processed_chunks for item in chunk]
+
+
+def _preprocess_chunk(preprocessor: DatasetPreprocess,
+                      chunks: List[Dataset],
+                      index: int) -> List[Any]:
+    return list(preprocessor(chunks[index]))
@@ -6,11 +6,12 @@ import tensorflow as tf
 from typeguard import check_argument_types
 
 from neuralmonkey.dataset import Dataset
-from neuralmonkey.vocabulary import Vocabulary, START_TOKEN
+from neuralmonkey.vocabulary import Vocabulary, START_TOKEN, END_TOKEN_INDEX
 from neuralmonkey.model.model_part import ModelPart, FeedDict
 from neuralmonkey.logging import log, warn
 from neuralmonkey.nn.utils import dropout
 from neuralmonkey.encoders.attentive import Attentive
+from neuralmonkey.decoding_function import Attention, CoverageAttention
 from neuralmonkey.nn.projection import linear
 from neuralmonkey.decoders.encoder_projection import (
     linear_encoder_projection, concat_encoder_projection, empty_initial_state)
@@ -45,6 +46,7 @@ class Decoder(ModelPart):
                  attention_on_input: bool=True,
                  rnn_cell: str='GRU',
                  conditional_gru: bool=False,
+                 max_length_ratio: Optional[float]=None,
                  save_checkpoint: Optional[str]=None,
                  load_checkpoint: Optional[str]=None) -> None:
         """Create a refactored version of monster decoder.
@@ -73,6 +75,9 @@ class Decoder(ModelPart):
                 architecture
             attention_on_input: Flag whether attention from previous decoding
                 step should be combined with the input in the next step.
+            max_length_ratio: Limit of the length of the greedily decoded
+                outputs relative to the longest input sentence in the batch
+                (the outputs are never longer than max_output_len).
         """
         ModelPart.__init__(self, name, save_checkpoint, load_checkpoint)
         log("Initializing decoder, name: '{}'".format(name))
@@ -90,6 +95,7 @@ class Decoder(ModelPart):
         self.encoder_projection = encoder_projection
         self.use_attention = use_attention
         self.embeddings_encoder = embeddings_encoder
+        self.max_length_ratio = max_length_ratio
         self._rnn_cell = rnn_cell
 
         if self.embedding_size is None and self.embeddings_encoder is None:
@@ -190,6 +196,29 @@ class Decoder(ModelPart):
 
             self.hidden_states = self.runtime_rnn_outputs
 
+            # fetch attention objects for the incremental decoding
+            self._step_attention_objects = {}
+            # type: Dict[Attentive, tf.Tensor]
+            if self.use_attention:
+                self._step_attention_objects = {
+                    e: e.create_attention_object()
+                    for e in self.encoders
+                    if isinstance(e, Attentive)}
+
+            self._create_step_graph(attention_on_input, conditional_gru)
+
+            # fetch attention objects for the greedy decoding loop
+            self._greedy_attention_objects = {}
+            # type: Dict[Attentive, tf.Tensor]
+            if self.use_attention:
+                self._greedy_attention_objects = {
+                    e: e.create_attention_object()
+                    for e in self.encoders
+                    if isinstance(e, Attentive)}
+
+            self._create_greedy_graph(embedded_go_symbols,
+                                      attention_on_input, conditional_gru)
+
             def decode(rnn_outputs):
                 with tf.name_scope("output_projection"):
                     logits = []
@@ -382,40 +411,253 @@ class Decoder(ModelPart):
                         prev_word_index = tf.argmax(out_activation, 1)
                         inp = self._embed_and_dropout(prev_word_index)
 
-                # Merge input and previous attentions into one vector of the
-                # right size.
-                if attention_on_input:
-                    x = linear([inp] + attns, self.embedding_size)
-                else:
-                    x = inp
+                output, state, attns = self._decoder_step(
+                    cell, inp, state, attns, att_objects,
+                    attention_on_input, conditional_gru)
+
+                states.append(state)
+                prev = output
+                outputs.append(output)
 
-                # Run the RNN.
-                cell_output, state = cell(x, state)
+        return outputs, states
 
-                # Run the attention mechanism.
-                attns = [a.attention(cell_output) for a in att_objects]
+    # pylint: disable=too-many-arguments
+    def _decoder_step(
+            self,
+            cell: tf.nn.rnn_cell.RNNCell,
+            inp: tf.Tensor,
+            state: Any,
+            attns: List[tf.Tensor],
+            att_objects: List[Attention],
+            attention_on_input: bool,
+            conditional_gru: bool) -> Tuple[tf.Tensor, Any, List[tf.Tensor]]:
+        """Construct a single step of the decoder RNN.
 
-                if conditional_gru:
-                    x_2 = linear(
-                        attns, self.embedding_size, scope="cond_gru_2_linproj")
-                    # Run the RNN for the second time
-                    cell_output, state = cell(
-                        x_2, state, scope="cond_gru_2_cell")
+        Arguments:
+            cell: The RNN cell of the decoder.
+            inp: The embedded input of the step.
+            state: The RNN state from the previous step.
+            attns: The attention context vectors from the previous step.
+            att_objects: The attention objects of the encoders.
+            attention_on_input: Flag whether attention from previous time step
+                is fed to the input in the next step.
+            conditional_gru: Flag that enables conditional GRU architecture
 
-                states.append(state)
+        Returns:
+            The output of the step, the new RNN state and the new attention
+            context vectors.
+        """
+        # Merge input and previous attentions into one vector of the
+        # right size.
+        if attention_on_input:
+            x = linear([inp] + attns, self.embedding_size)
+        else:
+            x = inp
+
+        # Run the RNN.
+        cell_output, state = cell(x, state)
+
+        # Run the attention mechanism.
+        attns = [a.attention(cell_output) for a in att_objects]
+
+        if conditional_gru:
+            x_2 = linear(
+                attns, self.embedding_size, scope="cond_gru_2_linproj")
+            # Run the RNN for the second time
+            cell_output, state = cell(
+                x_2, state, scope="cond_gru_2_cell")
+
+        with tf.name_scope("rnn_output_projection"):
+            if attns:
+                output = linear([cell_output] + attns,
+                                cell.output_size,
+                                scope="AttnOutputProjection")
+            else:
+                output = cell_output
 
-                with tf.name_scope("rnn_output_projection"):
-                    if attns:
-                        output = linear([cell_output] + attns,
-                                        cell.output_size,
-                                        scope="AttnOutputProjection")
-                    else:
-                        output = cell_output
+        return output, state, attns
 
-                prev = output
-                outputs.append(output)
+    def _create_step_graph(self, attention_on_input: bool,
+                           conditional_gru: bool) -> None:
+        """Construct a single decoder step for the incremental decoding.
 
-        return outputs, states
+        The step takes the previous word, the RNN state and the attention
+        context vectors and returns the distribution of the next word and the
+        new state, so the beam search does not run the decoder over the whole
+        prefix of the hypotheses in every step. The state placeholders default
+        to the initial state, so the first step is computed from the encoders.
+        In the following steps, the tensors in ``step_cache`` (the attention
+        states and their precomputed projections) are fed with their values
+        from the first step, so the encoders are not run again.
+
+        The coverage of the coverage attention objects is a part of the state.
+        """
+        att_objects = [self._step_attention_objects.get(e)
+                       for e in self.encoders]
+        att_objects = [a for a in att_objects if a is not None]
+
+        self.step_cache = []  # type: List[tf.Tensor]
+        for att in att_objects:
+            self.step_cache.extend([att.attention_states,
+                                    att.hidden_features])
+            if isinstance(att.input_weights, tf.Tensor):
+                self.step_cache.append(att.input_weights)
+
+        self.step_inputs = tf.placeholder_with_default(
+            self.go_symbols[0], shape=[None], name="decoder_step_inputs")
+
+        if self._rnn_cell == 'GRU':
+            rnn_state = [tf.placeholder_with_default(
+                self.initial_state, shape=[None, self.rnn_size],
+                name="decoder_step_state")]
+            state = rnn_state[0]
+        else:
+            rnn_state = [
+                tf.placeholder_with_default(
+                    self.initial_state, shape=[None, self.rnn_size],
+                    name="decoder_step_state_{}".format(part))
+                for part in "ch"]
+            state = tf.nn.rnn_cell.LSTMStateTuple(*rnn_state)
+
+        attns = [
+            tf.placeholder_with_default(
+                tf.zeros([self.batch_size, a.attn_size]),
+                shape=[None, a.attn_size], name="decoder_step_attention")
+            for a in att_objects]
+
+        coverages = []
+        for att in att_objects:
+            if isinstance(att, CoverageAttention):
+                # the coverage attention sums the attentions in time
+                coverage = tf.placeholder_with_default(
+                    tf.zeros(tf.shape(att.attention_states)[:2]),
+                    shape=[None, None], name="decoder_step_coverage")
+                att.attentions_in_time.append(coverage)
+                coverages.append(coverage)
+
+        cell = self._get_rnn_cell()
+        with tf.variable_scope("attention_decoder"):
+            output, next_state, next_attns = self._decoder_step(
+                cell, self._embed_and_dropout(self.step_inputs), state, attns,
+                att_objects, attention_on_input, conditional_gru)
+
+        with tf.name_scope("output_projection"):
+            self.step_logprobs = tf.nn.log_softmax(
+                self._logit_function(output))
+
+        if self._rnn_cell == 'GRU':
+            next_rnn_state = [next_state]
+        else:
+            next_rnn_state = [next_state.c, next_state.h]
+
+        next_coverages = [sum(a.attentions_in_time) for a in att_objects
+                          if isinstance(a, CoverageAttention)]
+
+        self.step_state = rnn_state + attns + coverages
+        self.step_next_state = next_rnn_state + next_attns + next_coverages
+
+    def _create_greedy_graph(self, embedded_go_symbols: tf.Tensor,
+                             attention_on_input: bool,
+                             conditional_gru: bool) -> None:
+        """Construct the greedy decoding loop with a dynamic length.
+
+        Unlike the unrolled runtime decoder, the loop stops as soon as all
+        sentences in the batch have generated the end token, or when it
+        reaches the output length limit of the batch. The distributions of
+        the output words are in ``greedy_logprobs``, a tensor of shape
+        (time, batch, vocabulary).
+        """
+        att_objects = [self._greedy_attention_objects.get(e)
+                       for e in self.encoders]
+        att_objects = [a for a in att_objects if a is not None]
+        coverage_objects = [a for a in att_objects
+                            if isinstance(a, CoverageAttention)]
+
+        cell = self._get_rnn_cell()
+
+        if self._rnn_cell == 'GRU':
+            initial_state = self.initial_state
+        else:
+            initial_state = tf.nn.rnn_cell.LSTMStateTuple(
+                self.initial_state, self.initial_state)
+
+        initial_attns = [tf.zeros([self.batch_size, a.attn_size])
+                         for a in att_objects]
+        initial_coverages = [tf.zeros(tf.shape(a.attention_states)[:2])
+                             for a in coverage_objects]
+
+        length_limit = self._greedy_length_limit()
+
+        # pylint: disable=too-many-arguments
+        def loop_condition(step, inp, state, attns, coverages, finished,
+                           logprobs):
+            # pylint: disable=unused-argument
+            return tf.logical_and(step < length_limit,
+                                  tf.logical_not(tf.reduce_all(finished)))
+
+        def loop_body(step, inp, state, attns, coverages, finished,
+                      logprobs):
+            # the coverage attention sums the attentions in time
+            for att, coverage in zip(coverage_objects, coverages):
+                att.attentions_in_time.append(coverage)
+
+            output, next_state, next_attns = self._decoder_step(
+                cell, inp, state, list(attns), att_objects,
+                attention_on_input, conditional_gru)
+            next_coverages = [sum(a.attentions_in_time[-2:])
+                              for a in coverage_objects]
+
+            with tf.name_scope("output_projection"):
+                step_logprobs = tf.nn.log_softmax(self._logit_function(output))
+            next_words = tf.argmax(step_logprobs, 1)
+
+            return (step + 1,
+                    self._embed_and_dropout(next_words),
+                    next_state,
+                    next_attns,
+                    next_coverages,
+                    tf.logical_or(finished,
+                                  tf.equal(next_words, END_TOKEN_INDEX)),
+                    logprobs.write(step, step_logprobs))
+        # pylint: enable=too-many-arguments
+
+        with tf.variable_scope("attention_decoder"):
+            loop_result = tf.while_loop(
+                loop_condition, loop_body,
+                [tf.constant(0),
+                 embedded_go_symbols[0],
+                 initial_state,
+                 initial_attns,
+                 initial_coverages,
+                 tf.zeros([self.batch_size], dtype=tf.bool),
+                 tf.TensorArray(tf.float32, size=0, dynamic_size=True)])
+
+        self.greedy_logprobs = loop_result[-1].pack()
+
+    def _greedy_length_limit(self) -> tf.Tensor:
+        """Get the maximum length of the greedily decoded batch.
+
+        The length is limited by ``max_output_len`` and if the
+        ``max_length_ratio`` is set, by its multiple of the length of the
+        longest input sentence.
+        """
+        length_limit = tf.constant(self.max_output_len)
+        if self.max_length_ratio is None:
+            return length_limit
+
+        source_lengths = [e.sentence_lengths for e in self.encoders
+                          if hasattr(e, "sentence_lengths")]
+        if not source_lengths:
+            raise ValueError("The max_length_ratio can be used only with "
+                             "encoders with the sentence lengths.")
+
+        longest_source = tf.reduce_max(
+            tf.pack([tf.to_float(tf.reduce_max(lengths))
+                     for lengths in source_lengths]))
+        return tf.minimum(
+            length_limit,
+            tf.maximum(1, tf.to_int32(tf.ceil(
+                self.max_length_ratio * longest_source))))
 
     def _visualize_attention(self):
         """Create image summaries with attentions"""
@@ -444,8 +686,6 @@ class Decoder(ModelPart):
             raise ValueError("When training, you must feed "
                              "reference sentences")
 
-        sentences_list = list(sentences) if sentences is not None else None
-
         fd = {}  # type: FeedDict
         fd[self.train_mode] = train
 
@@ -456,11 +696,11 @@ class Decoder(ModelPart):
         if sentences is not None:
             # train_mode=False, since we don't want to <unk>ize target words!
             inputs, weights = self.vocabulary.sentences_to_tensor(
-                sentences_list, self.max_output_len, train_mode=False,
+                sentences, self.max_output_len, train_mode=False,
                 add_start_symbol=False, add_end_symbol=True)
 
-            assert inputs.shape == (self.max_output_len, len(sentences_list))
-            assert weights.shape == (self.max_output_len, len(sentences_list))
+            assert inputs.shape == (self.max_output_len, len(dataset))
+            assert weights.shape == (self.max_output_len, len(dataset))
 
             fd[self.train_inputs] = inputs
             fd[self.train_padding] = weights
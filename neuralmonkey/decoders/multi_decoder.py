@@ -1,3 +1,5 @@
+import threading
+
 import tensorflow as tf
 import numpy as np
 
@@ -32,6 +34,11 @@ class MultiDecoder(object):
     because we often do not have the training data that cover all tasks in one
     corpus.
 
+    The decoders are scheduled in a round-robin fashion, skipping the
+    decoders whose series are not in the batch. When the training data is a
+    ``MixedDataset`` streaming from separate corpora for the tasks, each
+    batch is thus used for the task of the corpus it comes from.
+
     """
 
     def __init__(self, main_decoder, regularization_decoders):
@@ -53,6 +60,8 @@ class MultiDecoder(object):
                                             for d in self._training_decoders])
 
         self._scheduled_decoder = 0
+        # the feed dicts can be prepared in a background thread
+        self._schedule_lock = threading.Lock()
         self._input_selector = tf.placeholder(tf.float32,
                                               [len(self._training_decoders)],
                                               name="input_decoder_selector")
@@ -124,9 +133,17 @@ class MultiDecoder(object):
 
         # pylint: disable=invalid-name
         # fd stands for feed_dict
+        with self._schedule_lock:
+            self._schedule_decoder(dataset)
+            scheduled_decoder = self._scheduled_decoder
+
+            # Schedule update
+            self._scheduled_decoder = ((self._scheduled_decoder + 1)
+                                       % len(self._training_decoders))
+
         fd = {}
         for i, decoder in enumerate(self._training_decoders):
-            if i == self._scheduled_decoder:
+            if i == scheduled_decoder:
                 fd_i = decoder.feed_dict(dataset, train=train)
             else:
                 # serie is a generator of lists of words (i.e. sentences)
@@ -138,11 +155,20 @@ class MultiDecoder(object):
         # We now need to set the value of our input_selector placeholder
         # as well.
         input_selector_value = np.zeros(len(self._training_decoders))
-        input_selector_value[self._scheduled_decoder] = 1
+        input_selector_value[scheduled_decoder] = 1
         fd[self._input_selector] = input_selector_value
 
-        # Schedule update
-        self._scheduled_decoder = ((self._scheduled_decoder + 1)
-                                   % len(self._training_decoders))
-
         return fd
+
+    def _schedule_decoder(self, dataset: Dataset) -> None:
+        """Skip the scheduled decoders without the series in the dataset.
+
+        If none of the decoders has its series in the dataset (e.g. at
+        inference time), the schedule is not changed.
+        """
+        for _ in range(len(self._training_decoders)):
+            decoder = self._training_decoders[self._scheduled_decoder]
+            if dataset.has_series(decoder.data_id):
+                return
+            self._scheduled_decoder = ((self._scheduled_decoder + 1)
+                                       % len(self._training_decoders))
@@ -101,12 +101,10 @@ class SequenceClassifier(ModelPart):
         sentences = cast(Iterable[List[str]],
                          dataset.get_series(self.data_id, allow_none=True))
 
-        sentences_list = list(sentences) if sentences is not None else None
-
         fd = {}  # type: FeedDict
 
         label_tensors, _ = self.vocabulary.sentences_to_tensor(
-            sentences_list, self.max_output_len)
+            sentences, self.max_output_len)
 
         fd[self.gt_inputs[0]] = label_tensors[0]
 
@@ -89,9 +89,8 @@ class SequenceLabeler(ModelPart):
                          dataset.get_series(self.data_id, allow_none=True))
 
         if sentences is not None:
-            sentences_list = list(sentences) if sentences is not None else None
             inputs, weights = self.vocabulary.sentences_to_tensor(
-                sentences_list, self.max_output_len)
+                sentences, self.max_output_len)
 
             assert len(weights) == len(self.train_weights)
             assert len(inputs) == len(self.train_targets)
@@ -24,9 +24,12 @@ class CNNEncoder(ModelPart, Attentive):
     encode the image into a single vector.
 
     Attributes:
-        input_op: Placeholder for the batch of input images
-        padding_masks: Placeholder for matrices capturing telling where the
-            image has been padded.
+        image_input: Placeholder for the batch of input images in their
+            original data type.
+        input_op: The batch of input images converted to float32 and
+            normalized.
+        padding_masks: Matrices capturing telling where the image has been
+            padded.
         image_processing_layers: List of TensorFlow operator that are
             visualizable image transformations.
         encoded: Operator that returns a batch of ecodede image (intended
@@ -48,6 +51,7 @@ class CNNEncoder(ModelPart, Attentive):
                  local_response_normalization: bool=True,
                  dropout_keep_prob: float=0.5,
                  attention_type: Type=Attention,
+                 image_dtype: str="float32",
                  save_checkpoint: Optional[str]=None,
                  load_checkpoint: Optional[str]=None) -> None:
         """Initialize a convolutional network for image processing.
@@ -69,6 +73,10 @@ class CNNEncoder(ModelPart, Attentive):
             dropout_keep_prob: Probability of keeping neurons active in
                 dropout. Dropout is done between all convolutional layers and
                 fully connected layer.
+            image_dtype: Data type of the fed images. With 8-bit images
+                (e.g. from the image reader in the RGB or L mode), use uint8
+                so the images are fed without conversion. The images are
+                converted to float32 and normalized in the graph.
         """
         ModelPart.__init__(self, name, save_checkpoint, load_checkpoint)
         Attentive.__init__(self, attention_type)
@@ -81,15 +89,18 @@ class CNNEncoder(ModelPart, Attentive):
                 tf.float32, name="dropout")
             self.train_mode = tf.placeholder(tf.bool, shape=[],
                                              name="mode_placeholder")
-            self.input_op = tf.placeholder(
-                tf.float32,
+            self.image_input = tf.placeholder(
+                tf.as_dtype(image_dtype),
                 shape=(None, image_height, image_width, pixel_dim),
                 name="input_images")
 
-            self.padding_masks = tf.placeholder(
-                tf.float32,
-                shape=(None, image_height, image_width, 1),
-                name="padding_masks")
+            images = tf.to_float(self.image_input)
+            self.input_op = images / 225.0
+
+            # it is one everywhere where non-zero, i.e. zero columns are
+            # masked out
+            self.padding_masks = tf.reduce_sum(
+                tf.sign(images), [3], keep_dims=True)
 
             last_layer = self.input_op
             last_padding_masks = self.padding_masks
@@ -159,15 +170,11 @@ class CNNEncoder(ModelPart, Attentive):
 
     def feed_dict(self, dataset: Dataset, train: bool=False) -> FeedDict:
         # if it is from the pickled file, it is list, not numpy tensor,
-        # so convert it as as a prevention
-        images = np.array(dataset.get_series(self.data_id))
+        # so convert it as as a prevention (without copying an array)
+        images = np.asarray(dataset.get_series(self.data_id))
 
         f_dict = {}
-        f_dict[self.input_op] = images / 225.0
-
-        # it is one everywhere where non-zero, i.e. zero columns are masked out
-        f_dict[self.padding_masks] = \
-            np.sum(np.sign(images), axis=3, keepdims=True)
+        f_dict[self.image_input] = images
 
         if train:
             f_dict[self.dropout_placeholder] = self.dropout_keep_prob
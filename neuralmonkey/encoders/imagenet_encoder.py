@@ -163,7 +163,7 @@ class ImageNet(ModelPart, Attentive):
         return self.__attention_tensor
 
     def feed_dict(self, dataset: Dataset, train: bool=False) -> FeedDict:
-        images = np.array(dataset.get_series(self.data_id))
+        images = np.asarray(dataset.get_series(self.data_id))
         assert images.shape[1:] == (self.HEIGHT, self.WIDTH, 3)
 
         return {self.input_plc: images}
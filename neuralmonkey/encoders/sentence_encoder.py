@@ -209,7 +209,7 @@ class SentenceEncoder(ModelPart, Attentive):
         sentences = dataset.get_series(self.data_id)
 
         vectors, paddings = self.vocabulary.sentences_to_tensor(
-            list(sentences), self.max_input_len, pad_to_max_len=False,
+            sentences, self.max_input_len, pad_to_max_len=False,
             train_mode=train)
 
         # as sentences_to_tensor returns lists of shape (time, batch),
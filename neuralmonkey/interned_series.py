@@ -0,0 +1,204 @@
+"""Compact in-memory storage of tokenized series.
+
+A sentence stored as a Python list of strings costs tens of bytes per token.
+An interned series stores all sentences as a single int32 array of indices
+into a table of distinct tokens and an array of sentence offsets. The items
+of the series are still returned as lists of strings, so the readers,
+preprocessors and previews work with them as with any other series. The
+vocabulary maps the token table to its indices only once and then builds
+the batch tensors directly from the index arrays.
+"""
+
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union
+import array
+import collections.abc
+
+import numpy as np
+
+
+class StringTable(object):
+    """Table of distinct tokens shared by interned series.
+
+    Attributes:
+        words: The tokens in the order in which they were added.
+    """
+
+    def __init__(self, words: Iterable[Any]=()) -> None:
+        """Create a table.
+
+        Arguments:
+            words: Distinct tokens initially in the table.
+        """
+        self.words = []  # type: List[Any]
+        self._index = {}  # type: Dict[Any, int]
+        self._lookups = {}  # type: Dict[int, Tuple[Any, Tuple, np.ndarray]]
+        self.intern(list(words))
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def intern(self, tokens: List[Any]) -> List[int]:
+        """Get the indices of tokens, adding the new ones to the table."""
+        index = self._index
+        words = self.words
+        indices = []
+        for token in tokens:
+            token_index = index.get(token)
+            if token_index is None:
+                token_index = len(words)
+                index[token] = token_index
+                words.append(token)
+            indices.append(token_index)
+        return indices
+
+    def lookup(self, word_to_index: Dict[str, int],
+               default: int) -> np.ndarray:
+        """Map the table to indices of a vocabulary.
+
+        The mapping is cached until the table or the vocabulary change.
+
+        Arguments:
+            word_to_index: Mapping from the words to the vocabulary indices.
+            default: The index of the words missing in the vocabulary.
+
+        Returns:
+            Int32 array with the vocabulary index of each token of the table.
+        """
+        sizes = (len(word_to_index), len(self.words))
+        cached = self._lookups.get(id(word_to_index))
+        if (cached is None or cached[0] is not word_to_index
+                or cached[1] != sizes):
+            indices = np.array([word_to_index.get(word, default)
+                                for word in self.words], dtype=np.int32)
+            cached = (word_to_index, sizes, indices)
+            self._lookups[id(word_to_index)] = cached
+        return cached[2]
+
+
+class InternedSeries(collections.abc.Sequence):
+    """A series of sentences stored as indices into a string table.
+
+    The sentence ``i`` consists of the tokens with the table indices
+    ``ids[offsets[i]:offsets[i + 1]]``. Slices and index arrays select
+    sentences without converting them to strings.
+    """
+
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray,
+                 table: StringTable) -> None:
+        """Create a series from the flat index array and the offsets.
+
+        Arguments:
+            ids: One-dimensional int32 array of the token indices.
+            offsets: Array of the sentence start positions followed by the
+                end of the last sentence.
+            table: The table of the tokens.
+        """
+        self.ids = ids
+        self.offsets = offsets
+        self.table = table
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """Lengths of all sentences in the series."""
+        return np.diff(self.offsets)
+
+    def __getitem__(self, index: Any) -> Union[List[Any], 'InternedSeries']:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return InternedSeries(self.ids,
+                                      self.offsets[start:max(start, stop) + 1],
+                                      self.table)
+            index = np.arange(start, stop, step)
+        if isinstance(index, (list, np.ndarray)):
+            return self._gather(np.asarray(index, dtype=np.int64))
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Sentence index out of range.")
+        return self._sentence(self.offsets[index], self.offsets[index + 1])
+
+    def _sentence(self, start: int, end: int) -> List[Any]:
+        words = self.table.words
+        return [words[i] for i in self.ids[start:end].tolist()]
+
+    def token_positions(self, lengths: np.ndarray) -> np.ndarray:
+        """Get positions of the tokens of truncated sentences in ``ids``.
+
+        Arguments:
+            lengths: Number of tokens taken from each sentence, at most
+                its length.
+
+        Returns:
+            Array of the positions of the taken tokens of all sentences.
+        """
+        return _positions(self.offsets[:-1], lengths)
+
+    def _gather(self, indices: np.ndarray) -> 'InternedSeries':
+        indices = np.where(indices < 0, indices + len(self), indices)
+        if np.any((indices < 0) | (indices >= len(self))):
+            raise IndexError("Sentence indices out of range.")
+
+        starts = self.offsets[indices]
+        lengths = self.offsets[indices + 1] - starts
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return InternedSeries(self.ids[_positions(starts, lengths)],
+                              offsets, self.table)
+
+    def __iter__(self) -> Iterator[List[Any]]:
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            yield self._sentence(start, end)
+
+
+def intern_series(items: Iterable[Any], table: StringTable) -> Any:
+    """Store a series of tokenized sentences as an interned series.
+
+    The items are read in a single pass. If some of the items is not a list
+    of hashable tokens, the series is returned as a list instead.
+
+    Arguments:
+        items: The items of the series.
+        table: The table to which the tokens are added.
+
+    Returns:
+        The interned series or a list of the items.
+    """
+    ids = array.array("i")
+    offsets = array.array("q", [0])
+
+    iterator = iter(items)
+    for item in iterator:
+        try:
+            if not isinstance(item, list):
+                raise TypeError("Item is not a list.")
+            ids.extend(table.intern(item))
+        except TypeError:
+            interned = InternedSeries(np.array(ids, dtype=np.int32),
+                                      np.array(offsets, dtype=np.int64),
+                                      table)
+            return list(interned) + [item] + list(iterator)
+        offsets.append(len(ids))
+
+    return InternedSeries(np.array(ids, dtype=np.int32),
+                          np.array(offsets, dtype=np.int64), table)
+
+
+def _positions(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Get positions of the tokens of consecutive segments of an array.
+
+    Arguments:
+        starts: The start positions of the segments.
+        lengths: The lengths of the segments.
+
+    Returns:
+        Concatenated ranges ``starts[i]`` to ``starts[i] + lengths[i]``.
+    """
+    ends = np.cumsum(lengths)
+    return (np.arange(ends[-1] if len(ends) else 0) +
+            np.repeat(starts - (ends - lengths), lengths))
@@ -9,7 +9,7 @@ from termcolor import colored
 
 from neuralmonkey.logging import log, log_print, warn
 from neuralmonkey.dataset import Dataset, LazyDataset
-from neuralmonkey.tf_manager import TensorFlowManager
+from neuralmonkey.tf_manager import FeedDictPrefetcher, TensorFlowManager
 from neuralmonkey.runners.base_runner import BaseRunner, ExecutionResult
 from neuralmonkey.trainers.generic_trainer import GenericTrainer
 from neuralmonkey.tf_utils import gpu_memusage
@@ -45,7 +45,10 @@ def training_loop(tf_manager: TensorFlowManager,
                   runners_batch_size: Optional[int]=None,
                   initial_variables: Optional[Union[str, List[str]]]=None,
                   postprocess: Postprocess=None,
-                  minimize_metric: bool=False):
+                  minimize_metric: bool=False,
+                  bucket_window: Optional[int]=None,
+                  token_budget: Optional[int]=None,
+                  runners_token_budget: Optional[int]=None):
 
     # TODO finish the list
     """
@@ -67,6 +70,13 @@ def training_loop(tf_manager: TensorFlowManager,
             name of the dataset series the generated one is evaluated with and
             the evaluation function. If only one series names is provided, it
             means the generated and dataset series have the same name.
+        bucket_window: If set, training batches are created from windows of
+            this many batches sorted by the sentence lengths (see
+            ``Dataset.batch_dataset``).
+        token_budget: If set, the training batches are limited to this number
+            of padded tokens in addition to the batch size.
+        runners_token_budget: Token budget used when running the runners on
+            the validation and test data.
     """
     if validation_period < logging_period:
         raise AssertionError(
@@ -135,28 +145,51 @@ def training_loop(tf_manager: TensorFlowManager,
     best_score_batch_no = 0
 
     log("Starting training")
+    prepared_batches = None
     try:
         for epoch_n in range(1, epochs + 1):
             log_print("")
             log("Epoch {} starts".format(epoch_n), color='red')
 
             train_dataset.shuffle()
-            train_batched_datasets = train_dataset.batch_dataset(batch_size)
+            train_batched_datasets = train_dataset.batch_dataset(
+                batch_size, bucket_window=bucket_window,
+                token_budget=token_budget)
 
             if epoch_n == 1 and train_start_offset:
                 if not isinstance(train_dataset, LazyDataset):
                     warn("Not skipping training instances with "
                          "shuffled in-memory dataset")
+                elif train_dataset.indexed:
+                    # batches are read lazily, so the skipped instances
+                    # are not read at all
+                    log("Skipping first {} instances in the dataset"
+                        .format(train_start_offset))
+                    train_dataset.skip_instances(train_start_offset)
                 else:
                     _skip_lines(train_start_offset, train_batched_datasets)
 
-            for batch_n, batch_dataset in enumerate(train_batched_datasets):
+            # the feed dicts of the upcoming batches are prepared while the
+            # current one is trained on
+            prepared_batches = tf_manager.prefetch_feed_dicts(
+                train_batched_datasets, [trainer], train=True)
+
+            for batch_n, (batch_dataset, batch_feed_dict) in enumerate(
+                    prepared_batches):
                 step += 1
                 seen_instances += len(batch_dataset)
-                if step % logging_period == logging_period - 1:
+                evaluate_train = step % logging_period == logging_period - 1
+                validate = step % validation_period == validation_period - 1
+                if ((evaluate_train or validate)
+                        and isinstance(prepared_batches, FeedDictPrefetcher)):
+                    # the runners use the coders on this thread, so the
+                    # producer is paused at the same batch in every run
+                    prepared_batches.wait_until_idle()
+
+                if evaluate_train:
                     trainer_result = tf_manager.execute(
                         batch_dataset, [trainer], train=True,
-                        summaries=True)
+                        summaries=True, feed_dict=batch_feed_dict)
                     train_results, train_outputs = run_on_dataset(
                         tf_manager, runners, batch_dataset,
                         postprocess, write_out=False)
@@ -175,13 +208,15 @@ def training_loop(tf_manager: TensorFlowManager,
                                                train=True)
                 else:
                     tf_manager.execute(batch_dataset, [trainer],
-                                       train=True, summaries=False)
+                                       train=True, summaries=False,
+                                       feed_dict=batch_feed_dict)
 
-                if step % validation_period == validation_period - 1:
+                if validate:
                     val_results, val_outputs = run_on_dataset(
                         tf_manager, runners, val_dataset,
                         postprocess, write_out=False,
-                        batch_size=runners_batch_size)
+                        batch_size=runners_batch_size,
+                        token_budget=runners_token_budget)
                     # ensure val outputs are iterable more than once
                     val_outputs = {k: list(v) for k, v in val_outputs.items()}
                     val_evaluation = evaluation(
@@ -256,6 +291,9 @@ def training_loop(tf_manager: TensorFlowManager,
 
     except KeyboardInterrupt:
         log("Training interrupted by user.")
+    finally:
+        if prepared_batches is not None:
+            prepared_batches.close()
 
     log("Training finished. Maximum {} on validation data: {:.4g}, epoch {}"
         .format(main_metric, best_score, best_score_epoch))
@@ -266,7 +304,8 @@ def training_loop(tf_manager: TensorFlowManager,
     for dataset in test_datasets:
         test_results, test_outputs = run_on_dataset(
             tf_manager, runners, dataset, postprocess,
-            write_out=True, batch_size=runners_batch_size)
+            write_out=True, batch_size=runners_batch_size,
+            token_budget=runners_token_budget)
         # ensure test outputs are iterable more than once
         test_outputs = {k: list(v) for k, v in test_outputs.items()}
         eval_result = evaluation(evaluators, dataset, runners,
@@ -301,7 +340,9 @@ def run_on_dataset(tf_manager: TensorFlowManager,
                    dataset: Dataset,
                    postprocess: Postprocess,
                    write_out: bool=False,
-                   batch_size: Optional[int]=None) \
+                   batch_size: Optional[int]=None,
+                   token_budget: Optional[int]=None,
+                   summaries: bool=True) \
                                                 -> Tuple[List[ExecutionResult],
                                                          Dict[str, List[Any]]]:
     """Apply the model on a dataset and optionally write outputs to files.
@@ -315,6 +356,15 @@ def run_on_dataset(tf_manager: TensorFlowManager,
         postprocess: an object to use as postprocessing of the
         write_out: Flag whether the outputs should be printed to a file defined
             in the dataset object.
+        batch_size: Maximum number of instances in a batch. If neither this
+            nor the token budget is set, the whole dataset is one batch.
+        token_budget: Maximum number of padded tokens in a batch.
+        summaries: Flag whether the runners should compute the summaries.
+            Without the summaries, the greedy runners decode in a loop
+            which stops after the end tokens. This happens only if the
+            dataset has no references, though. With the references, the
+            losses are computed, which needs the decoder unrolled to its
+            maximum output length.
 
         extra_fetches: Extra tensors to evaluate for each batch.
 
@@ -328,7 +378,9 @@ def run_on_dataset(tf_manager: TensorFlowManager,
 
     all_results = tf_manager.execute(dataset, runners,
                                      compute_losses=contains_targets,
-                                     batch_size=batch_size)
+                                     summaries=summaries,
+                                     batch_size=batch_size,
+                                     token_budget=token_budget)
 
     result_data = {runner.output_series: result.outputs
                    for runner, result in zip(runners, all_results)}
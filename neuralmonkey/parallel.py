@@ -0,0 +1,225 @@
+"""Order-preserving parallel map over a pool of worker processes.
+
+The workers are forked from the main process and inherit the mapped
+function, so it does not have to be picklable. This matters for the readers
+and preprocessors which are often closures or objects holding large tables
+(e.g. BPE merges). Only the items and the results are sent between the
+processes, in chunks of a given size, and the results are returned in the
+order of the items.
+
+Forking is safe only while the process runs no other threads than those
+present when this module was imported (e.g. the threads of the numerical
+libraries): a thread holding a lock at the time of the fork (a TensorFlow
+session, a prefetching or decompressing thread) would leave the lock locked
+in the child forever. When other threads run, the workers are started by
+a fork server instead if the function can be pickled, otherwise the items
+are processed in the calling process.
+"""
+
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Set
+import collections
+import concurrent.futures
+import multiprocessing
+import multiprocessing.context
+import os
+import pickle
+import threading
+
+# numpy is imported before the threads are recorded, so the threads of the
+# numerical libraries it loads do not prevent forking
+import numpy as np  # noqa: F401 pylint: disable=unused-import
+
+from neuralmonkey.logging import warn
+
+DEFAULT_CHUNK_SIZE = 1000
+
+# the function mapped by the current pool, set in the forked workers
+_WORKER_FUNCTION = None  # type: Optional[Callable[[Any], Any]]
+
+
+def _init_worker(function: Callable[[Any], Any]) -> None:
+    global _WORKER_FUNCTION  # pylint: disable=global-statement
+    _WORKER_FUNCTION = function
+
+
+def _apply_chunk(chunk: List[Any]) -> List[Any]:
+    return [_WORKER_FUNCTION(item) for item in chunk]  # type: ignore
+
+
+def _thread_ids() -> Set[int]:
+    """Get the identifiers of the threads of the process.
+
+    On Linux, the native threads (e.g. of TensorFlow) are included, on other
+    platforms only the Python threads are.
+    """
+    try:
+        return {int(thread) for thread in os.listdir("/proc/self/task")}
+    except OSError:
+        return {thread.ident for thread in threading.enumerate()
+                if thread.ident is not None}
+
+
+_STARTUP_THREADS = _thread_ids()
+
+
+def _pool_context(function: Callable[[Any], Any]) -> Optional[
+        multiprocessing.context.BaseContext]:
+    """Choose how to start the workers.
+
+    Arguments:
+        function: The function the workers apply.
+
+    Returns:
+        The multiprocessing context or None if the function must be applied
+        in the calling process.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    if "fork" in methods and _thread_ids() <= _STARTUP_THREADS:
+        return multiprocessing.get_context("fork")
+
+    try:
+        pickle.dumps(function)
+    # pylint: disable=broad-except
+    except Exception:
+        warn("Other threads are running, so worker processes cannot be "
+             "forked, and the function cannot be pickled. Processing data "
+             "in a single process.")
+        return None
+
+    if "forkserver" in methods:
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def _chunks(items: Iterable[Any], chunk_size: int) -> Iterator[List[Any]]:
+    chunk = []  # type: List[Any]
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _check_arguments(num_workers: int, chunk_size: int) -> None:
+    if num_workers < 0:
+        raise ValueError("Number of workers must be non-negative, was {}."
+                         .format(num_workers))
+    if chunk_size < 1:
+        raise ValueError("Chunk size must be positive, was {}."
+                         .format(chunk_size))
+
+
+def parallel_imap(function: Callable[[Any], Any],
+                  items: Iterable[Any],
+                  num_workers: int,
+                  chunk_size: int=DEFAULT_CHUNK_SIZE) -> Iterator[Any]:
+    """Lazily apply a function to items using a pool of processes.
+
+    At most two chunks per worker are processed ahead of the consumer, so
+    the results do not pile up in the memory. The pool is terminated when
+    the generator is exhausted or closed. The workers are forked only if no
+    other threads are running (see the module documentation).
+
+    Arguments:
+        function: The function to apply.
+        items: The items to process.
+        num_workers: Number of worker processes. If zero, the items are
+            processed in the calling process.
+        chunk_size: Number of items sent to a worker at once.
+
+    Returns:
+        Generator yielding the results in the order of the items.
+
+    Raises:
+        ValueError if the number of workers or the chunk size is invalid.
+    """
+    _check_arguments(num_workers, chunk_size)
+    if num_workers == 0:
+        yield from map(function, items)
+        return
+
+    context = _pool_context(function)
+    if context is None:
+        yield from map(function, items)
+        return
+
+    with context.Pool(num_workers, initializer=_init_worker,
+                      initargs=(function,)) as pool:
+        pending = collections.deque()  # type: collections.deque
+        for chunk in _chunks(items, chunk_size):
+            pending.append(pool.apply_async(_apply_chunk, (chunk,)))
+            if len(pending) >= 2 * num_workers:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+def parallel_map(function: Callable[[Any], Any],
+                 items: Iterable[Any],
+                 num_workers: int,
+                 chunk_size: int=DEFAULT_CHUNK_SIZE) -> List[Any]:
+    """Apply a function to all items using a pool of processes.
+
+    Arguments:
+        function: The function to apply.
+        items: The items to process.
+        num_workers: Number of worker processes. If zero, the items are
+            processed in the calling process.
+        chunk_size: Number of items sent to a worker at once.
+
+    Returns:
+        List of the results in the order of the items.
+
+    Raises:
+        ValueError if the number of workers or the chunk size is invalid.
+    """
+    return list(parallel_imap(function, items, num_workers, chunk_size))
+
+
+def threaded_imap(function: Callable[[Any], Any],
+                  items: Iterable[Any],
+                  num_threads: int,
+                  chunk_size: int=DEFAULT_CHUNK_SIZE) -> Iterator[Any]:
+    """Lazily apply a function to items using a pool of threads.
+
+    Unlike the worker processes, the threads can be used safely at any time,
+    e.g. during training, and the function does not have to be picklable.
+    The work runs in parallel only where the function releases the GIL, as
+    the image decoders do. The chunks are processed ahead of the consumer
+    in the same way as in ``parallel_imap``.
+
+    Arguments:
+        function: The function to apply.
+        items: The items to process.
+        num_threads: Number of threads. If zero, the items are processed in
+            the calling thread.
+        chunk_size: Number of items processed by a thread at once.
+
+    Returns:
+        Generator yielding the results in the order of the items.
+
+    Raises:
+        ValueError if the number of threads or the chunk size is invalid.
+    """
+    _check_arguments(num_threads, chunk_size)
+    if num_threads == 0:
+        yield from map(function, items)
+        return
+
+    def apply_chunk(chunk: List[Any]) -> List[Any]:
+        return [function(item) for item in chunk]
+
+    with concurrent.futures.ThreadPoolExecutor(num_threads) as executor:
+        pending = collections.deque()  # type: collections.deque
+        try:
+            for chunk in _chunks(items, chunk_size):
+                pending.append(executor.submit(apply_chunk, chunk))
+                if len(pending) >= 2 * num_threads:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
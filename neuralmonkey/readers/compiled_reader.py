@@ -0,0 +1,138 @@
+"""Reader of text compiled to vocabulary indices.
+
+On the first use, the reader tokenizes and preprocesses the text files and
+maps the tokens to vocabulary indices. The result is stored as a flat int32
+array of the token indices and an array of sentence offsets. The files are
+keyed by the fingerprints of the input files, the preprocessor and the
+vocabulary, so on subsequent runs they are only memory-mapped.
+"""
+
+from typing import Any, Callable, Iterable, List, Optional
+import os
+
+import numpy as np
+
+from neuralmonkey.caching import (cache_key, file_fingerprint,
+                                  object_fingerprint)
+from neuralmonkey.interned_series import InternedSeries, StringTable
+from neuralmonkey.logging import log
+from neuralmonkey.readers.plain_text_reader import get_plain_text_reader
+
+_WRITE_CHUNK = 100000
+
+
+class TokenIdSeries(InternedSeries):
+    """A series of sentences stored as vocabulary indices.
+
+    The series is interned in a table of the vocabulary words, so its items
+    are lists of tokens as in any other series (e.g. when it is used as
+    references of an evaluator), the words missing in the vocabulary are
+    read back as the unknown token. The ids array can be backed by
+    a memory-mapped file.
+    """
+
+
+def get_compiled_reader(vocabulary: Any,
+                        preprocess: Optional[Callable[[List[str]],
+                                                      List[str]]]=None,
+                        cache_dir: Optional[str]=None,
+                        encoding: str="utf-8") -> Callable:
+    """Get a reader of text compiled to the vocabulary indices.
+
+    The series produced by this reader store the indices instead of the
+    tokens. The encoders and decoders using the same vocabulary feed them
+    without touching the strings. The items of the series are still lists
+    of tokens, but the words missing in the vocabulary are replaced by the
+    unknown token, so the series should not be used as references of
+    evaluators.
+
+    Arguments:
+        vocabulary: The vocabulary used to map the tokens to indices.
+        preprocess: Optional preprocessor applied to the tokenized sentences
+            before the mapping.
+        cache_dir: Directory where the compiled files are stored. Defaults to
+            the directory of the first input file.
+        encoding: Encoding of the text files.
+
+    Returns:
+        The reader function that takes a list of paths and returns
+        a ``TokenIdSeries``.
+    """
+    text_reader = get_plain_text_reader(encoding)
+    vocabulary_key = object_fingerprint(vocabulary.index_to_word)
+    preprocess_key = object_fingerprint(preprocess)
+
+    def reader(files: List[str]) -> TokenIdSeries:
+        directory = cache_dir
+        if directory is None:
+            directory = os.path.dirname(os.path.abspath(files[0]))
+
+        key = cache_key(vocabulary_key, preprocess_key, encoding,
+                        *[file_fingerprint(path) for path in files])
+        prefix = os.path.join(directory, "compiled-{}".format(key))
+
+        if not os.path.exists(prefix + ".offsets.npy"):
+            log("Compiling '{}' to vocabulary indices"
+                .format(", ".join(files)))
+            sentences = text_reader(files)
+            if preprocess is not None:
+                sentences = map(preprocess, sentences)
+            _compile(sentences, vocabulary, prefix)
+
+        log("Loading compiled series from '{}'".format(prefix))
+        return _load_compiled(prefix,
+                              StringTable(vocabulary.index_to_word))
+
+    return reader
+
+
+def _compile(sentences: Iterable[List[str]], vocabulary: Any,
+             prefix: str) -> None:
+    """Write sentences mapped to vocabulary indices to files.
+
+    Arguments:
+        sentences: Tokenized sentences.
+        vocabulary: The vocabulary used for the mapping.
+        prefix: Prefix of the paths of the compiled files.
+    """
+    os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    tmp_suffix = ".{}.tmp".format(os.getpid())
+
+    lengths = []  # type: List[int]
+    buffer = []  # type: List[int]
+    with open(prefix + ".ids" + tmp_suffix, "wb") as f_ids:
+        for sentence in sentences:
+            buffer.extend(vocabulary.get_word_index(w) for w in sentence)
+            lengths.append(len(sentence))
+            if len(buffer) >= _WRITE_CHUNK:
+                f_ids.write(np.array(buffer, dtype=np.int32).tobytes())
+                buffer = []
+        f_ids.write(np.array(buffer, dtype=np.int32).tobytes())
+
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    with open(prefix + ".offsets" + tmp_suffix, "wb") as f_offsets:
+        np.save(f_offsets, offsets)
+
+    # the offsets file is renamed last, its presence marks a complete cache
+    os.replace(prefix + ".ids" + tmp_suffix, prefix + ".ids")
+    os.replace(prefix + ".offsets" + tmp_suffix, prefix + ".offsets.npy")
+
+
+def _load_compiled(prefix: str, table: StringTable) -> TokenIdSeries:
+    """Memory-map the compiled files.
+
+    Arguments:
+        prefix: Prefix of the paths of the compiled files.
+        table: Table of the vocabulary words.
+
+    Returns:
+        The series backed by the memory-mapped files.
+    """
+    offsets = np.load(prefix + ".offsets.npy")
+    if offsets[-1] == 0:
+        # empty files cannot be memory-mapped
+        ids = np.zeros(0, dtype=np.int32)  # type: np.ndarray
+    else:
+        ids = np.memmap(prefix + ".ids", dtype=np.int32, mode="r")
+    return TokenIdSeries(ids, offsets, table)
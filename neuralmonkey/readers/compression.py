@@ -0,0 +1,212 @@
+"""Fast reading of possibly compressed text files.
+
+The compression format is detected from the magic bytes at the beginning of
+the file. Gzip, bzip2 and xz are supported by the standard library, zstd is
+supported if the ``zstandard`` package is installed.
+
+The files are read and decompressed in a background thread in large blocks.
+The decompressors release the GIL, so the decompression runs in parallel
+with the consumer of the data, which splits the blocks into lines.
+"""
+
+from typing import (Any, BinaryIO, Iterable, Iterator, List, Optional,
+                    Pattern, Union)
+import bz2
+import codecs
+import gzip
+import lzma
+import queue
+import re
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # pylint: disable=invalid-name
+
+BLOCK_SIZE = 1 << 22
+
+_QUEUE_SIZE = 4
+_MAGIC_BYTES = [(b"\x1f\x8b", "gzip"),
+                (b"BZh", "bz2"),
+                (b"\xfd7zXZ\x00", "xz"),
+                (b"\x28\xb5\x2f\xfd", "zstd")]
+
+# the same line boundaries as in files opened in the text mode
+_NEWLINES = re.compile("\r\n|\r|\n")
+_RAW_NEWLINES = re.compile(b"\r\n|\r|\n")
+
+
+def detect_compression(path: str) -> Optional[str]:
+    """Detect the compression format of a file.
+
+    Arguments:
+        path: The path to the file.
+
+    Returns:
+        One of 'gzip', 'bz2', 'xz' and 'zstd', or None for an uncompressed
+        file.
+    """
+    with open(path, "rb") as f_data:
+        header = f_data.read(6)
+
+    for magic, compression in _MAGIC_BYTES:
+        if header.startswith(magic):
+            return compression
+    return None
+
+
+def open_decompressed(path: str) -> BinaryIO:
+    """Open a possibly compressed file for reading of the raw content.
+
+    Arguments:
+        path: The path to the file.
+
+    Returns:
+        A binary file object with the decompressed data.
+
+    Raises:
+        ValueError if the file is compressed by zstd and the ``zstandard``
+        package is not installed.
+    """
+    compression = detect_compression(path)
+
+    if compression == "gzip":
+        return gzip.open(path, "rb")  # type: ignore
+    if compression == "bz2":
+        return bz2.open(path, "rb")  # type: ignore
+    if compression == "xz":
+        return lzma.open(path, "rb")  # type: ignore
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("Reading of zstd-compressed file '{}' requires "
+                             "the zstandard package.".format(path))
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+    return open(path, "rb")
+
+
+def read_blocks(path: str, block_size: int=BLOCK_SIZE) -> Iterator[bytes]:
+    """Read the decompressed content of a file in blocks.
+
+    The blocks are read in a background thread a few blocks ahead. When the
+    generator is closed, the thread is stopped.
+
+    Arguments:
+        path: The path to the file.
+        block_size: The size of the blocks in bytes.
+
+    Returns:
+        Generator yielding the blocks of the decompressed content.
+    """
+    blocks = queue.Queue(maxsize=_QUEUE_SIZE)  # type: queue.Queue
+    stop = threading.Event()
+
+    def put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            with open_decompressed(path) as f_data:
+                while True:
+                    block = f_data.read(block_size)
+                    if not put(block) or not block:
+                        return
+        # pylint: disable=broad-except
+        except Exception as exc:
+            put(exc)
+
+    producer = threading.Thread(target=produce, name="block-reader",
+                                daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            block = blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                break
+            yield block
+    finally:
+        stop.set()
+
+
+def read_line_batches(
+        path: str,
+        block_size: int=BLOCK_SIZE,
+        encoding: Optional[str]=None) -> Iterator[List[Union[bytes, str]]]:
+    """Read lines of a possibly compressed file in batches.
+
+    Each block of the file is split to lines at once, a line split between
+    two blocks is joined. The lines end with the same line boundaries as in
+    files opened in the text mode, i.e. ``\\n``, ``\\r\\n`` and a lone
+    ``\\r``.
+
+    Without an encoding, the raw blocks are split on the newline bytes, which
+    is correct only for encodings compatible with ASCII (e.g. UTF-8). With an
+    encoding, the blocks are decoded incrementally.
+
+    Arguments:
+        path: The path to the file.
+        block_size: The size of the blocks in bytes.
+        encoding: The encoding of the file. If None, raw lines are returned.
+
+    Returns:
+        Generator yielding lists of the lines without the newline characters,
+        as bytes if the encoding is None and as strings otherwise.
+    """
+    if encoding is None:
+        yield from _split_lines(read_blocks(path, block_size),
+                                _RAW_NEWLINES, b"\n", b"\r")
+        return
+
+    decoder = codecs.getincrementaldecoder(encoding)()
+
+    def decoded_blocks() -> Iterator[str]:
+        for block in read_blocks(path, block_size):
+            yield decoder.decode(block)
+        yield decoder.decode(b"", final=True)
+
+    yield from _split_lines(decoded_blocks(), _NEWLINES, "\n", "\r")
+
+
+def _split_lines(blocks: Iterable[Any], newlines: Pattern, newline: Any,
+                 carriage_return: Any) -> Iterator[List[Any]]:
+    """Split consecutive blocks of bytes or strings to lines.
+
+    Arguments:
+        blocks: The blocks of the content.
+        newlines: The pattern of the line boundaries.
+        newline: The line feed of the type of the blocks.
+        carriage_return: The carriage return of the type of the blocks.
+
+    Returns:
+        Generator yielding lists of the lines without the line boundaries.
+    """
+    rest = carriage_return[:0]
+    for block in blocks:
+        text = rest + block
+        # a carriage return at the end of the block can start a CRLF
+        held = (carriage_return if text.endswith(carriage_return)
+                else carriage_return[:0])
+        text = text[:len(text) - len(held)]
+        # the files without carriage returns are split faster
+        if carriage_return in text:
+            lines = newlines.split(text)
+        else:
+            lines = text.split(newline)
+        rest = lines.pop() + held
+        if lines:
+            yield lines
+
+    lines = newlines.split(rest)
+    if not lines[-1]:
+        lines.pop()
+    if lines:
+        yield lines
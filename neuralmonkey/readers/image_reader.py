@@ -1,15 +1,26 @@
-from typing import Callable, Iterable, List, Optional
+from typing import Any, Callable, Iterable, List, Optional
 import os
 import numpy as np
 from PIL import Image, ImageFile
+
+from neuralmonkey.caching import (cache_key, file_fingerprint,
+                                  object_fingerprint)
+from neuralmonkey.logging import log
+from neuralmonkey.parallel import threaded_imap
+from neuralmonkey.readers.numpy_reader import ShardedArray
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+# number of images decoded by a thread at once
+_IMAGE_CHUNK_SIZE = 16
+
 
 def image_reader(prefix="",
                  pad_w: Optional[int]=None,
                  pad_h: Optional[int]=None,
                  rescale: bool=False,
-                 mode: str='RGB') -> Callable:
+                 mode: str='RGB',
+                 num_workers: int=0,
+                 cache_dir: Optional[str]=None) -> Callable:
     """Get a reader of images loading them from a list of pahts.
 
     Args:
@@ -20,86 +31,201 @@ def image_reader(prefix="",
             size. Otherwise, they will be cropped from the middle.
         mode: Scipy image loading mode, see scipy documentation for more
             details.
+        num_workers: Number of threads decoding the images. If zero, the
+            images are decoded in the calling thread. Threads are used
+            instead of processes, so the images can be read safely also
+            during training, but they run in parallel only while PIL
+            releases the GIL (when decoding and resizing the images); the
+            cropping and padding in Python is not sped up.
+        cache_dir: Directory where the processed images are cached. If set,
+            the images from each list file are stored in a single numpy file
+            keyed by the paths and modification times of the images and the
+            reader parameters, and the reader returns the memory-mapped
+            array.
 
     Returns:
         The reader function that takes a list of image paths (relative to
         provided prefix) and returns a list of images as numpy arrays of shape
-        pad_h x pad_w x number of channels.
+        pad_h x pad_w x number of channels. The arrays keep the data type of
+        the decoded images, i.e. uint8 for the RGB and L modes.
     """
 
-    def load(list_files: List[str]) -> Iterable[np.ndarray]:
-        for list_file in list_files:
-            with open(list_file) as f_list:
-                for i, image_file in enumerate(f_list):
-                    path = os.path.join(prefix, image_file.rstrip())
-
-                    if not os.path.exists(path):
-                        raise Exception(
-                            ("Image file '{}' no."
-                             "{}  does not exist.").format(path, i + 1))
-
-                    try:
-                        image = Image.open(path).convert(mode)
-                    except IOError:
-                        image = Image.new(mode, (pad_w, pad_h))
-
-                    if rescale:
-                        _rescale(image, pad_w, pad_h)
-                    else:
-                        image = _crop(image, pad_w, pad_h)
-                    image_np = np.array(image)
-
-                    if len(image_np.shape) == 2:
-                        channels = 1
-                        image_np = np.expand_dims(image_np, 2)
-                    elif len(image_np.shape) == 3:
-                        channels = image_np.shape[2]
-                    else:
-                        raise ValueError(
-                            ("Image should have either 2 (black and white) "
-                             "or three dimensions (color channels), has {} "
-                             "dimension.").format(len(image_np.shape)))
-
-                    yield _pad(image_np, pad_w, pad_h, channels)
-
-    return load
+    def load_image(path: str) -> np.ndarray:
+        return _load_image(path, pad_w, pad_h, rescale, mode)
+
+    return _get_reader(prefix, load_image, num_workers, cache_dir)
 
 
 def imagenet_reader(prefix: str,
                     target_width: int=227,
-                    target_height: int=227) -> Callable:
-    """Load and prepare image the same way as Caffe scripts."""
+                    target_height: int=227,
+                    num_workers: int=0,
+                    cache_dir: Optional[str]=None) -> Callable:
+    """Load and prepare image the same way as Caffe scripts.
+
+    The images can be decoded by ``num_workers`` threads and cached in the
+    same way as in the ``image_reader``. As there, the threads decode the
+    images in parallel only while PIL releases the GIL.
+    """
+
+    def load_image(path: str) -> np.ndarray:
+        return _load_imagenet_image(path, target_width, target_height)
+
+    return _get_reader(prefix, load_image, num_workers, cache_dir)
+
+
+def _get_reader(prefix: str,
+                load_image: Callable[[str], np.ndarray],
+                num_workers: int,
+                cache_dir: Optional[str]) -> Callable:
+    """Create a reader of images listed in files.
+
+    Arguments:
+        prefix: Prefix of the paths listed in the files.
+        load_image: Function loading and processing a single image.
+        num_workers: Number of decoding threads.
+        cache_dir: The cache directory or None.
+
+    Returns:
+        The reader function.
+    """
+
     def load(list_files: List[str]) -> Iterable[np.ndarray]:
         for list_file in list_files:
-            with open(list_file) as f_list:
-                for i, image_file in enumerate(f_list):
-                    path = os.path.join(prefix, image_file.rstrip())
-
-                    if not os.path.exists(path):
-                        raise Exception(
-                            "Image file '{}' no. {} does not exist."
-                            .format(path, i + 1))
-
-                    image = Image.open(path).convert('RGB')
-
-                    width, height = image.size
-                    if width == height:
-                        _rescale(image, target_width, target_height)
-                    elif height < width:
-                        _rescale(image,
-                                 int(width * float(target_height) / height),
-                                 target_height)
-                    else:
-                        _rescale(image,
-                                 target_width,
-                                 int(height * float(target_width) / width))
-                    cropped_image = _crop(image, target_width, target_height)
-
-                    res = _pad(np.array(cropped_image),
-                               target_width, target_height, 3)
-                    assert res.shape == (target_width, target_height, 3)
-                    yield res
-    return load
+            yield from threaded_imap(
+                load_image, _image_paths(list_file, prefix), num_workers,
+                chunk_size=_IMAGE_CHUNK_SIZE)
+
+    def load_cached(list_files: List[str]) -> Any:
+        arrays = [_load_cached_images(list_file, prefix, load_image,
+                                      num_workers, cache_dir)
+                  for list_file in list_files]
+        if len(arrays) == 1:
+            return arrays[0]
+        return ShardedArray(arrays)
+
+    if cache_dir is None:
+        return load
+    return load_cached
+
+
+def _image_paths(list_file: str, prefix: str) -> List[str]:
+    """Read the paths of the images from a list file.
+
+    Raises:
+        Exception if some of the images does not exist.
+    """
+    paths = []
+    with open(list_file) as f_list:
+        for i, image_file in enumerate(f_list):
+            path = os.path.join(prefix, image_file.rstrip())
+
+            if not os.path.exists(path):
+                raise Exception(
+                    "Image file '{}' no. {} does not exist."
+                    .format(path, i + 1))
+            paths.append(path)
+    return paths
+
+
+def _load_cached_images(list_file: str, prefix: str,
+                        load_image: Callable[[str], np.ndarray],
+                        num_workers: int, cache_dir: str) -> np.ndarray:
+    """Load the images listed in a file from the cache.
+
+    If the images are not cached yet, they are processed and stored in the
+    cache first.
+
+    Returns:
+        The memory-mapped array of all the images from the list.
+    """
+    paths = _image_paths(list_file, prefix)
+    key = cache_key(
+        object_fingerprint(load_image),
+        object_fingerprint([_load_image, _load_imagenet_image,
+                            _rescale, _crop, _pad]),
+        *[file_fingerprint(path) for path in paths])
+    cache_path = os.path.join(cache_dir, "images-{}.npy".format(key))
+
+    if not os.path.exists(cache_path):
+        log("Caching images listed in '{}'".format(list_file))
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+
+        try:
+            cached = None  # type: Optional[np.memmap]
+            images = threaded_imap(load_image, paths, num_workers,
+                                   chunk_size=_IMAGE_CHUNK_SIZE)
+            for i, image in enumerate(images):
+                if cached is None:
+                    cached = np.lib.format.open_memmap(
+                        tmp_path, mode="w+", dtype=image.dtype,
+                        shape=(len(paths),) + image.shape)
+                cached[i] = image
+
+            if cached is None:
+                with open(tmp_path, "wb") as f_cache:
+                    np.save(f_cache, np.zeros((0,)))
+            else:
+                cached.flush()
+                del cached
+            os.replace(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    log("Loading cached images from '{}'".format(cache_path))
+    return np.load(cache_path, mmap_mode="r")
+
+
+def _load_image(path: str, pad_w: Optional[int], pad_h: Optional[int],
+                rescale: bool, mode: str) -> np.ndarray:
+    try:
+        image = Image.open(path).convert(mode)
+    except IOError:
+        image = Image.new(mode, (pad_w, pad_h))
+
+    if rescale:
+        _rescale(image, pad_w, pad_h)
+    else:
+        image = _crop(image, pad_w, pad_h)
+    image_np = np.array(image)
+
+    if len(image_np.shape) == 2:
+        channels = 1
+        image_np = np.expand_dims(image_np, 2)
+    elif len(image_np.shape) == 3:
+        channels = image_np.shape[2]
+    else:
+        raise ValueError(
+            ("Image should have either 2 (black and white) "
+             "or three dimensions (color channels), has {} "
+             "dimension.").format(len(image_np.shape)))
+
+    return _pad(image_np, pad_w, pad_h, channels)
+
+
+def _load_imagenet_image(path: str, target_width: int,
+                         target_height: int) -> np.ndarray:
+    image = Image.open(path).convert('RGB')
+
+    width, height = image.size
+    if width == height:
+        _rescale(image, target_width, target_height)
+    elif height < width:
+        _rescale(image,
+                 int(width * float(target_height) / height),
+                 target_height)
+    else:
+        _rescale(image,
+                 target_width,
+                 int(height * float(target_width) / width))
+    cropped_image = _crop(image, target_width, target_height)
+
+    res = _pad(np.array(cropped_image),
+               target_width, target_height, 3)
+    assert res.shape == (target_width, target_height, 3)
+    return res
 
 
 def _rescale(image: Image.Image, pad_w: int, pad_h: int) -> None:
@@ -125,7 +251,7 @@ def _pad(image: np.ndarray, pad_w: int, pad_h: int,
          channels: int) -> np.ndarray:
     img_h, img_w = image.shape[:2]
 
-    image_padded = np.zeros((pad_h, pad_w, channels))
+    image_padded = np.zeros((pad_h, pad_w, channels), dtype=image.dtype)
     image_padded[:img_h, :img_w, :] = image
 
     return image_padded
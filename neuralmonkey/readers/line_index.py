@@ -0,0 +1,171 @@
+"""Byte-offset index of lines in text files.
+
+The index allows random access to lines of (possibly huge) uncompressed text
+files. It is computed once per file and cached next to the data in a file
+with the ``.lineidx2.npy`` suffix.
+"""
+
+from typing import Dict, Iterable, List
+import mmap
+import os
+
+import numpy as np
+
+from neuralmonkey.logging import log, warn
+from neuralmonkey.readers.compression import detect_compression
+
+# the indices with the ".lineidx.npy" suffix ignored the lone carriage returns
+INDEX_SUFFIX = ".lineidx2.npy"
+
+_CHUNK_SIZE = 1 << 24
+
+
+def compute_line_offsets(path: str) -> np.ndarray:
+    """Compute the offsets of the lines in a file.
+
+    The lines end with the same line boundaries as in files opened in the
+    text mode, i.e. ``\\n``, ``\\r\\n`` and a lone ``\\r``.
+
+    Arguments:
+        path: The path to the file.
+
+    Returns:
+        Array of the byte offsets of the beginnings of the lines, followed
+        by the size of the file. Line ``i`` spans the bytes from
+        ``offsets[i]`` to ``offsets[i + 1]``.
+    """
+    line_ends = []  # type: List[np.ndarray]
+    position = 0
+    # whether the previous chunk ends with a carriage return
+    pending_return = False
+    with open(path, "rb") as f_data:
+        while True:
+            chunk = f_data.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            data = np.frombuffer(chunk, dtype=np.uint8)
+            is_feed = data == ord("\n")
+            is_return = data == ord("\r")
+
+            if pending_return and not is_feed[0]:
+                line_ends.append(np.array([position]))
+
+            # a carriage return followed by a line feed does not end a line
+            is_end = is_feed.copy()
+            is_end[:-1] |= is_return[:-1] & ~is_feed[1:]
+            line_ends.append(np.flatnonzero(is_end) + position + 1)
+
+            pending_return = bool(is_return[-1])
+            position += len(chunk)
+
+    if pending_return:
+        line_ends.append(np.array([position]))
+
+    offsets = np.concatenate(
+        [np.zeros(1, dtype=np.int64)] +
+        [ends.astype(np.int64) for ends in line_ends])
+
+    # the last line does not have to end with a newline
+    if offsets[-1] != position:
+        offsets = np.append(offsets, np.int64(position))
+
+    return offsets
+
+
+def load_line_offsets(path: str) -> np.ndarray:
+    """Load the line offsets of a file from the cache or compute them.
+
+    The cached index is used only if it is newer than the file and matches
+    its size. A newly computed index is saved next to the file if possible.
+
+    Arguments:
+        path: The path to the file.
+
+    Returns:
+        Array of the line offsets (see ``compute_line_offsets``).
+    """
+    index_path = path + INDEX_SUFFIX
+
+    if (os.path.exists(index_path) and
+            os.path.getmtime(index_path) >= os.path.getmtime(path)):
+        offsets = np.load(index_path)
+        if offsets[-1] == os.path.getsize(path):
+            return offsets
+
+    log("Building line index of '{}'".format(path))
+    offsets = compute_line_offsets(path)
+
+    tmp_path = "{}.{}.tmp".format(index_path, os.getpid())
+    try:
+        with open(tmp_path, "wb") as f_index:
+            np.save(f_index, offsets)
+        os.replace(tmp_path, index_path)
+    except OSError as exc:
+        warn("Cannot save line index of '{}': {}".format(path, exc))
+
+    return offsets
+
+
+class LineIndex(object):
+    """Random access to lines of a list of files read as a single series.
+
+    Attributes:
+        paths: The indexed files.
+    """
+
+    def __init__(self, paths: List[str]) -> None:
+        """Load or build the indices of the files.
+
+        Arguments:
+            paths: List of paths to uncompressed text files.
+
+        Raises:
+            ValueError if some of the files is compressed.
+        """
+        for path in paths:
+            if detect_compression(path) is not None:
+                raise ValueError(
+                    "Compressed file '{}' cannot be indexed.".format(path))
+
+        self.paths = paths
+        self._offsets = [load_line_offsets(path) for path in paths]
+        self._first_lines = np.cumsum(
+            [0] + [len(offsets) - 1 for offsets in self._offsets])
+
+    def __len__(self) -> int:
+        """Get the total number of lines in the files."""
+        return int(self._first_lines[-1])
+
+    def read_lines(self, indices: Iterable[int]) -> Iterable[bytes]:
+        """Read the lines with the given indices.
+
+        The files are memory-mapped, so the lines can be read in an arbitrary
+        order without loading the files to the memory.
+
+        Arguments:
+            indices: Indices of the lines to read (across all the files).
+
+        Returns:
+            Generator yielding raw lines including the newline characters.
+        """
+        mapped = {}  # type: Dict[int, mmap.mmap]
+        try:
+            for index in indices:
+                if not 0 <= index < len(self):
+                    raise IndexError("Line {} is out of range of {} lines."
+                                     .format(index, len(self)))
+
+                file_index = int(np.searchsorted(
+                    self._first_lines, index, side="right")) - 1
+                line = index - self._first_lines[file_index]
+                offsets = self._offsets[file_index]
+
+                if file_index not in mapped:
+                    with open(self.paths[file_index], "rb") as f_data:
+                        mapped[file_index] = mmap.mmap(
+                            f_data.fileno(), 0, access=mmap.ACCESS_READ)
+
+                yield mapped[file_index][offsets[line]:offsets[line + 1]]
+        finally:
+            for mapped_file in mapped.values():
+                mapped_file.close()
@@ -1,10 +1,136 @@
-from typing import List
+from typing import Any, Iterator, List, Tuple, Union
 
 import numpy as np
 
 
-def numpy_reader(files: List[str]):
+def numpy_reader(files: List[str]) -> np.ndarray:
+    """Load numpy arrays from files and concatenate them in the memory."""
     if len(files) == 1:
         return np.load(files[0])
-    else:
-        np.concatenate([np.load(f) for f in files], axis=0)
+
+    return np.concatenate([np.load(f) for f in files], axis=0)
+
+
+def mmap_numpy_reader(files: List[str]) -> Union[np.ndarray, 'ShardedArray']:
+    """Memory-map numpy arrays from files.
+
+    The arrays are not loaded to the memory, their rows are paged in when
+    they are accessed (e.g. when a batch is indexed from the array). Multiple
+    files are presented as a single ``ShardedArray``.
+
+    Arguments:
+        files: Paths to ``.npy`` files with arrays of the same row shape.
+
+    Returns:
+        A memory-mapped array or a virtual concatenation of the arrays.
+    """
+    shards = [np.load(f, mmap_mode="r") for f in files]
+    if len(shards) == 1:
+        return shards[0]
+    return ShardedArray(shards)
+
+
+class ShardedArray(object):
+    """Virtual concatenation of arrays along the first axis.
+
+    The arrays (shards) are not copied. Integer indexing and slicing take
+    constant time with respect to the number of rows, indexing by an array
+    of indices gathers the rows from the shards into a new array.
+
+    Attributes:
+        shards: The concatenated arrays.
+    """
+
+    def __init__(self, shards: List[np.ndarray]) -> None:
+        """Create the virtual concatenation.
+
+        Arguments:
+            shards: Arrays with the same dtype and the same shape except for
+                the first dimension.
+
+        Raises:
+            ValueError if the shards do not match.
+        """
+        if not shards:
+            raise ValueError("At least one array must be provided.")
+        for shard in shards[1:]:
+            if (shard.shape[1:] != shards[0].shape[1:] or
+                    shard.dtype != shards[0].dtype):
+                raise ValueError(
+                    "Cannot concatenate arrays of shapes {} and {} (dtypes "
+                    "{} and {}).".format(shards[0].shape, shard.shape,
+                                         shards[0].dtype, shard.dtype))
+
+        self.shards = shards
+        self._starts = np.cumsum([0] + [len(shard) for shard in shards])
+
+    def __len__(self) -> int:
+        return int(self._starts[-1])
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return (len(self),) + self.shards[0].shape[1:]
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.shards[0].dtype
+
+    @property
+    def ndim(self) -> int:
+        return self.shards[0].ndim
+
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return self._slice(index)
+        if isinstance(index, (list, np.ndarray)):
+            return self._gather(np.asarray(index, dtype=np.int64))
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Index {} is out of range of {} rows."
+                             .format(index, len(self)))
+        shard = int(np.searchsorted(self._starts, index, side="right")) - 1
+        return self.shards[shard][index - self._starts[shard]]
+
+    def _slice(self, index: slice) -> Any:
+        start, stop, step = index.indices(len(self))
+        if step != 1:
+            return self._gather(np.arange(start, stop, step))
+
+        pieces = []
+        for shard, shard_start in zip(self.shards, self._starts):
+            shard_stop = shard_start + len(shard)
+            if shard_stop > start and shard_start < stop:
+                pieces.append(shard[max(start - shard_start, 0):
+                                    min(stop, shard_stop) - shard_start])
+
+        if len(pieces) == 1:
+            return pieces[0]
+        if not pieces:
+            return self.shards[0][:0]
+        return ShardedArray(pieces)
+
+    def _gather(self, indices: np.ndarray) -> np.ndarray:
+        indices = np.where(indices < 0, indices + len(self), indices)
+        if np.any((indices < 0) | (indices >= len(self))):
+            raise IndexError("Indices are out of range of {} rows."
+                             .format(len(self)))
+
+        result = np.empty((len(indices),) + self.shape[1:], dtype=self.dtype)
+        shard_ids = np.searchsorted(self._starts, indices, side="right") - 1
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            result[mask] = self.shards[shard_id][
+                indices[mask] - self._starts[shard_id]]
+        return result
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for shard in self.shards:
+            yield from shard
+
+    def __array__(self, dtype: Any=None) -> np.ndarray:
+        array = np.concatenate(self.shards, axis=0)
+        if dtype is not None:
+            return array.astype(dtype, copy=False)
+        return array
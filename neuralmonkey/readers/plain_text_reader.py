@@ -1,26 +1,39 @@
 from typing import List, Iterable
-import gzip
+import functools
 
-from neuralmonkey.readers.utils import FILETYPER
+from neuralmonkey.readers.compression import read_line_batches
 
 
 def get_plain_text_reader(encoding: str="utf-8"):
-    """Get reader for space-separated tokenized text."""
+    """Get reader for space-separated tokenized text.
+
+    The files can be compressed by gzip, bzip2, xz or zstd, they are read
+    and decompressed in large blocks in a background thread (see
+    ``neuralmonkey.readers.compression``).
+
+    If the encoding is compatible with ASCII (e.g. UTF-8 or Latin-1), the
+    returned reader has a ``parse_line`` attribute, a function which
+    converts a single raw line (bytes) to the list of tokens. It is used by
+    lazy datasets reading lines from indexed files in an arbitrary order.
+    Raw lines are split on the newline bytes, so this is not possible with
+    encodings such as UTF-16, whose files can only be read as a whole.
+    """
     def reader(files: List[str]) -> Iterable[List[str]]:
         for path in files:
-            mime_type = FILETYPER.from_file(path)
-
-            if mime_type == "application/gzip":
-                with gzip.open(path, 'r') as f_data:
-                    for line in f_data:
-                        yield str(line, 'utf-8').strip().split(" ")
-            else:
-                with open(path, encoding=encoding) as f_data:
-                    for line in f_data:
-                        yield line.strip().split(" ")
+            for lines in read_line_batches(path, encoding=encoding):
+                for line in lines:
+                    yield line.strip().split(" ")  # type: ignore
 
+    if "\n ".encode(encoding) == b"\n ":
+        # a module-level function can be pickled for the worker processes
+        reader.parse_line = functools.partial(  # type: ignore
+            _parse_line, encoding=encoding)
     return reader
 
 
+def _parse_line(line: bytes, encoding: str) -> List[str]:
+    return str(line, encoding).strip().split(" ")
+
+
 # pylint: disable=invalid-name
 UtfPlainTextReader = get_plain_text_reader()
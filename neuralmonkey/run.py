@@ -14,6 +14,7 @@ CONFIG.add_argument('evaluation')
 CONFIG.add_argument('runners')
 CONFIG.add_argument('threads', required=False, default=4)
 CONFIG.add_argument('runners_batch_size', required=False, default=None)
+CONFIG.add_argument('runners_token_budget', required=False, default=None)
 # ignore arguments which are just for training
 CONFIG.ignore_argument('val_dataset')
 CONFIG.ignore_argument('trainer')
@@ -21,6 +22,8 @@ CONFIG.ignore_argument('name')
 CONFIG.ignore_argument('train_dataset')
 CONFIG.ignore_argument('epochs')
 CONFIG.ignore_argument('batch_size')
+CONFIG.ignore_argument('bucket_window')
+CONFIG.ignore_argument('token_budget')
 CONFIG.ignore_argument('test_datasets')
 CONFIG.ignore_argument('initial_variables')
 CONFIG.ignore_argument('validation_period')
@@ -103,9 +106,12 @@ def main() -> None:
                   for e in CONFIG.model.evaluation]
 
     for dataset in datesets_model.test_datasets:
+        # the decoding stops after the end tokens only on datasets without
+        # references, the losses on the others need the unrolled decoder
         execution_results, output_data = run_on_dataset(
             CONFIG.model.tf_manager, CONFIG.model.runners,
-            dataset, CONFIG.model.postprocess, write_out=True)
+            dataset, CONFIG.model.postprocess, write_out=True,
+            token_budget=CONFIG.model.runners_token_budget, summaries=False)
         # TODO what if there is no ground truth
         eval_result = evaluation(evaluators, dataset, CONFIG.model.runners,
                                  execution_results, output_data)
@@ -7,11 +7,19 @@ model ensembling and beam search.
 
 The TensorFlow session is invoked for every single output of the decoder
 separately which allows ensembling from all sessions and do the beam pruning
-before the a next output is emmited.
+before the a next output is emmited. The encoders are run only in the first
+step, the following steps feed the decoder with the RNN states and attention
+contexts of the hypotheses cached from the previous step. All hypotheses of
+the beam are expanded in a single run, the batch is tiled to ``batch x beam``
+rows with the hypotheses of each instance next to each other. The finished
+hypotheses leave the beam and the decoding stops as soon as none of the live
+ones can get a better score.
 """
 
 
-from typing import Dict, List, Callable, NamedTuple, Tuple
+from typing import Any, Dict, List, Callable, NamedTuple, Optional, Tuple
+import inspect
+
 import numpy as np
 import tensorflow as tf
 
@@ -21,160 +29,190 @@ from neuralmonkey.vocabulary import END_TOKEN_INDEX
 
 
 # pylint: disable=invalid-name
-BeamBatch = NamedTuple('BeamBatch',
-                       [('decoded', np.ndarray),
-                        ('logprobs', np.ndarray)])
-ExpandedBeamBatch = NamedTuple('ExpandedBeamBatch',
-                               [('beam_batch', BeamBatch),
-                                ('next_logprobs', np.ndarray)])
+# decoder states of the hypotheses for each session, each state is a list of
+# arrays with the hypotheses in the first dimension
+DecoderStates = List[List[np.ndarray]]
+# the live hypotheses of one decoding step, arrays of shape (batch, beam) with
+# the index of the hypothesis of the previous step they continue, their last
+# word, the sum of their log-probs and their length
+BeamHypotheses = NamedTuple('BeamHypotheses',
+                            [('parents', np.ndarray),
+                             ('tokens', np.ndarray),
+                             ('logprob_sums', np.ndarray),
+                             ('lengths', np.ndarray)])
+# the best finished hypothesis of each instance, arrays of shape (batch) with
+# its score, the number of its words before the end token and its position in
+# the beam of the step of its last word
+FinishedHypotheses = NamedTuple('FinishedHypotheses',
+                                [('scores', np.ndarray),
+                                 ('lengths', np.ndarray),
+                                 ('positions', np.ndarray)])
 ScoringFunction = Callable[[np.ndarray, np.ndarray], np.ndarray]
 
-# pylint: disable=too-many-locals
-
-
-def _n_best_indices(scores: np.ndarray, n: int) -> np.ndarray:
-    if scores.shape[0] <= n:
-        unsorted_n_best_indices = np.arange(scores.shape[0])
-    else:
-        unsorted_n_best_indices = np.argpartition(-scores, n)[:n]
-    n_best_indices = unsorted_n_best_indices[
-        np.argsort(scores[unsorted_n_best_indices])]
-    return n_best_indices
 
-
-def _score_expanded(n: int,
-                    batch_size: int,
-                    expanded: List[ExpandedBeamBatch],
-                    scoring_function: ScoringFunction) -> \
-        Tuple[List[np.ndarray], List[np.ndarray]]:
-    """Score expanded beams.
-
-    After all hypotheses have their possible continuations, we need to score
-    the expanded hypotheses. We collect all possible conitnuations (typically
-    `n`-times size of the voabulary), score them using `scoring_function` and
-    keep only `n` with the highest scores.
+def likelihood_beam_score(logprob_sums: np.ndarray,
+                          lengths: np.ndarray) -> np.ndarray:
+    """Score the beam by normalized probaility.
 
     Args:
-        n: Number of best hypotheses.
-        batch_size: Number hypothese in the batch.
-        expanded: List of expanded hypotheses from the previous beam, organized
-            into batches.
-        scoring_function: A function that scores the expanded hypotheses based
-            on the hypotheses and individual words' log-probs.
+        logprob_sums: Sums of the log-probs of the hypotheses words up to the
+            end token.
+        lengths: Lengths of the hypotheses including the end token.
 
     Returns:
-        Hypotheses indices and logprobs for the next decoding step.
+        The log-prob sums normalized by the logarithm of the lengths.
     """
-    next_beam_hypotheses = []
-    next_beam_logprobs = []
-    # agregate the expanded hypotheses hypothesis-wise
-    for rank in range(batch_size):
-        candidate_scores = None
-        candidate_hypotheses = None
-        candidate_logprobs = None
-
-        for expanded_batch in expanded:
-            next_distribution = expanded_batch.next_logprobs[rank]
-            if expanded_batch.beam_batch is None:
-                expanded_hypotheses = np.expand_dims(np.arange(
-                    len(next_distribution)), axis=1)
-                expanded_logprobs = np.expand_dims(next_distribution, 1)
-            else:
-                hypothesis = expanded_batch.beam_batch.decoded[rank]
-                prev_logprobs = expanded_batch.beam_batch.logprobs[rank]
-
-                expanded_hypotheses = np.array(
-                    [np.append(hypothesis, index)
-                     for index, _ in enumerate(next_distribution)])
-                expanded_logprobs = np.array(
-                    [np.append(prev_logprobs, logprob)
-                     for logprob in next_distribution])
-
-            assert expanded_hypotheses.shape == expanded_logprobs.shape
-            scores = scoring_function(expanded_hypotheses, expanded_logprobs)
-            assert scores.shape[0] == expanded_hypotheses.shape[0]
-            n_best_indices = _n_best_indices(scores, n)
-            candidate_scores = _try_append(
-                candidate_scores, scores[n_best_indices])
-            candidate_hypotheses = _try_append(
-                candidate_hypotheses, expanded_hypotheses[n_best_indices])
-            candidate_logprobs = _try_append(
-                candidate_logprobs, expanded_logprobs[n_best_indices])
-            assert len(candidate_hypotheses.shape) == 2
-
-        n_best_indices = _n_best_indices(candidate_scores, n)
-        n_best_hypotheses = candidate_hypotheses[n_best_indices]
-        n_best_logprobs = candidate_logprobs[n_best_indices]
-
-        assert len(n_best_hypotheses.shape) == 2
-        assert n_best_hypotheses.shape == n_best_logprobs.shape
-        next_beam_hypotheses.append(n_best_hypotheses)
-        next_beam_logprobs.append(n_best_logprobs)
-    return next_beam_hypotheses, next_beam_logprobs
-
-
-def _try_append(first, second):
-    if first is None:
-        return second
-    else:
-        return np.append(first, second, axis=0)
+    return logprob_sums - np.log(lengths)
 
 
-def likelihood_beam_score(decoded, logprobs):
-    """Score the beam by normalized probaility."""
+def _check_scoring_function(scoring_function: ScoringFunction) -> None:
+    """Check that the beam scoring function takes two arguments.
 
-    mask = []
-    for hypothesis in decoded:
-        before_end = True
-        hyp_mask = []
-        for index in hypothesis:
-            hyp_mask.append(float(before_end))
-            before_end &= (index != END_TOKEN_INDEX)
-        mask.append(hyp_mask)
+    The scoring functions used to take the decoded hypotheses and their
+    log-probs, these cannot be told apart by the number of the arguments,
+    so they are recognized by the names of the arguments.
 
-    mask_matrix = np.array(mask)
-    masked_logprobs = mask_matrix * logprobs
-    # pylint: disable=no-member
-    avg_logprobs = masked_logprobs.sum(
-        axis=1) - np.log(mask_matrix.sum(axis=1))
-    return avg_logprobs
+    Raises:
+        ValueError if the function cannot be called with the log-prob sums
+        and the lengths.
+    """
+    try:
+        signature = inspect.signature(scoring_function)
+    except (TypeError, ValueError):
+        # e.g. numpy ufuncs do not provide the signature
+        return
+
+    try:
+        signature.bind(None, None)
+        is_valid = list(signature.parameters)[:2] != ["decoded", "logprobs"]
+    except TypeError:
+        is_valid = False
+
+    if not is_valid:
+        raise ValueError(
+            "The beam scoring function must take the arguments "
+            "(logprob_sums, lengths), the arrays of the sums of the log-probs "
+            "of the hypotheses and of their lengths, and return their "
+            "scores, got {}{}.".format(
+                getattr(scoring_function, "__name__", scoring_function),
+                signature))
 
 
 def n_best(n: int,
-           expanded: List[ExpandedBeamBatch],
-           scoring_function) -> List[BeamBatch]:
+           hypotheses: Optional[BeamHypotheses],
+           next_logprobs: np.ndarray,
+           scoring_function: ScoringFunction) -> Tuple[BeamHypotheses,
+                                                       np.ndarray]:
     """Take n-best from expanded beam search hypotheses.
 
-    To do the scoring we need to "reshape" the hypohteses. Before the scoring
-    the hypothesis are split into beam batches by their position in the beam.
-    To do the scoring, however, they need to be organized by the instances.
-    After the scoring, only _n_ hypotheses is kept for each isntance. These
-    are again split by their position in the beam.
+    Each hypothesis of the beam is expanded by every word of the vocabulary
+    and all expansions of an instance are scored at once using
+    `scoring_function`. The expansions by the end token finish the
+    hypotheses, from the others only _n_ with the highest scores are kept.
+    If there are fewer expansions, the beam is filled by hypotheses with
+    log-prob sums of minus infinity.
 
     Args:
         n: Beam size.
-        expanded: List of batched expanded hypotheses.
-        scoring_function: A function
+        hypotheses: The hypotheses of the previous step, None before the
+            first step.
+        next_logprobs: The log-probs of the next words of shape
+            (batch, beam, vocabulary).
+        scoring_function: A function scoring the hypotheses based on their
+            log-prob sums and lengths.
 
     Returns:
-        List of BeamBatches ready for new expansion.
+        The n-best live hypotheses ordered from the best one and the scores
+        of the hypotheses of the previous step finished by the end token.
+    """
+    batch_size, beam_size, vocabulary_size = next_logprobs.shape
+
+    if hypotheses is None:
+        logprob_sums = np.zeros([batch_size, beam_size])
+        lengths = np.zeros([batch_size, beam_size], dtype=np.int32)
+    else:
+        logprob_sums = hypotheses.logprob_sums
+        lengths = hypotheses.lengths
+
+    candidate_sums = logprob_sums[:, :, None] + next_logprobs
+    scores = np.array(np.broadcast_to(
+        scoring_function(candidate_sums, lengths[:, :, None] + 1),
+        candidate_sums.shape))
+
+    finished_scores = scores[:, :, END_TOKEN_INDEX].copy()
+    scores[:, :, END_TOKEN_INDEX] = -np.inf
+    candidate_sums[:, :, END_TOKEN_INDEX] = -np.inf
+    scores = scores.reshape(batch_size, -1)
+    candidate_sums = candidate_sums.reshape(batch_size, -1)
+
+    expansions = scores.shape[1]
+    if expansions < n:
+        # a beam wider than the expansions (e.g. in the first step with
+        # a small vocabulary) is filled by impossible hypotheses
+        padding = np.full([batch_size, n - expansions], -np.inf)
+        scores = np.concatenate([scores, padding], axis=1)
+        candidate_sums = np.concatenate([candidate_sums, padding], axis=1)
+
+    instances = np.arange(batch_size)[:, None]
+    best = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    best = best[instances, np.argsort(-scores[instances, best], axis=1)]
+
+    padded = best >= expansions
+    parents, tokens = np.divmod(np.where(padded, 0, best), vocabulary_size)
+    next_hypotheses = BeamHypotheses(
+        parents=parents,
+        tokens=np.where(padded, END_TOKEN_INDEX, tokens),
+        logprob_sums=candidate_sums[instances, best],
+        lengths=lengths[instances, parents] + 1)
+    return next_hypotheses, finished_scores
+
+
+def _update_finished(finished: FinishedHypotheses,
+                     finished_scores: np.ndarray,
+                     length: int) -> FinishedHypotheses:
+    """Keep the best finished hypothesis of each instance.
 
+    Args:
+        finished: The best hypotheses finished in the previous steps.
+        finished_scores: The scores of the hypotheses of the last beam
+            finished by the end token, of shape (batch, beam).
+        length: The number of words of the hypotheses of the last beam.
     """
+    positions = np.argmax(finished_scores, axis=1)
+    scores = finished_scores[np.arange(len(positions)), positions]
+    improved = scores > finished.scores
+    return FinishedHypotheses(
+        scores=np.where(improved, scores, finished.scores),
+        lengths=np.where(improved, length, finished.lengths),
+        positions=np.where(improved, positions, finished.positions))
 
-    batch_size = expanded[0].next_logprobs.shape[0]
-    next_beam_hypotheses, next_beam_logprobs = _score_expanded(
-        n, batch_size, expanded, scoring_function)
 
-    # now cut the beams by hypotheses rank
-    beam_batches = []
-    for rank in range(n):
-        hypotheses = np.array([beam[rank] for beam in next_beam_hypotheses])
-        logprobs = np.array([beam[rank] for beam in next_beam_logprobs])
-        assert len(hypotheses.shape) == 2
-        assert hypotheses.shape == logprobs.shape
-        beam_batches.append(BeamBatch(hypotheses, logprobs))
+def _backtrack(history: List[BeamHypotheses],
+               lengths: np.ndarray,
+               positions: np.ndarray) -> np.ndarray:
+    """Get the words of hypotheses following the back-pointers.
 
-    return beam_batches
+    Args:
+        history: The hypotheses of all decoding steps.
+        lengths: The number of words of the hypothesis of each instance.
+        positions: The position of the hypothesis of each instance in the
+            beam of the step of its last word.
+
+    Returns:
+        Array of the words of the hypotheses padded by the end token with the
+        time in the first dimension.
+    """
+    instances = np.arange(len(lengths))
+    decoded = np.full([len(history), len(lengths)], END_TOKEN_INDEX,
+                      dtype=np.int64)
+    for time_step in reversed(range(len(history))):
+        active = time_step < lengths
+        decoded[time_step, active] = history[time_step].tokens[
+            instances, positions][active]
+        positions = np.where(
+            active, history[time_step].parents[instances, positions],
+            positions)
+    return decoded
 
 
 class RuntimeRnnRunner(BaseRunner):
@@ -185,10 +223,8 @@ class RuntimeRnnRunner(BaseRunner):
                  beam_size: int=1, beam_scoring_f=likelihood_beam_score,
                  postprocess: Callable[[List[str]], List[str]]=None) -> None:
         super(RuntimeRnnRunner, self).__init__(output_series, decoder)
+        _check_scoring_function(beam_scoring_f)
 
-        self._initial_fetches = [decoder.runtime_rnn_states[0]]
-        self._initial_fetches += [e.encoded for e in self.all_coders
-                                  if hasattr(e, 'encoded')]
         self._beam_size = beam_size
         self._beam_scoring_f = beam_scoring_f
         self._postprocess = postprocess
@@ -196,7 +232,6 @@ class RuntimeRnnRunner(BaseRunner):
     def get_executable(self, compute_losses=False, summaries=True):
 
         return RuntimeRnnExecutable(self.all_coders, self._decoder,
-                                    self._initial_fetches,
                                     self._decoder.vocabulary,
                                     beam_size=self._beam_size,
                                     beam_scoring_f=self._beam_scoring_f,
@@ -213,63 +248,79 @@ class RuntimeRnnExecutable(Executable):
     """Run and ensemble the RNN decoder step by step."""
 
     # pylint: disable=too-many-arguments
-    def __init__(self, all_coders, decoder, initial_fetches, vocabulary,
+    def __init__(self, all_coders, decoder, vocabulary,
                  beam_scoring_f, postprocess, beam_size=1,
                  compute_loss=True):
         self._all_coders = all_coders
         self._decoder = decoder
         self._vocabulary = vocabulary
-        self._initial_fetches = initial_fetches
         self._compute_loss = compute_loss
         self._beam_size = beam_size
         self._beam_scoring_f = beam_scoring_f
         self._postprocess = postprocess
 
-        self._to_exapand = [None]  # type: List[Option[BeamBatch]]
-        self._current_beam_batch = None
-        self._expanded = []  # type: List[ExpandedBeamBatch]
+        self._history = []  # type: List[BeamHypotheses]
+        self._finished = None  # type: Optional[FinishedHypotheses]
+        self._states = []  # type: DecoderStates
         self._time_step = 0
+        self._step_cache = []  # type: List[List[np.ndarray]]
+        self._loss = 0.
 
         self.result = None  # type: Option[ExecutionResult]
 
     def next_to_execute(self) -> NextExecute:
         """Get the feedables and tensors to run.
 
-        It takes a beam batch that should be expanded the next and preprare an
-        additional feed_dict based on the hypotheses history.
+        It takes the hypotheses that should be expanded the next and preprare
+        an additional feed_dict for each session with their last words and
+        their cached decoder states.
         """
 
         if self.result is not None:
             raise Exception(
                 "Nothing to execute, if there is already a result.")
 
-        to_run = {'logprobs': self._decoder.train_logprobs[self._time_step]}
+        to_run = {'logprobs': self._decoder.step_logprobs,
+                  'states': self._decoder.step_next_state}
 
-        self._current_beam_batch = self._to_exapand.pop()
+        if not self._history:
+            # the first step runs the encoders, their outputs are cached
+            to_run['cache'] = self._decoder.step_cache
+            if self._compute_loss:
+                to_run['xent'] = self._decoder.train_loss
+            return self._all_coders, to_run, {}
 
-        if self._current_beam_batch is not None:
-            batch_size, output_len = self._current_beam_batch.decoded.shape
-            fed_value = np.zeros([self._decoder.max_output_len, batch_size])
-            fed_value[:output_len, :] = self._current_beam_batch.decoded.T
+        additional_feed_dicts = [
+            self._step_feed_dict(states, cache)
+            for states, cache in zip(self._states, self._step_cache)]
 
-            additional_feed_dict = {self._decoder.train_inputs: fed_value}
-        else:
-            additional_feed_dict = {}
+        return self._all_coders, to_run, additional_feed_dicts
 
-        # at the end, we should compute loss
-        if self._time_step == self._decoder.max_output_len - 1:
-            if self._compute_loss:
-                to_run["xent"] = self._decoder.train_loss
-            else:
-                to_run["xent"] = tf.zeros([])
+    def _step_feed_dict(self, states: List[np.ndarray],
+                        cache: List[np.ndarray]) -> Dict[tf.Tensor, Any]:
+        """Feed the decoder step with the state of the current hypotheses.
 
-        return self._all_coders, to_run, additional_feed_dict
+        Arguments:
+            states: The decoder states of the hypotheses from one session.
+            cache: The encoder outputs computed in the session in the first
+                step, tiled to the size of the beam.
+        """
+        feed_dict = dict(zip(self._decoder.step_cache, cache))
+        feed_dict.update(zip(self._decoder.step_state, states))
+        feed_dict[self._decoder.step_inputs] = self._history[-1].tokens.ravel()
+        return feed_dict
 
     def collect_results(self, results: List[Dict]) -> None:
         """Process what the TF session returned.
 
         Only a single time step is always processed at once. First,
-        distributions from all sessions are aggregated.
+        distributions from all sessions are aggregated. The decoder states
+        are kept separately for each session and reordered according to the
+        back-pointers of the selected hypotheses.
+
+        The decoding stops when no live hypothesis can beat the best finished
+        one of its instance, assuming the score of a hypothesis does not
+        increase when it is extended (as with the log-prob based scores).
 
         """
 
@@ -279,27 +330,62 @@ class RuntimeRnnExecutable(Executable):
                                            sess_result["logprobs"])
         avg_logprobs = summed_logprobs - np.log(len(results))
 
-        expanded_batch = ExpandedBeamBatch(self._current_beam_batch,
-                                           avg_logprobs)
-        self._expanded.append(expanded_batch)
-
-        if not self._to_exapand:
-            self._time_step += 1
-            self._to_exapand = n_best(
-                self._beam_size, self._expanded, self._beam_scoring_f)
-            self._expanded = []
-
-        if self._time_step == self._decoder.max_output_len:
-            top_batch = self._to_exapand[-1].decoded.T
-            decoded_tokens = self._vocabulary.vectors_to_sentences(top_batch)
+        if not self._history:
+            # the following steps run the whole beam at once
+            self._step_cache = [
+                [np.repeat(value, self._beam_size, axis=0)
+                 for value in res["cache"]] for res in results]
+            if self._compute_loss:
+                self._loss = np.mean([res["xent"] for res in results])
+            hypotheses = None
+        else:
+            hypotheses = self._history[-1]
+
+        # the first step expands a single hypothesis for each instance
+        beam_size = 1 if hypotheses is None else self._beam_size
+        next_logprobs = avg_logprobs.reshape(
+            [-1, beam_size, avg_logprobs.shape[1]])
+
+        hypotheses, finished_scores = n_best(
+            self._beam_size, hypotheses, next_logprobs, self._beam_scoring_f)
+
+        if self._finished is None:
+            batch_size = finished_scores.shape[0]
+            self._finished = FinishedHypotheses(
+                scores=np.full(batch_size, -np.inf),
+                lengths=np.zeros(batch_size, dtype=np.int64),
+                positions=np.zeros(batch_size, dtype=np.int64))
+        self._finished = _update_finished(
+            self._finished, finished_scores, len(self._history))
+
+        self._history.append(hypotheses)
+        self._time_step += 1
+
+        rows = (np.arange(hypotheses.parents.shape[0])[:, None] * beam_size
+                + hypotheses.parents).ravel()
+        self._states = [[part[rows] for part in res["states"]]
+                        for res in results]
+
+        # the best live hypotheses are the first ones in the beam
+        live_scores = self._beam_scoring_f(hypotheses.logprob_sums[:, 0],
+                                           hypotheses.lengths[:, 0])
+        use_finished = self._finished.scores >= live_scores
+
+        if (self._time_step == self._decoder.max_output_len
+                or np.all(use_finished)):
+            decoded = _backtrack(
+                self._history,
+                np.where(use_finished, self._finished.lengths,
+                         len(self._history)),
+                np.where(use_finished, self._finished.positions, 0))
+            decoded_tokens = self._vocabulary.vectors_to_sentences(decoded)
 
             if self._postprocess is not None:
                 decoded_tokens = self._postprocess(decoded_tokens)
 
-            loss = np.mean([res["xent"] for res in results])
             self.result = ExecutionResult(
                 outputs=decoded_tokens,
-                losses=[loss],
+                losses=[self._loss],
                 scalar_summaries=None,
                 histogram_summaries=None,
                 image_summaries=None
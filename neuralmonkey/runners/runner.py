@@ -31,11 +31,18 @@ class GreedyRunner(BaseRunner):
             fetches = {"train_xent": tf.zeros([]),
                        "runtime_xent": tf.zeros([])}
 
-        fetches["decoded_logprobs"] = self._decoder.runtime_logprobs
-
-        if summaries and self.image_summaries is not None:
+        fetch_images = summaries and self.image_summaries is not None
+        if fetch_images:
             fetches['image_summaries'] = self.image_summaries
 
+        # the losses and the attention images need the unrolled runtime
+        # decoder, otherwise the decoding can stop after the end tokens
+        if (compute_losses or fetch_images
+                or not hasattr(self._decoder, "greedy_logprobs")):
+            fetches["decoded_logprobs"] = self._decoder.runtime_logprobs
+        else:
+            fetches["decoded_logprobs"] = self._decoder.greedy_logprobs
+
         return GreedyRunExecutable(self.all_coders, fetches,
                                    self._decoder.vocabulary,
                                    self._postprocess)
@@ -63,14 +70,20 @@ class GreedyRunExecutable(Executable):
     def collect_results(self, results: List[Dict]) -> None:
         train_loss = 0.
         runtime_loss = 0.
-        summed_logprobs = [-np.inf for _ in self._fetches["decoded_logprobs"]]
+        summed_logprobs = []  # type: List[np.ndarray]
 
         for sess_result in results:
             train_loss += sess_result["train_xent"]
             runtime_loss += sess_result["runtime_xent"]
 
+            # with the dynamic decoding, the sessions can decode outputs of
+            # different lengths
             for i, logprob in enumerate(sess_result["decoded_logprobs"]):
-                summed_logprobs[i] = np.logaddexp(summed_logprobs[i], logprob)
+                if i < len(summed_logprobs):
+                    summed_logprobs[i] = np.logaddexp(summed_logprobs[i],
+                                                      logprob)
+                else:
+                    summed_logprobs.append(logprob)
 
         argmaxes = [np.argmax(l, axis=1) for l in summed_logprobs]
 
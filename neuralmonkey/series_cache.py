@@ -0,0 +1,112 @@
+"""On-disk cache of preprocessed data series.
+
+A cached series is stored in two files: the items pickled one after another
+and an array of their byte offsets. The cache can be read sequentially
+(when an in-memory dataset is loaded) or randomly from a memory-mapped file
+(when a lazy dataset is read in a shuffled order). The cache files are named
+by keys combining fingerprints of the input files and the preprocessors (see
+``neuralmonkey.caching``).
+"""
+
+from typing import Any, Iterable, Iterator, List, Optional
+import collections.abc
+import mmap
+import os
+import pickle
+
+import numpy as np
+
+from neuralmonkey.logging import log, warn
+
+
+class CachedSeries(collections.abc.Sequence):
+    """A series read from the cache files."""
+
+    def __init__(self, prefix: str) -> None:
+        """Open a cached series.
+
+        Arguments:
+            prefix: Prefix of the paths of the cache files.
+        """
+        self._path = prefix + ".pkl"
+        self._offsets = np.load(prefix + ".offsets.npy")
+        self._mapped = None  # type: Optional[mmap.mmap]
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> Any:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Series index out of range.")
+
+        if self._mapped is None:
+            with open(self._path, "rb") as f_data:
+                self._mapped = mmap.mmap(f_data.fileno(), 0,
+                                         access=mmap.ACCESS_READ)
+
+        return pickle.loads(
+            self._mapped[self._offsets[index]:self._offsets[index + 1]])
+
+    def __iter__(self) -> Iterator[Any]:
+        with open(self._path, "rb") as f_data:
+            for length in np.diff(self._offsets):
+                yield pickle.loads(f_data.read(length))
+
+
+def _prefix(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, "series-{}".format(key))
+
+
+def load_cached_series(cache_dir: str, key: str) -> Optional[CachedSeries]:
+    """Open a series from the cache.
+
+    Arguments:
+        cache_dir: The cache directory.
+        key: The key of the series.
+
+    Returns:
+        The cached series or None if it is not in the cache.
+    """
+    prefix = _prefix(cache_dir, key)
+    if not os.path.exists(prefix + ".offsets.npy"):
+        return None
+
+    log("Loading cached series from '{}'".format(prefix))
+    return CachedSeries(prefix)
+
+
+def save_cached_series(cache_dir: str, key: str,
+                       items: Iterable[Any]) -> None:
+    """Store a series in the cache.
+
+    The items are written as they are read, so the series does not need
+    to fit in the memory. Failure to write the cache is only reported.
+
+    Arguments:
+        cache_dir: The cache directory.
+        key: The key of the series.
+        items: The items of the series.
+    """
+    prefix = _prefix(cache_dir, key)
+    tmp_suffix = ".{}.tmp".format(os.getpid())
+    log("Storing series to cache '{}'".format(prefix))
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        offsets = [0]  # type: List[int]
+        with open(prefix + ".pkl" + tmp_suffix, "wb") as f_data:
+            for item in items:
+                data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+                f_data.write(data)
+                offsets.append(offsets[-1] + len(data))
+
+        with open(prefix + ".offsets" + tmp_suffix, "wb") as f_offsets:
+            np.save(f_offsets, np.array(offsets, dtype=np.int64))
+
+        # the offsets file is renamed last, its presence marks a valid cache
+        os.replace(prefix + ".pkl" + tmp_suffix, prefix + ".pkl")
+        os.replace(prefix + ".offsets" + tmp_suffix, prefix + ".offsets.npy")
+    except OSError as exc:
+        warn("Cannot store series to cache '{}': {}".format(prefix, exc))
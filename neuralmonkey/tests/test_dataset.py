@@ -0,0 +1,514 @@
+#!/usr/bin/env python3.5
+"""Unit tests for the dataset batching."""
+
+import os
+import random
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+import numpy as np
+
+from neuralmonkey.dataset import (Dataset, LazyDataset, MixedDataset,
+                                  load_dataset_from_files)
+from neuralmonkey.interned_series import (InternedSeries, StringTable,
+                                          intern_series)
+from neuralmonkey.processors.editops import Preprocess
+from neuralmonkey.processors.helpers import preprocess_char_based
+from neuralmonkey.readers.plain_text_reader import UtfPlainTextReader
+
+SOURCE = [["w{}".format(j) for j in range(i % 13 + 1)] for i in range(100)]
+TARGET = [sent[:-1] for sent in SOURCE]
+# the target series written to files, it has no empty lines
+TAGGED_TARGET = [["t"] + sent for sent in SOURCE]
+
+PREPROCESSED_SENTENCES = 0
+
+
+def _counting_preprocess(sentence):
+    global PREPROCESSED_SENTENCES  # pylint: disable=global-statement
+    PREPROCESSED_SENTENCES += 1
+    return preprocess_char_based(sentence)
+
+
+def _create_dataset() -> Dataset:
+    return Dataset("test", {"source": list(SOURCE),
+                            "target": list(TARGET)}, {})
+
+
+class TestBatching(unittest.TestCase):
+
+    def test_batch_dataset(self):
+        batches = list(_create_dataset().batch_dataset(30))
+
+        self.assertEqual([len(b) for b in batches], [30, 30, 30, 10])
+        self.assertEqual(list(batches[1].get_series("source")),
+                         SOURCE[30:60])
+
+    def test_bucketed_batches_keep_instances(self):
+        random.seed(42)
+        batches = list(_create_dataset().batch_dataset(10, bucket_window=5))
+
+        self.assertEqual(sum(len(b) for b in batches), len(SOURCE))
+
+        pairs = [(tuple(src), tuple(tgt)) for batch in batches
+                 for src, tgt in zip(batch.get_series("source"),
+                                     batch.get_series("target"))]
+        self.assertEqual(
+            sorted(pairs),
+            sorted((tuple(src), tuple(tgt))
+                   for src, tgt in zip(SOURCE, TARGET)))
+
+    def test_bucketed_batches_similar_lengths(self):
+        random.seed(42)
+        batches = _create_dataset().batch_dataset(10, bucket_window=5)
+
+        for batch in batches:
+            lengths = [len(s) for s in batch.get_series("source")]
+            self.assertLessEqual(max(lengths) - min(lengths), 3)
+
+    def test_token_budget(self):
+        batches = list(_create_dataset().batch_dataset(
+            None, token_budget=40))
+
+        self.assertEqual(sum(len(b) for b in batches), len(SOURCE))
+        for batch in batches:
+            max_len = max(len(s) for s in batch.get_series("source"))
+            self.assertTrue(len(batch) == 1 or len(batch) * max_len <= 40)
+
+    def test_token_budget_and_batch_size(self):
+        batches = list(_create_dataset().batch_dataset(
+            3, token_budget=1000))
+
+        self.assertTrue(all(len(b) <= 3 for b in batches))
+        self.assertEqual(sum(len(b) for b in batches), len(SOURCE))
+
+
+class TestInMemoryShuffle(unittest.TestCase):
+
+    def test_shuffle_keeps_series_aligned(self):
+        np.random.seed(42)
+        dataset = _create_dataset()
+        dataset.shuffle()
+
+        sources = list(dataset.get_series("source"))
+        self.assertNotEqual(sources, SOURCE)
+        self.assertEqual(sorted(sources), sorted(SOURCE))
+        for src, tgt in zip(sources, dataset.get_series("target")):
+            self.assertEqual(src[:-1], tgt)
+
+    def test_batches_share_data(self):
+        np.random.seed(42)
+        dataset = _create_dataset()
+        dataset.shuffle()
+        shuffled = list(dataset.get_series("source"))
+
+        batches = list(dataset.batch_dataset(30))
+        self.assertEqual([len(b) for b in batches], [30, 30, 30, 10])
+        self.assertTrue(all(
+            batch_item is item for batch_item, item in zip(
+                batches[1].get_series("source"), shuffled[30:60])))
+
+    def test_numpy_series(self):
+        np.random.seed(42)
+        dataset = Dataset("test", {"source": list(SOURCE),
+                                   "vectors": np.arange(100)}, {})
+        dataset.shuffle()
+
+        for batch in dataset.batch_dataset(7, bucket_window=3):
+            vectors = batch.get_series("vectors")
+            self.assertIsInstance(vectors, np.ndarray)
+            self.assertEqual(list(batch.get_series("source")),
+                             [SOURCE[i] for i in vectors])
+
+    def test_add_series_after_shuffle(self):
+        np.random.seed(42)
+        dataset = _create_dataset()
+        dataset.shuffle()
+        dataset.add_series(
+            "copy", [list(sent) for sent in dataset.get_series("source")])
+
+        self.assertEqual(list(dataset.get_series("copy")),
+                         list(dataset.get_series("source")))
+        batch = next(iter(dataset.batch_dataset(10)))
+        with self.assertRaises(ValueError):
+            batch.add_series("other", list(range(10)))
+
+
+class LazyDatasetFiles(object):
+    """Mixin writing the test corpus to temporary files."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.paths = {}
+        for name, series in [("source", SOURCE), ("target", TAGGED_TARGET)]:
+            path = os.path.join(self.tmp_dir.name, name + ".txt")
+            with open(path, "w", encoding="utf-8") as f_data:
+                for sent in series:
+                    f_data.write(" ".join(sent) + "\n")
+            self.paths[name] = path
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def assert_shuffled_aligned(self, dataset):
+        sources = list(dataset.get_series("source"))
+        targets = list(dataset.get_series("target"))
+
+        self.assertNotEqual(sources, SOURCE)
+        self.assertEqual(sorted(sources), sorted(SOURCE))
+        for src, tgt in zip(sources, targets):
+            self.assertEqual(src, tgt[1:])
+
+
+class TestIndexedLazyDataset(LazyDatasetFiles, unittest.TestCase):
+
+    def _load(self):
+        return load_dataset_from_files(
+            lazy=True, index=True, s_source=self.paths["source"],
+            s_target=self.paths["target"])
+
+    def test_length(self):
+        self.assertEqual(len(self._load()), len(SOURCE))
+        # the second time, the cached index is used
+        self.assertEqual(len(self._load()), len(SOURCE))
+
+    def test_shuffle_keeps_series_aligned(self):
+        np.random.seed(42)
+        dataset = self._load()
+        dataset.shuffle()
+        self.assert_shuffled_aligned(dataset)
+
+    def test_skip_instances(self):
+        dataset = self._load()
+        dataset.skip_instances(90)
+
+        self.assertEqual(list(dataset.get_series("source")), SOURCE[90:])
+        self.assertEqual(len(dataset), 10)
+        self.assertEqual(len(dataset.shard(0, 2)), 50)
+
+        # shuffling restores the skipped instances
+        dataset.shuffle()
+        self.assertEqual(len(dataset), len(SOURCE))
+
+
+class TestShuffleBuffer(LazyDatasetFiles, unittest.TestCase):
+
+    def _load(self):
+        return load_dataset_from_files(
+            lazy=True, shuffle_buffer=10, s_source=self.paths["source"],
+            s_target=self.paths["target"])
+
+    def test_not_shuffled_before_shuffle(self):
+        self.assertEqual(list(self._load().get_series("source")), SOURCE)
+
+    def test_shuffle_keeps_series_aligned(self):
+        random.seed(42)
+        dataset = self._load()
+        dataset.shuffle()
+        self.assert_shuffled_aligned(dataset)
+
+
+class TestParallelPreprocessing(LazyDatasetFiles, unittest.TestCase):
+
+    def _load(self, workers):
+        return load_dataset_from_files(
+            s_source=self.paths["source"], s_target=self.paths["target"],
+            preprocessors=[("source", "chars", preprocess_char_based)],
+            pre_edits=Preprocess("source", "target"),
+            preprocess_workers=workers)
+
+    def test_same_as_sequential(self):
+        sequential = self._load(0)
+        parallel = self._load(3)
+
+        self.assertEqual(list(parallel.get_series("source")), SOURCE)
+        for series in ["target", "chars", "edits"]:
+            self.assertEqual(list(parallel.get_series(series)),
+                             list(sequential.get_series(series)))
+
+    def test_with_running_thread(self):
+        sequential = self._load(0)
+        stop = threading.Event()
+        thread = threading.Thread(target=stop.wait)
+        thread.start()
+        try:
+            # the workers are not forked, the picklable preprocessors are
+            # sent to a fork server instead of running in this process
+            with unittest.mock.patch("neuralmonkey.parallel.warn") as warn:
+                parallel = self._load(2)
+            warn.assert_not_called()
+        finally:
+            stop.set()
+            thread.join()
+
+        for series in ["target", "chars", "edits"]:
+            self.assertEqual(list(parallel.get_series(series)),
+                             list(sequential.get_series(series)))
+
+
+class TestSeriesCache(LazyDatasetFiles, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = os.path.join(self.tmp_dir.name, "cache")
+
+    def _load(self, **kwargs):
+        return load_dataset_from_files(
+            s_source=self.paths["source"], s_target=self.paths["target"],
+            preprocessors=[("source", "chars", _counting_preprocess)],
+            cache_dir=self.cache_dir, **kwargs)
+
+    def _count_preprocessed(self, **kwargs):
+        global PREPROCESSED_SENTENCES  # pylint: disable=global-statement
+        PREPROCESSED_SENTENCES = 0
+        dataset = self._load(**kwargs)
+        chars = list(dataset.get_series("chars"))
+        self.assertEqual(chars,
+                         [preprocess_char_based(s) for s in SOURCE])
+        return PREPROCESSED_SENTENCES
+
+    def test_in_memory(self):
+        self.assertEqual(self._count_preprocessed(), len(SOURCE))
+        self.assertEqual(self._count_preprocessed(), 0)
+
+    def test_dataset_preprocessor(self):
+        first = self._load(pre_edits=Preprocess("source", "target"))
+        second = self._load(pre_edits=Preprocess("source", "target"))
+        self.assertEqual(list(first.get_series("edits")),
+                         list(second.get_series("edits")))
+        self.assertEqual(len(os.listdir(self.cache_dir)), 4)
+
+    def test_changed_file_invalidates(self):
+        self.assertEqual(self._count_preprocessed(), len(SOURCE))
+        os.utime(self.paths["source"], ns=(0, 0))
+        self.assertEqual(self._count_preprocessed(), len(SOURCE))
+
+    def test_lazy_shared_with_in_memory(self):
+        self.assertEqual(self._count_preprocessed(), len(SOURCE))
+        self.assertEqual(self._count_preprocessed(lazy=True), 0)
+
+    def test_lazy_shuffled(self):
+        np.random.seed(42)
+        dataset = self._load(lazy=True, index=True)
+        dataset.shuffle()
+
+        sources = list(dataset.get_series("source"))
+        self.assertNotEqual(sources, SOURCE)
+        self.assertEqual(list(dataset.get_series("chars")),
+                         [preprocess_char_based(s) for s in sources])
+
+
+class TestSharding(LazyDatasetFiles, unittest.TestCase):
+
+    def _load(self, **kwargs):
+        return load_dataset_from_files(
+            s_source=self.paths["source"], s_target=self.paths["target"],
+            s_target_out="out.txt",
+            preprocessors=[("source", "chars", preprocess_char_based)],
+            **kwargs)
+
+    def _assert_shards(self, shards):
+        self.assertEqual([len(list(s.get_series("source"))) for s in shards],
+                         [33, 33, 34])
+        self.assertEqual([sent for shard in shards
+                          for sent in shard.get_series("source")], SOURCE)
+        for shard in shards:
+            self.assertEqual(
+                list(shard.get_series("chars")),
+                [preprocess_char_based(s) for s in shard.get_series("source")])
+
+    def test_in_memory_view(self):
+        dataset = self._load()
+        shards = [dataset.shard(i, 3) for i in range(3)]
+        self._assert_shards(shards)
+        self.assertEqual(shards[1].series_outputs, {"target": "out.txt.1"})
+
+        np.random.seed(42)
+        shards[0].shuffle()
+        self.assertEqual(sorted(shards[0].get_series("source")),
+                         sorted(SOURCE[:33]))
+
+    def test_in_memory_loading(self):
+        self._assert_shards([self._load(shard_index=i, shard_count=3)
+                             for i in range(3)])
+
+    def test_indexed_lazy(self):
+        shards = [self._load(lazy=True, index=True, shard_index=i,
+                             shard_count=3) for i in range(3)]
+        self._assert_shards(shards)
+        self.assertEqual(len(shards[2]), 34)
+
+        np.random.seed(42)
+        shards[2].shuffle()
+        sources = list(shards[2].get_series("source"))
+        self.assertNotEqual(sources, SOURCE[66:])
+        self.assertEqual(sorted(sources), sorted(SOURCE[66:]))
+
+    def test_lazy_striding(self):
+        dataset = self._load(lazy=True)
+        shards = [dataset.shard(i, 3) for i in range(3)]
+
+        for i, shard in enumerate(shards):
+            self.assertEqual(list(shard.get_series("source")), SOURCE[i::3])
+            self.assertEqual(
+                list(shard.get_series("chars")),
+                [preprocess_char_based(s) for s in SOURCE[i::3]])
+
+    def test_lazy_striding_parses_shard_lines(self):
+        parsed = []
+
+        def parse_line(line):
+            parsed.append(line)
+            return UtfPlainTextReader.parse_line(line)
+
+        def reader(files):
+            raise AssertionError("The whole files should not be parsed.")
+
+        reader.parse_line = parse_line
+        dataset = LazyDataset("test",
+                              {"source": ([self.paths["source"]], reader)}, {})
+
+        self.assertEqual(list(dataset.shard(1, 3).get_series("source")),
+                         SOURCE[1::3])
+        self.assertEqual(len(parsed), len(SOURCE[1::3]))
+
+    def test_invalid_shard(self):
+        with self.assertRaises(ValueError):
+            _create_dataset().shard(3, 3)
+
+
+class TestMixedDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.main = _create_dataset()
+        self.auxiliary = Dataset("aux", {"source": SOURCE[:20],
+                                         "tags": TARGET[:20]}, {})
+
+    def _source_names(self, batches):
+        return [b.name.split("-batch-")[0] for b in batches]
+
+    def test_batches_from_single_source(self):
+        np.random.seed(42)
+        mixed = MixedDataset("mixed", [self.main, self.auxiliary])
+        batches = list(mixed.batch_dataset(10))
+
+        self.assertEqual(sum(len(b) for b in batches), 120)
+        for batch in batches:
+            self.assertEqual(batch.has_series("tags"),
+                             batch.name.startswith("aux"))
+            self.assertEqual(batch.has_series("target"),
+                             batch.name.startswith("test"))
+
+    def test_weights(self):
+        np.random.seed(42)
+        mixed = MixedDataset("mixed", [self.main, self.auxiliary],
+                             weights=[1, 3], epoch_size=4000)
+        names = self._source_names(mixed.batch_dataset(10))
+
+        # the small dataset is oversampled, so it is reshuffled repeatedly
+        self.assertAlmostEqual(names.count("aux") / len(names), 0.75,
+                               delta=0.05)
+
+    def test_temperature(self):
+        uniform = MixedDataset("mixed", [self.main, self.auxiliary],
+                               temperature=1e6)
+        np.testing.assert_allclose(uniform.probabilities, [0.5, 0.5],
+                                   rtol=1e-5)
+
+        proportional = MixedDataset("mixed", [self.main, self.auxiliary])
+        np.testing.assert_allclose(proportional.probabilities,
+                                   [100 / 120, 20 / 120])
+
+    def test_series(self):
+        mixed = MixedDataset("mixed", [self.main, self.auxiliary])
+
+        self.assertEqual(list(mixed.series_ids),
+                         ["source", "target", "tags"])
+        self.assertTrue(mixed.has_series("tags"))
+        self.assertEqual(len(list(mixed.get_series("source"))), 120)
+        self.assertIsNone(mixed.get_series("chars", allow_none=True))
+
+    def test_invalid_weights(self):
+        with self.assertRaises(ValueError):
+            MixedDataset("mixed", [self.main], weights=[1, 1])
+        with self.assertRaises(ValueError):
+            MixedDataset("mixed", [self.main], weights=[0])
+
+    def test_streaming_source_needs_weights_and_epoch_size(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "source.txt")
+            with open(path, "w", encoding="utf-8") as f_data:
+                f_data.write("a b c\n")
+            lazy = LazyDataset(
+                "lazy", {"source": ([path], UtfPlainTextReader)}, {})
+
+            with self.assertRaisesRegex(ValueError, "epoch_size"):
+                MixedDataset("mixed", [self.main, lazy])
+            with self.assertRaisesRegex(ValueError, "epoch_size"):
+                MixedDataset("mixed", [self.main, lazy], weights=[1, 1])
+            with self.assertRaisesRegex(ValueError, "epoch_size"):
+                MixedDataset("mixed", [self.main, lazy], epoch_size=10)
+
+            mixed = MixedDataset("mixed", [self.main, lazy],
+                                 weights=[1, 1], epoch_size=10)
+            self.assertEqual(len(mixed), 10)
+
+
+class TestInternedSeries(LazyDatasetFiles, unittest.TestCase):
+
+    def _load(self, **kwargs):
+        return load_dataset_from_files(
+            s_source=self.paths["source"], s_target=self.paths["target"],
+            preprocessors=[("source", "chars", preprocess_char_based)],
+            pre_edits=Preprocess("source", "target"),
+            intern_tokens=True, **kwargs)
+
+    def test_items_are_lists(self):
+        series = intern_series(SOURCE, StringTable())
+
+        self.assertIsInstance(series, InternedSeries)
+        self.assertEqual(series[3], SOURCE[3])
+        self.assertEqual(list(series), SOURCE)
+        self.assertEqual(list(series[10:20]), SOURCE[10:20])
+        self.assertEqual(list(series[[5, 1, 5]]),
+                         [SOURCE[5], SOURCE[1], SOURCE[5]])
+        self.assertEqual(series.lengths.tolist(),
+                         [len(s) for s in SOURCE])
+
+    def test_fallback_to_list(self):
+        series = intern_series([["a", "b"], ["c"], "not a list"],
+                               StringTable())
+        self.assertEqual(series, [["a", "b"], ["c"], "not a list"])
+
+    def test_loaded_dataset(self):
+        dataset = self._load()
+
+        for name in ["source", "target", "chars", "edits"]:
+            self.assertIsInstance(dataset.get_series(name), InternedSeries)
+        self.assertEqual(list(dataset.get_series("source")), SOURCE)
+        self.assertEqual(list(dataset.get_series("chars")),
+                         [preprocess_char_based(s) for s in SOURCE])
+
+    def test_shuffled_batches(self):
+        np.random.seed(42)
+        dataset = self._load(preprocess_workers=2)
+        dataset.shuffle()
+
+        batches = list(dataset.batch_dataset(10, bucket_window=3))
+        pairs = [(src, tgt) for batch in batches
+                 for src, tgt in zip(batch.get_series("source"),
+                                     batch.get_series("target"))]
+        self.assertEqual(len(pairs), len(SOURCE))
+        for src, tgt in pairs:
+            self.assertEqual(src, tgt[1:])
+
+    def test_shards(self):
+        shards = [self._load(shard_index=i, shard_count=3) for i in range(3)]
+        self.assertEqual([s for shard in shards
+                          for s in shard.get_series("source")], SOURCE)
+
+
+if __name__ == "__main__":
+    unittest.main()
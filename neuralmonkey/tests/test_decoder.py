@@ -4,8 +4,12 @@
 
 import unittest
 
+import numpy as np
+import tensorflow as tf
+
+from neuralmonkey.dataset import Dataset
 from neuralmonkey.decoders.decoder import Decoder
-from neuralmonkey.vocabulary import Vocabulary
+from neuralmonkey.vocabulary import END_TOKEN_INDEX, Vocabulary
 
 
 class TestDecoder(unittest.TestCase):
@@ -22,6 +26,58 @@ class TestDecoder(unittest.TestCase):
             rnn_size=10)
         self.assertIsNotNone(decoder)
 
+    def test_max_length_ratio_without_sources(self):
+        with self.assertRaises(ValueError):
+            Decoder(
+                encoders=[],
+                vocabulary=Vocabulary(),
+                data_id="foo",
+                name="test-decoder-ratio",
+                max_output_len=5,
+                dropout_keep_prob=1.0,
+                embedding_size=10,
+                rnn_size=10,
+                max_length_ratio=1.5)
+
+    def _greedy_logprobs(self, favored_word, max_output_len):
+        """Decode a batch greedily with a decoder preferring a single word."""
+        vocabulary = Vocabulary()
+        vocabulary.add_word("a")
+
+        with tf.Graph().as_default():
+            decoder = Decoder(
+                encoders=[],
+                vocabulary=vocabulary,
+                data_id="foo",
+                name="test-decoder-greedy",
+                max_output_len=max_output_len,
+                dropout_keep_prob=1.0,
+                embedding_size=10,
+                rnn_size=10)
+
+            bias = np.zeros(len(vocabulary), dtype=np.float32)
+            bias[favored_word] = 10.
+            dataset = Dataset("test", {"foo": [["a"]] * 3}, {})
+
+            with tf.Session() as session:
+                session.run(tf.initialize_all_variables())
+                session.run([
+                    decoder.decoding_w.assign(
+                        tf.zeros_like(decoder.decoding_w)),
+                    decoder.decoding_b.assign(bias)])
+                return session.run(decoder.greedy_logprobs,
+                                   decoder.feed_dict(dataset))
+
+    def test_greedy_loop_stops_after_end(self):
+        logprobs = self._greedy_logprobs(END_TOKEN_INDEX, 5)
+        self.assertEqual(logprobs.shape, (1, 3, 5))
+        self.assertTrue(np.all(np.argmax(logprobs, 2) == END_TOKEN_INDEX))
+
+    def test_greedy_loop_stops_at_length_limit(self):
+        logprobs = self._greedy_logprobs(4, 5)
+        self.assertEqual(logprobs.shape, (5, 3, 5))
+        self.assertTrue(np.all(np.argmax(logprobs, 2) == 4))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3.5
+"""Unit tests for the parallel map over worker processes."""
+
+import threading
+import unittest
+
+from neuralmonkey.parallel import parallel_imap, parallel_map, threaded_imap
+
+ITEMS = list(range(50))
+
+
+def _square(value):
+    return value * value
+
+
+class TestParallelMap(unittest.TestCase):
+
+    def test_closure(self):
+        offset = 3
+        self.assertEqual(
+            parallel_map(lambda x: x + offset, ITEMS, 2, chunk_size=7),
+            [x + offset for x in ITEMS])
+
+    def test_early_close(self):
+        results = parallel_imap(_square, ITEMS, 2, chunk_size=3)
+        self.assertEqual(next(results), 0)
+        results.close()
+
+    def test_with_running_thread(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=stop.wait)
+        thread.start()
+        try:
+            # the workers are not forked, the closure is applied in this
+            # process and the picklable function by a fork server
+            self.assertEqual(
+                parallel_map(lambda x: -x, ITEMS, 2, chunk_size=7),
+                [-x for x in ITEMS])
+            self.assertEqual(parallel_map(_square, ITEMS, 2, chunk_size=7),
+                             [_square(x) for x in ITEMS])
+        finally:
+            stop.set()
+            thread.join()
+
+
+class TestThreadedMap(unittest.TestCase):
+
+    def test_order(self):
+        offset = 3
+        self.assertEqual(
+            list(threaded_imap(lambda x: x + offset, ITEMS, 3, chunk_size=4)),
+            [x + offset for x in ITEMS])
+
+    def test_early_close(self):
+        results = threaded_imap(_square, ITEMS, 2, chunk_size=3)
+        self.assertEqual(next(results), 0)
+        results.close()
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            list(threaded_imap(_square, ITEMS, -1))
+        with self.assertRaises(ValueError):
+            list(threaded_imap(_square, ITEMS, 1, chunk_size=0))
+
+
+if __name__ == "__main__":
+    unittest.main()
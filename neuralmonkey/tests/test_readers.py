@@ -0,0 +1,276 @@
+#!/usr/bin/env python3.5
+"""Unit tests for the readers of compressed text, numpy arrays and images."""
+
+import bz2
+import functools
+import gzip
+import lzma
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import numpy as np
+
+from neuralmonkey.caching import object_fingerprint
+from neuralmonkey.dataset import Dataset, load_dataset_from_files
+from neuralmonkey.readers.image_reader import image_reader, imagenet_reader
+from neuralmonkey.readers.compiled_reader import get_compiled_reader
+from neuralmonkey.readers.compression import (detect_compression,
+                                              read_line_batches)
+from neuralmonkey.readers.line_index import compute_line_offsets
+from neuralmonkey.readers.numpy_reader import (mmap_numpy_reader,
+                                               numpy_reader, ShardedArray)
+from neuralmonkey.readers.plain_text_reader import (get_plain_text_reader,
+                                                    UtfPlainTextReader)
+from neuralmonkey.vocabulary import Vocabulary
+
+CORPUS = "příliš žluťoučký kůň\n\núpěl ďábelské ódy\nbez konce"
+SENTENCES = [line.split(" ") for line in CORPUS.split("\n")]
+
+
+class TestCompressedText(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        data = CORPUS.encode("utf-8")
+        self.paths = {}
+        for name, compress in [(None, lambda x: x),
+                               ("gzip", gzip.compress),
+                               ("bz2", bz2.compress),
+                               ("xz", lzma.compress)]:
+            path = os.path.join(self.tmp_dir.name, "corpus.{}".format(name))
+            with open(path, "wb") as f_data:
+                f_data.write(compress(data))
+            self.paths[name] = path
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_detect_compression(self):
+        for name, path in self.paths.items():
+            self.assertEqual(detect_compression(path), name)
+
+    def test_reader(self):
+        for path in self.paths.values():
+            self.assertEqual(list(UtfPlainTextReader([path])), SENTENCES)
+
+    def test_lines_split_between_blocks(self):
+        for path in self.paths.values():
+            lines = [line for batch in read_line_batches(path, block_size=5)
+                     for line in batch]
+            self.assertEqual(b"\n".join(lines), CORPUS.encode("utf-8"))
+
+    def test_multiple_files(self):
+        self.assertEqual(
+            list(UtfPlainTextReader([self.paths["gzip"], self.paths["xz"]])),
+            SENTENCES + SENTENCES)
+
+    def test_decoded_lines_split_between_blocks(self):
+        path = os.path.join(self.tmp_dir.name, "corpus.utf16")
+        with open(path, "wb") as f_data:
+            f_data.write(gzip.compress(CORPUS.encode("utf-16")))
+
+        lines = [line for batch in read_line_batches(path, block_size=5,
+                                                     encoding="utf-16")
+                 for line in batch]
+        self.assertEqual(lines, CORPUS.split("\n"))
+
+        reader = get_plain_text_reader("utf-16")
+        self.assertEqual(list(reader([path])), SENTENCES)
+        self.assertFalse(hasattr(reader, "parse_line"))
+
+    def test_carriage_returns(self):
+        path = os.path.join(self.tmp_dir.name, "corpus.cr")
+        with open(path, "wb") as f_data:
+            f_data.write(b"a b\r\nc\rd e\r\r\nf\r")
+
+        for block_size in [1, 2, 3, 100]:
+            batches = read_line_batches(path, block_size=block_size,
+                                        encoding="utf-8")
+            lines = [line for batch in batches for line in batch]
+            self.assertEqual(lines, ["a b", "c", "d e", "", "f"])
+
+            raw_lines = [line for batch in read_line_batches(
+                path, block_size=block_size) for line in batch]
+            self.assertEqual(raw_lines, [b"a b", b"c", b"d e", b"", b"f"])
+
+            with unittest.mock.patch(
+                    "neuralmonkey.readers.line_index._CHUNK_SIZE",
+                    block_size):
+                self.assertEqual(compute_line_offsets(path).tolist(),
+                                 [0, 5, 7, 11, 13, 15])
+
+    def test_carriage_returns_in_datasets(self):
+        path = os.path.join(self.tmp_dir.name, "corpus.cr")
+        with open(path, "wb") as f_data:
+            f_data.write(b"a b\r\nc\rd e\r\r\nf\rg")
+        sentences = list(UtfPlainTextReader([path]))
+        self.assertEqual(len(sentences), 6)
+
+        # the raw lines are parsed by the workers or read by the index
+        parallel = load_dataset_from_files(s_text=path, preprocess_workers=2)
+        indexed = load_dataset_from_files(s_text=path, lazy=True, index=True)
+        self.assertEqual(list(parallel.get_series("text")), sentences)
+        self.assertEqual(list(indexed.get_series("text")), sentences)
+
+
+class TestCompiledReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "corpus.txt")
+        with open(self.path, "w", encoding="utf-8") as f_data:
+            f_data.write(CORPUS)
+
+        self.vocabulary = Vocabulary()
+        for sentence in SENTENCES[:2]:
+            self.vocabulary.add_tokenized_text(sentence)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_items_are_tokens(self):
+        reader = get_compiled_reader(self.vocabulary)
+        for _ in range(2):
+            series = reader([self.path])
+            self.assertEqual(list(series), SENTENCES[:2] + [
+                ["<unk>"] * len(sent) for sent in SENTENCES[2:]])
+            self.assertEqual(list(series[1:3]), list(series)[1:3])
+
+    def test_tensor_from_compiled_series(self):
+        series = get_compiled_reader(self.vocabulary)([self.path])
+        dataset = Dataset("compiled", {"text": series}, {})
+        np.random.seed(0)
+        dataset.shuffle()
+        batch = list(dataset.batch_dataset(3))[0]
+
+        vectors, weights = self.vocabulary.sentences_to_tensor(
+            batch.get_series("text"), 10, add_end_symbol=True)
+        text_vectors, text_weights = self.vocabulary.sentences_to_tensor(
+            [list(sent) for sent in batch.get_series("text")], 10,
+            add_end_symbol=True)
+
+        self.assertTrue(np.array_equal(vectors, text_vectors))
+        self.assertTrue(np.array_equal(weights, text_weights))
+
+
+def _apply_scale(value):
+    return value * SCALE
+
+
+SCALE = 2
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def test_referenced_globals(self):
+        global SCALE  # pylint: disable=global-statement
+        fingerprint = object_fingerprint(_apply_scale)
+        self.assertEqual(object_fingerprint(_apply_scale), fingerprint)
+
+        SCALE = 3
+        try:
+            self.assertNotEqual(object_fingerprint(_apply_scale),
+                                fingerprint)
+        finally:
+            SCALE = 2
+
+    def test_referenced_names(self):
+        self.assertNotEqual(object_fingerprint(lambda x: x.lower()),
+                            object_fingerprint(lambda x: x.upper()))
+
+
+class TestNumpyReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data = np.arange(60, dtype=np.float32).reshape(20, 3)
+        self.paths = []
+        for i, (start, end) in enumerate([(0, 7), (7, 7), (7, 20)]):
+            path = os.path.join(self.tmp_dir.name, "shard{}.npy".format(i))
+            np.save(path, self.data[start:end])
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_concatenate(self):
+        self.assertTrue(np.array_equal(numpy_reader(self.paths), self.data))
+
+    def test_sharded_array(self):
+        array = mmap_numpy_reader(self.paths)
+
+        self.assertIsInstance(array, ShardedArray)
+        self.assertEqual(array.shape, self.data.shape)
+        self.assertTrue(np.array_equal(np.asarray(array), self.data))
+        self.assertTrue(np.array_equal(array[-1], self.data[-1]))
+        for index in [slice(2, 5), slice(5, 12), slice(0, 20, 3)]:
+            self.assertTrue(np.array_equal(np.asarray(array[index]),
+                                           self.data[index]))
+
+        indices = np.array([19, 0, 7, 6, 8])
+        self.assertTrue(np.array_equal(array[indices], self.data[indices]))
+
+    def test_shuffled_dataset(self):
+        np.random.seed(42)
+        dataset = Dataset("test", {"id": list(range(20)),
+                                   "vectors": mmap_numpy_reader(self.paths)},
+                          {})
+        dataset.shuffle()
+
+        for batch in dataset.batch_dataset(6):
+            vectors = batch.get_series("vectors")
+            self.assertIsInstance(vectors, np.ndarray)
+            self.assertTrue(np.array_equal(
+                vectors, self.data[list(batch.get_series("id"))]))
+
+
+class TestImageReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.list_file = os.path.join(self.tmp_dir.name, "images.txt")
+        with open("tests/data/flickr30k/train_images.txt") as f_images:
+            images = [next(f_images) for _ in range(5)]
+        with open(self.list_file, "w") as f_list:
+            f_list.writelines(images)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _read(self, reader_factory, **kwargs):
+        reader = reader_factory("tests/data/flickr30k", **kwargs)
+        return np.stack(list(reader([self.list_file])))
+
+    def test_parallel_decoding(self):
+        for factory in [functools.partial(image_reader, pad_w=32, pad_h=24),
+                        imagenet_reader]:
+            sequential = self._read(factory)
+            parallel = self._read(factory, num_workers=2)
+            self.assertEqual(len(sequential), 5)
+            self.assertTrue(np.array_equal(sequential, parallel))
+
+    def test_cache(self):
+        cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        expected = self._read(image_reader, pad_w=32, pad_h=24)
+
+        first = image_reader("tests/data/flickr30k", pad_w=32, pad_h=24,
+                             cache_dir=cache_dir)([self.list_file])
+        self.assertIsInstance(first, np.memmap)
+        self.assertEqual(first.dtype, np.uint8)
+        self.assertTrue(np.array_equal(first, expected))
+
+        image_reader("tests/data/flickr30k", pad_w=32, pad_h=24,
+                     cache_dir=cache_dir)([self.list_file])
+        image_reader("tests/data/flickr30k", pad_w=16, pad_h=24,
+                     cache_dir=cache_dir)([self.list_file])
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+        both = image_reader("tests/data/flickr30k", pad_w=32, pad_h=24,
+                            cache_dir=cache_dir)([self.list_file] * 2)
+        self.assertEqual(both.shape, (10, 24, 32, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3.5
+"""Unit tests for the beam search of the runtime RNN runner."""
+
+from types import SimpleNamespace
+import unittest
+
+import numpy as np
+
+from neuralmonkey.runners.rnn_runner import (
+    BeamHypotheses, RuntimeRnnExecutable, RuntimeRnnRunner, _backtrack,
+    likelihood_beam_score, n_best)
+from neuralmonkey.vocabulary import (END_TOKEN_INDEX, START_TOKEN_INDEX,
+                                     Vocabulary)
+
+_TABLE_SIZE = 101
+
+
+def _mix(state, token):
+    """Hash of the decoded prefix used as the state of the fake decoder."""
+    return (state * 31 + token + 7) % 10007
+
+
+class FakeModel(object):
+    """A decoder whose next word distribution depends on the whole prefix.
+
+    The decoder is run by ``run`` in the same way as the TensorFlow manager
+    runs the decoder graph, the sessions of an ensemble differ in the tables
+    of the log-probs.
+    """
+
+    def __init__(self, vocabulary_size, seeds, sessions=1):
+        random = np.random.RandomState(42)
+        tables = random.normal(scale=2.,
+                               size=[sessions, _TABLE_SIZE, vocabulary_size])
+        self.tables = tables - np.logaddexp.reduce(tables, axis=2,
+                                                   keepdims=True)
+        self.seeds = np.asarray(seeds)
+        self.decoder = SimpleNamespace(
+            step_logprobs="logprobs", step_next_state=["state"],
+            step_cache=["cache"], step_inputs="inputs", step_state=["state"],
+            train_loss="xent", max_output_len=None)
+
+    def logprobs(self, session, state, seed):
+        return self.tables[session, (state + seed) % _TABLE_SIZE]
+
+    def ensemble_logprobs(self, state, seed):
+        """The averaged distribution of all sessions (for the reference)."""
+        logprobs = [self.logprobs(session, state, seed)
+                    for session in range(len(self.tables))]
+        return np.logaddexp.reduce(logprobs, axis=0) - np.log(len(logprobs))
+
+    def run(self, executable):
+        """Run the executable until it has a result.
+
+        Returns:
+            The number of the decoding steps.
+        """
+        steps = 0
+        while executable.result is None:
+            _, to_run, feed_dicts = executable.next_to_execute()
+            results = []
+            for session in range(len(self.tables)):
+                feed_dict = (feed_dicts[session]
+                             if isinstance(feed_dicts, list) else feed_dicts)
+                results.append(self._run_session(session, to_run, feed_dict))
+            executable.collect_results(results)
+            steps += 1
+        return steps
+
+    def _run_session(self, session, to_run, feed_dict):
+        if not feed_dict:
+            seeds = self.seeds
+            states = _mix(seeds, START_TOKEN_INDEX)
+        else:
+            seeds = feed_dict["cache"][:, 0]
+            states = _mix(feed_dict["state"], feed_dict["inputs"])
+
+        result = {"logprobs": self.logprobs(session, states, seeds),
+                  "states": [states]}
+        if "cache" in to_run:
+            result["cache"] = [self.seeds[:, None]]
+        if "xent" in to_run:
+            result["xent"] = 0.
+        return result
+
+
+def _reference_beam_search(model, seed, beam_size, max_output_len):
+    """Beam search of a single instance which never stops early."""
+    live = [((), 0., seed, START_TOKEN_INDEX)]
+    finished_score, finished_tokens = -np.inf, None
+
+    for _ in range(max_output_len):
+        candidates = []
+        for tokens, logprob_sum, state, last_token in live:
+            next_state = _mix(state, last_token)
+            logprobs = model.ensemble_logprobs(next_state, seed)
+            for token, logprob in enumerate(logprobs):
+                total = logprob_sum + logprob
+                score = likelihood_beam_score(total, len(tokens) + 1)
+                if token == END_TOKEN_INDEX:
+                    if score > finished_score:
+                        finished_score, finished_tokens = score, tokens
+                else:
+                    candidates.append((score, tokens + (token,), total,
+                                       next_state))
+        candidates.sort(key=lambda candidate: -candidate[0])
+        live = [candidate[1:] + (candidate[1][-1],)
+                for candidate in candidates[:beam_size]]
+
+    best_tokens, best_sum = live[0][:2]
+    if finished_score >= likelihood_beam_score(best_sum, len(best_tokens)):
+        return list(finished_tokens)
+    return list(best_tokens)
+
+
+class TestNBest(unittest.TestCase):
+
+    def test_first_step(self):
+        # the first step expands a single hypothesis for each instance
+        logprobs = np.log(np.array([[[.05, .15, .3, .1, .4]],
+                                    [[.1, .25, .1, .4, .15]]]))
+        hypotheses, finished_scores = n_best(3, None, logprobs,
+                                             likelihood_beam_score)
+
+        self.assertEqual(hypotheses.parents.tolist(), [[0, 0, 0], [0, 0, 0]])
+        self.assertEqual(hypotheses.tokens.tolist(), [[4, 1, 3], [3, 1, 4]])
+        self.assertTrue(np.allclose(hypotheses.logprob_sums[:, 0],
+                                    np.log([.4, .4])))
+        self.assertEqual(hypotheses.lengths.tolist(), [[1, 1, 1], [1, 1, 1]])
+        self.assertTrue(np.allclose(finished_scores,
+                                    np.log([[.3], [.1]])))
+
+    def test_expansions_of_beam(self):
+        previous = BeamHypotheses(parents=np.zeros([1, 2], dtype=np.int64),
+                                  tokens=np.array([[3, 4]]),
+                                  logprob_sums=np.log([[.5, .25]]),
+                                  lengths=np.array([[1, 1]]))
+        logprobs = np.log(np.array([[[.1, .1, .2, .6],
+                                     [.1, .1, .1, .7]]]))
+        hypotheses, finished_scores = n_best(2, previous, logprobs,
+                                             likelihood_beam_score)
+
+        self.assertEqual(hypotheses.parents.tolist(), [[0, 1]])
+        self.assertEqual(hypotheses.tokens.tolist(), [[3, 3]])
+        self.assertTrue(np.allclose(hypotheses.logprob_sums,
+                                    np.log([[.3, .175]])))
+        self.assertEqual(hypotheses.lengths.tolist(), [[2, 2]])
+        self.assertTrue(np.allclose(finished_scores,
+                                    np.log([[.1, .025]]) - np.log(2)))
+
+    def test_beam_wider_than_expansions(self):
+        logprobs = np.log(np.full([2, 1, 5], .2))
+        hypotheses, _ = n_best(8, None, logprobs, likelihood_beam_score)
+
+        self.assertEqual(hypotheses.tokens.shape, (2, 8))
+        self.assertEqual(hypotheses.parents.tolist(), [[0] * 8] * 2)
+        self.assertTrue(np.all(np.isfinite(hypotheses.logprob_sums[:, :4])))
+        self.assertTrue(np.all(hypotheses.logprob_sums[:, 4:] == -np.inf))
+
+
+class TestBacktrack(unittest.TestCase):
+
+    def test_back_pointers(self):
+        # one instance, beam of two, three steps
+        history = [
+            BeamHypotheses(parents=np.array([[0, 0]]),
+                           tokens=np.array([[5, 6]]),
+                           logprob_sums=None, lengths=None),
+            BeamHypotheses(parents=np.array([[1, 0]]),
+                           tokens=np.array([[7, 8]]),
+                           logprob_sums=None, lengths=None),
+            BeamHypotheses(parents=np.array([[1, 0]]),
+                           tokens=np.array([[9, 10]]),
+                           logprob_sums=None, lengths=None)]
+
+        self.assertEqual(
+            _backtrack(history, np.array([3]), np.array([0]))[:, 0].tolist(),
+            [5, 8, 9])
+        self.assertEqual(
+            _backtrack(history, np.array([3]), np.array([1]))[:, 0].tolist(),
+            [6, 7, 10])
+        # a hypothesis finished after the second word is padded
+        self.assertEqual(
+            _backtrack(history, np.array([2]), np.array([1]))[:, 0].tolist(),
+            [5, 8, END_TOKEN_INDEX])
+
+
+class TestRuntimeRnnExecutable(unittest.TestCase):
+
+    def setUp(self):
+        self.vocabulary = Vocabulary()
+        self.vocabulary.add_tokenized_text(["a", "b", "c"])
+        self.seeds = [3, 17, 42, 99, 1234]
+
+    def _decode(self, model, beam_size, max_output_len):
+        model.decoder.max_output_len = max_output_len
+        executable = RuntimeRnnExecutable(
+            [], model.decoder, self.vocabulary,
+            beam_scoring_f=likelihood_beam_score, postprocess=None,
+            beam_size=beam_size, compute_loss=True)
+        steps = model.run(executable)
+
+        outputs = [[self.vocabulary.get_word_index(word) for word in sent]
+                   for sent in executable.result.outputs]
+        references = [_reference_beam_search(model, seed, beam_size,
+                                             max_output_len)
+                      for seed in self.seeds]
+        return outputs, references, steps
+
+    def test_early_stop_same_as_full_search(self):
+        for beam_size in [1, 2, 4]:
+            outputs, references, steps = self._decode(
+                FakeModel(len(self.vocabulary), self.seeds), beam_size, 30)
+            self.assertEqual(outputs, references)
+            self.assertLess(steps, 30)
+
+    def test_length_limit(self):
+        outputs, references, steps = self._decode(
+            FakeModel(len(self.vocabulary), self.seeds), 3, 2)
+        self.assertEqual(outputs, references)
+        self.assertEqual(steps, 2)
+
+    def test_ensemble(self):
+        outputs, references, _ = self._decode(
+            FakeModel(len(self.vocabulary), self.seeds, sessions=2), 3, 30)
+        self.assertEqual(outputs, references)
+
+    def test_beam_wider_than_vocabulary(self):
+        outputs, references, _ = self._decode(
+            FakeModel(len(self.vocabulary), self.seeds), 8, 6)
+        self.assertEqual(outputs, references)
+
+
+class TestRuntimeRnnRunner(unittest.TestCase):
+
+    def test_scoring_function_signature(self):
+        # the decoder is not used before the runner is executed
+        decoder = object()
+        RuntimeRnnRunner("out", decoder, beam_scoring_f=likelihood_beam_score)
+        RuntimeRnnRunner("out", decoder,
+                         beam_scoring_f=lambda sums, lengths, alpha=1.: sums)
+        RuntimeRnnRunner("out", decoder, beam_scoring_f=np.subtract)
+
+        # pylint: disable=unused-argument
+        def old_score(decoded, logprobs):
+            return logprobs.sum(axis=1)
+
+        for function in [old_score, lambda sums: sums,
+                         lambda sums, lengths, alpha: sums]:
+            with self.assertRaisesRegex(ValueError, r"\(logprob_sums, "):
+                RuntimeRnnRunner("out", decoder, beam_scoring_f=function)
+
+
+if __name__ == "__main__":
+    unittest.main()
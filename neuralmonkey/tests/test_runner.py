@@ -0,0 +1,50 @@
+#!/usr/bin/env python3.5
+"""Unit tests for the greedy runner."""
+
+import unittest
+
+import numpy as np
+
+from neuralmonkey.runners.runner import GreedyRunExecutable
+from neuralmonkey.vocabulary import END_TOKEN_INDEX, Vocabulary
+
+
+def _step_logprobs(*words):
+    """Log-probs of a step preferring the given word of each instance."""
+    probs = np.full([len(words), 6], .1)
+    probs[np.arange(len(words)), words] = .5
+    return np.log(probs)
+
+
+class TestGreedyRunExecutable(unittest.TestCase):
+
+    def setUp(self):
+        self.vocabulary = Vocabulary()
+        self.vocabulary.add_tokenized_text(["a", "b"])
+
+    def test_ensemble_of_different_lengths(self):
+        executable = GreedyRunExecutable([], {}, self.vocabulary, None)
+        word_a = self.vocabulary.get_word_index("a")
+        word_b = self.vocabulary.get_word_index("b")
+
+        # the first session ends both outputs in the second step, the second
+        # one outweighs it for the first instance and decodes one more step
+        first = {"train_xent": 1., "runtime_xent": 2.,
+                 "decoded_logprobs": [_step_logprobs(word_a, word_b),
+                                      _step_logprobs(END_TOKEN_INDEX,
+                                                     END_TOKEN_INDEX)]}
+        second = {"train_xent": 3., "runtime_xent": 4.,
+                  "decoded_logprobs": [_step_logprobs(word_a, word_b),
+                                       np.log(np.array(
+                                           [[.01, .01, .2, .01, .8, .01],
+                                            [.01, .01, .4, .01, .01, .6]])),
+                                       _step_logprobs(word_b, word_a)]}
+        executable.collect_results([first, second])
+
+        self.assertEqual(executable.result.outputs,
+                         [["a", "a", "b"], ["b"]])
+        self.assertEqual(executable.result.losses, [4., 6.])
+
+
+if __name__ == "__main__":
+    unittest.main()
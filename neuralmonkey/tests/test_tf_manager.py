@@ -0,0 +1,69 @@
+#!/usr/bin/env python3.5
+"""Unit tests for the background preparation of the feed dictionaries."""
+
+import threading
+import unittest
+
+from neuralmonkey.tf_manager import FeedDictPrefetcher
+
+
+class FakeCoder(object):
+    """A coder which records the batches it prepares."""
+
+    def __init__(self, fail_on=None):
+        self.prepared = []
+        self.fail_on = fail_on
+        self.lock = threading.Lock()
+
+    def feed_dict(self, dataset, train=False):
+        if dataset == self.fail_on:
+            raise ValueError("Cannot prepare batch {}".format(dataset))
+        with self.lock:
+            self.prepared.append(dataset)
+        return {"batch": dataset, "train": train}
+
+
+class TestFeedDictPrefetcher(unittest.TestCase):
+
+    def test_batches_in_order(self):
+        coder = FakeCoder()
+        prefetcher = FeedDictPrefetcher(range(10), {coder}, True, 3)
+
+        self.assertEqual(list(prefetcher),
+                         [(i, {"batch": i, "train": True})
+                          for i in range(10)])
+        self.assertEqual(coder.prepared, list(range(10)))
+
+    def test_wait_until_idle(self):
+        for queue_size in [1, 3]:
+            coder = FakeCoder()
+            prefetcher = FeedDictPrefetcher(range(10), {coder}, False,
+                                            queue_size)
+            for consumed in range(1, 11):
+                next(prefetcher)
+                prefetcher.wait_until_idle()
+                # the producer stays at the same batch until the next read
+                self.assertEqual(len(coder.prepared),
+                                 min(consumed + queue_size, 10))
+            prefetcher.close()
+
+    def test_error_after_prepared_batches(self):
+        prefetcher = FeedDictPrefetcher(range(10), {FakeCoder(fail_on=2)},
+                                        False, 5)
+        self.assertEqual([batch for batch, _ in
+                          [next(prefetcher), next(prefetcher)]], [0, 1])
+        with self.assertRaises(ValueError):
+            next(prefetcher)
+
+    def test_close(self):
+        coder = FakeCoder()
+        prefetcher = FeedDictPrefetcher(range(100), {coder}, False, 2)
+        next(prefetcher)
+        prefetcher.close()
+
+        self.assertLessEqual(len(coder.prepared), 3)
+        self.assertFalse(prefetcher._producer.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
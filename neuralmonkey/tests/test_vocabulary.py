@@ -1,8 +1,16 @@
 #!/usr/bin/env python3.5
 
+import os
+import pickle
+import tempfile
 import unittest
 
-from neuralmonkey.vocabulary import Vocabulary
+import numpy as np
+
+from neuralmonkey.dataset import Dataset, load_dataset_from_files
+from neuralmonkey.interned_series import StringTable, intern_series
+from neuralmonkey.vocabulary import (Vocabulary, from_dataset, from_file,
+                                     from_wordlist, UNK_TOKEN_INDEX)
 
 CORPUS = [
     "the colorless ideas slept furiously",
@@ -45,6 +53,260 @@ class TestVocabulary(unittest.TestCase):
                 zip(TOKENIZED_CORPUS, senteces_again):
             self.assertSequenceEqual(orig_sentence, reconstructed_sentence)
 
+    def test_compiled_sentences(self):
+        compiled = [np.array([VOCABULARY.get_word_index(w) for w in s],
+                             dtype=np.int32) for s in TOKENIZED_CORPUS]
+
+        vectors, weights = VOCABULARY.sentences_to_tensor(
+            TOKENIZED_CORPUS, 20, add_end_symbol=True)
+        compiled_vectors, compiled_weights = VOCABULARY.sentences_to_tensor(
+            compiled, 20, add_end_symbol=True)
+
+        self.assertTrue(np.array_equal(vectors, compiled_vectors))
+        self.assertTrue(np.array_equal(weights, compiled_weights))
+
+    def test_tensor_padding_and_symbols(self):
+        sentences = [["the", "walrus"], ["jindrisek"], ["pooh"] * 5]
+        vectors, weights = VOCABULARY.sentences_to_tensor(
+            sentences, 4, add_start_symbol=True, add_end_symbol=True)
+
+        index = VOCABULARY.get_word_index
+        self.assertEqual(vectors.dtype, np.int32)
+        self.assertEqual(weights.dtype, np.float32)
+        self.assertEqual(vectors.T.tolist(), [
+            [index("<s>"), index("the"), index("walrus"), index("</s>"),
+             index("<pad>")],
+            [index("<s>"), index("<unk>"), index("</s>"), index("<pad>"),
+             index("<pad>")],
+            [index("<s>")] + [index("pooh")] * 4])
+        self.assertEqual(weights.T.tolist(), [[1, 1, 1, 1, 0],
+                                              [1, 1, 1, 0, 0],
+                                              [1, 1, 1, 1, 1]])
+
+    def test_tensor_batch_max_len(self):
+        vectors, weights = VOCABULARY.sentences_to_tensor(
+            [["the"], ["pooh", "slept"]], 10, pad_to_max_len=False,
+            add_end_symbol=True)
+
+        self.assertEqual(vectors.shape, (3, 2))
+        self.assertEqual(weights.sum(axis=0).tolist(), [2, 3])
+
+    def test_unk_sampling(self):
+        vocabulary = Vocabulary(unk_sample_prob=1.0)
+        vocabulary.add_tokenized_text(["frequent", "frequent", "rare"])
+
+        vectors, _ = vocabulary.sentences_to_tensor(
+            [["frequent", "rare"]], train_mode=True)
+        self.assertEqual(vectors[:, 0].tolist(),
+                         [vocabulary.get_word_index("frequent"),
+                          vocabulary.get_word_index("<unk>")])
+
+        vocabulary.add_word("rare")
+        vectors, _ = vocabulary.sentences_to_tensor(
+            [["frequent", "rare"]], train_mode=True)
+        self.assertEqual(vectors[:, 0].tolist(),
+                         [vocabulary.get_word_index("frequent"),
+                          vocabulary.get_word_index("rare")])
+
+    def test_interned_sentences(self):
+        sentences = TOKENIZED_CORPUS + [["jindrisek", "the"]]
+        interned = intern_series(sentences, StringTable())
+
+        for kwargs in [dict(max_len=3, add_start_symbol=True),
+                       dict(max_len=20, add_end_symbol=True),
+                       dict(pad_to_max_len=False, add_end_symbol=True)]:
+            vectors, weights = VOCABULARY.sentences_to_tensor(
+                [sentences[i] for i in [4, 0, 5]], **kwargs)
+            interned_vectors, interned_weights = (
+                VOCABULARY.sentences_to_tensor(interned[[4, 0, 5]], **kwargs))
+
+            self.assertEqual(interned_vectors.tolist(), vectors.tolist())
+            self.assertEqual(interned_weights.tolist(), weights.tolist())
+
+    def test_iterable_sentences(self):
+        vectors, weights = VOCABULARY.sentences_to_tensor(
+            TOKENIZED_CORPUS, 20)
+        iter_vectors, iter_weights = VOCABULARY.sentences_to_tensor(
+            iter(TOKENIZED_CORPUS), 20)
+
+        self.assertEqual(iter_vectors.tolist(), vectors.tolist())
+        self.assertEqual(iter_weights.tolist(), weights.tolist())
+
+    def test_vectors_truncated_at_end(self):
+        index = VOCABULARY.get_word_index
+        vectors = np.array([[index("the"), index("</s>"), index("pooh")],
+                            [index("walrus"), index("the"), index("slept")],
+                            [index("</s>"), index("the"), index("</s>")]],
+                           dtype=np.int32)
+
+        self.assertEqual(VOCABULARY.vectors_to_sentences(vectors),
+                         [["the", "walrus"], [], ["pooh", "slept"]])
+        self.assertEqual(VOCABULARY.vectors_to_sentences(list(vectors)),
+                         [["the", "walrus"], [], ["pooh", "slept"]])
+
+        indices = VOCABULARY.vectors_to_sentences(vectors,
+                                                  return_indices=True)
+        self.assertEqual([i.tolist() for i in indices],
+                         [[index("the"), index("walrus")], [],
+                          [index("pooh"), index("slept")]])
+
+
+class TestVocabularyFromDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.dataset = Dataset("corpus", {"text": TOKENIZED_CORPUS * 3}, {})
+
+    def test_counts(self):
+        vocabulary = from_dataset([self.dataset], ["text", "missing"], 100)
+
+        self.assertEqual(vocabulary.word_count["walrus"], 6)
+        self.assertEqual(vocabulary.word_count["pooh"], 3)
+        self.assertEqual(len(vocabulary), len(VOCABULARY))
+
+    def test_truncation(self):
+        vocabulary = from_dataset([self.dataset], ["text"], 4)
+
+        self.assertEqual(vocabulary.index_to_word[:4],
+                         ["<pad>", "<s>", "</s>", "<unk>"])
+        # five words occur six times, the others less often
+        self.assertEqual(len(vocabulary), 8)
+        for word in vocabulary.index_to_word[4:]:
+            self.assertEqual(vocabulary.word_count[word], 6)
+        for index, word in enumerate(vocabulary.index_to_word):
+            self.assertEqual(vocabulary.get_word_index(word), index)
+
+    def test_parallel_counts(self):
+        for max_size in [100, 4]:
+            vocabulary = from_dataset([self.dataset], ["text"], max_size)
+            parallel = from_dataset([self.dataset], ["text"], max_size,
+                                    num_workers=2)
+            self.assertEqual(parallel.word_count, vocabulary.word_count)
+            self.assertEqual(parallel.index_to_word,
+                             vocabulary.index_to_word)
+
+    def test_first_occurrence_order(self):
+        # the words are indexed in the same order as if added one by one
+        first, second = TOKENIZED_CORPUS[:3] * 2, TOKENIZED_CORPUS[3:] * 3
+        dataset = Dataset("corpus", {"a": first, "b": second}, {})
+        # the order of the string table is not the order of the occurrences
+        interned = Dataset("interned", {
+            "a": intern_series(first, StringTable(["be", "hero"])),
+            "b": intern_series(second, StringTable())}, {})
+        expected = Vocabulary()
+        for sentence in first + second:
+            expected.add_tokenized_text(sentence)
+
+        for data in [dataset, interned]:
+            for num_workers in [0, 2, 3]:
+                vocabulary = from_dataset([data], ["a", "b"], 100,
+                                          num_workers=num_workers)
+                self.assertEqual(vocabulary.index_to_word,
+                                 expected.index_to_word)
+                self.assertEqual(vocabulary.word_count, expected.word_count)
+
+    def test_interned_counts(self):
+        interned = Dataset(
+            "interned", {"text": intern_series(TOKENIZED_CORPUS * 3,
+                                               StringTable())}, {})
+        self.assertEqual(
+            from_dataset([interned], ["text"], 100).word_count,
+            from_dataset([self.dataset], ["text"], 100).word_count)
+        self.assertEqual(
+            from_dataset([interned.shard(1, 3)], ["text"], 4).index_to_word,
+            from_dataset([self.dataset.shard(1, 3)], ["text"],
+                         4).index_to_word)
+        self.assertEqual(
+            from_dataset([interned.shard(1, 3)], ["text"], 100).word_count,
+            from_dataset([self.dataset.shard(1, 3)], ["text"],
+                         100).word_count)
+
+    def test_lazy_dataset(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "text.txt")
+            with open(path, "w") as f_text:
+                f_text.write("\n".join(CORPUS) + "\n")
+
+            lazy = load_dataset_from_files(s_text=path, lazy=True)
+            vocabulary = from_dataset([lazy], ["text"], 100, num_workers=2)
+            # the counts of the striding shards are merged by the lines
+            strided = from_dataset([lazy], ["text"], 100, num_workers=3)
+            truncated = from_dataset([lazy], ["text"], 6, num_workers=3)
+            sequential = from_dataset([lazy], ["text"], 6)
+
+        self.assertEqual(vocabulary.word_count, VOCABULARY.word_count)
+        self.assertEqual(strided.index_to_word, VOCABULARY.index_to_word)
+        self.assertEqual(truncated.index_to_word, sequential.index_to_word)
+
+
+class TestVocabularyFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "vocab")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _assert_same(self, vocabulary, loaded):
+        self.assertEqual(loaded.index_to_word, vocabulary.index_to_word)
+        self.assertEqual(loaded.word_to_index, vocabulary.word_to_index)
+        self.assertEqual(loaded.word_count, vocabulary.word_count)
+        self.assertEqual(loaded.unk_sample_prob, vocabulary.unk_sample_prob)
+
+    def test_save_and_load(self):
+        vocabulary = Vocabulary(["příliš", "žluťoučký", "kůň", "kůň", ""],
+                                unk_sample_prob=0.5)
+        vocabulary.save_to_file(self.path)
+        self._assert_same(vocabulary, from_file(self.path))
+
+        with self.assertRaises(FileExistsError):
+            vocabulary.save_to_file(self.path)
+
+    def test_newline_in_word(self):
+        with self.assertRaises(ValueError):
+            Vocabulary(["new\nline"]).save_to_file(self.path)
+
+    def test_pickled_vocabulary(self):
+        with open(self.path, "wb") as f_pickle:
+            pickle.dump(VOCABULARY, f_pickle)
+        self._assert_same(VOCABULARY, from_file(self.path))
+
+    def test_pickled_by_older_version(self):
+        state = dict(VOCABULARY.__dict__)
+        state["word_count"] = state.pop("_word_count")
+        del state["_mapped_counts"]
+        with open(self.path, "wb") as f_pickle:
+            pickle.dump(state, f_pickle)
+        with open(self.path, "rb") as f_pickle:
+            vocabulary = Vocabulary.__new__(Vocabulary)
+            vocabulary.__setstate__(pickle.load(f_pickle))
+        self._assert_same(VOCABULARY, vocabulary)
+
+    def test_memory_mapped_counts(self):
+        vocabulary = Vocabulary(["kůň", "kůň", "pes"], unk_sample_prob=1.)
+        vocabulary.save_to_file(self.path)
+        loaded = from_file(self.path)
+
+        self.assertIsInstance(loaded._mapped_counts, np.memmap)
+        self.assertIsNone(loaded._word_count)
+        # the unk sampling does not need the dictionary of the counts
+        self.assertEqual(loaded.get_unk_sampled_word_index("pes"),
+                         UNK_TOKEN_INDEX)
+        self.assertEqual(loaded.get_unk_sampled_word_index("kůň"),
+                         loaded.get_word_index("kůň"))
+        self.assertIsNone(loaded._word_count)
+
+        self._assert_same(vocabulary, loaded)
+        self.assertIsNone(loaded._mapped_counts)
+
+    def test_wordlist(self):
+        with open(self.path, "w") as f_list:
+            f_list.write("the\n\nwalrus\nthe\n")
+        vocabulary = from_wordlist(self.path)
+
+        self.assertEqual(vocabulary.index_to_word[4:], ["the", "walrus"])
+        self.assertEqual(vocabulary.word_count["the"], 2)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -9,9 +9,13 @@ variables.
 """
 
 # pylint: disable=unused-import
-from typing import Any, List, Union
+from typing import (Any, Dict, Iterable, Iterator, List, Optional, Set,
+                    Tuple, Union)
 # pylint: enable=unused-import
 
+import collections
+import threading
+
 import tensorflow as tf
 from typeguard import check_argument_types
 
@@ -31,7 +35,8 @@ class TensorFlowManager(object):
     def __init__(self, num_sessions, num_threads, save_n_best=1,
                  variable_files=None, gpu_allow_growth=True,
                  per_process_gpu_memory_fraction=1.0,
-                 report_gpu_memory_consumption=False):
+                 report_gpu_memory_consumption=False,
+                 prefetch_batches=0):
         """Initialize a TensorflowManager.
 
         At this moment the graph must already exist. This method initializes
@@ -46,6 +51,9 @@ class TensorFlowManager(object):
             per_process_gpu_memory_fraction: Limit TF memory use.
             report_gpu_memory_consumption: Report overall GPU memory at every
                 logging
+            prefetch_batches: Number of batches whose feed dictionaries are
+                prepared in a background thread while the current batch is
+                being computed. Zero disables prefetching.
         """
 
         assert check_argument_types()
@@ -60,6 +68,11 @@ class TensorFlowManager(object):
             per_process_gpu_memory_fraction
         self.report_gpu_memory_consumption = report_gpu_memory_consumption
 
+        if prefetch_batches < 0:
+            raise ValueError("Number of prefetched batches must be "
+                             "non-negative, was {}.".format(prefetch_batches))
+        self.prefetch_batches = prefetch_batches
+
         self.saver_max_to_keep = save_n_best
         self.sessions = [tf.Session(config=session_cfg)
                          for _ in range(num_sessions)]
@@ -82,19 +95,92 @@ class TensorFlowManager(object):
                 train=False,
                 compute_losses=True,
                 summaries=True,
-                batch_size=None) -> List[ExecutionResult]:
-        if batch_size is None:
-            batch_size = len(dataset)
-        batched_dataset = dataset.batch_dataset(batch_size)
+                batch_size=None,
+                token_budget=None,
+                feed_dict=None) -> List[ExecutionResult]:
+        """Execute the scripts on a dataset batch by batch.
+
+        Arguments:
+            dataset: The dataset to execute the scripts on.
+            execution_scripts: The runners or trainers to execute.
+            train: Boolean flag telling whether it is training time.
+            compute_losses: Flag whether the losses should be computed.
+            summaries: Flag whether the summaries should be computed.
+            batch_size: Maximum number of instances in a batch.
+            token_budget: Maximum number of padded tokens in a batch.
+            feed_dict: The feed dictionary of the dataset prepared by
+                `prefetch_feed_dicts`. If given, the whole dataset is
+                executed as a single batch.
+        """
+        if feed_dict is not None:
+            prepared_batches = iter([(dataset, feed_dict)])
+        else:
+            if batch_size is None and token_budget is None:
+                batch_size = len(dataset)
+            batched_dataset = dataset.batch_dataset(
+                batch_size, token_budget=token_budget)
+            prepared_batches = self.prefetch_feed_dicts(
+                batched_dataset, execution_scripts, train=train)
+
+        try:
+            batch_results = self._execute_batches(
+                prepared_batches, execution_scripts, compute_losses,
+                summaries)
+        finally:
+            if hasattr(prepared_batches, "close"):
+                prepared_batches.close()
+
+        collected_results = []  # type: List[ExecutionResult]
+        for result_list in batch_results:
+            collected_results.append(reduce_execution_results(result_list))
 
+        return collected_results
+
+    def prefetch_feed_dicts(
+            self,
+            batches: Iterable[Dataset],
+            execution_scripts,
+            train: bool=False) -> Iterator[Tuple[Dataset, Dict]]:
+        """Prepare the feed dictionaries of the batches ahead of time.
+
+        The feed dictionaries of all coders of the scripts are computed once
+        per batch, the executables can only ask for a subset of them. If
+        ``prefetch_batches`` is positive, they are computed in a background
+        thread while the previous batches are executed.
+
+        Arguments:
+            batches: Iterable of batched datasets.
+            execution_scripts: The runners or trainers the batches are
+                prepared for.
+            train: Boolean flag telling whether it is training time.
+
+        Returns:
+            Iterator yielding tuples of a batch and its feed dictionary in
+            the order of the batches. It should be closed when it is not
+            read to the end. If prepared in background, it is a
+            ``FeedDictPrefetcher``.
+        """
+        all_coders = set.union(*[s.all_coders for s in execution_scripts])
+
+        if self.prefetch_batches > 0:
+            return FeedDictPrefetcher(batches, all_coders, train,
+                                      self.prefetch_batches)
+        return ((batch, _feed_dicts(batch, all_coders, train=train))
+                for batch in batches)
+
+    def _execute_batches(
+            self,
+            prepared_batches: Iterable[Tuple[Dataset, Dict]],
+            execution_scripts,
+            compute_losses: bool,
+            summaries: bool) -> List[List[ExecutionResult]]:
         batch_results = [
             [] for _ in execution_scripts]  # type: List[List[ExecutionResult]]
-        for batch in batched_dataset:
+        for _, batch_feed_dict in prepared_batches:
             executables = [s.get_executable(compute_losses=compute_losses,
                                             summaries=summaries)
                            for s in execution_scripts]
             while not all(ex.result is not None for ex in executables):
-                all_feedables = set()   # type: Set[Any]
                 # type: Dict[Executable, tf.Tensor]
                 all_tensors_to_execute = {}
                 additional_feed_dicts = []
@@ -102,23 +188,30 @@ class TensorFlowManager(object):
 
                 for executable in executables:
                     if executable.result is None:
-                        (feedables,
+                        (_,
                          tensors_to_execute,
                          add_feed_dict) = executable.next_to_execute()
-                        all_feedables = all_feedables.union(feedables)
                         all_tensors_to_execute[executable] = tensors_to_execute
                         additional_feed_dicts.append(add_feed_dict)
                         tensor_list_lengths.append(len(tensors_to_execute))
                     else:
                         tensor_list_lengths.append(0)
 
-                feed_dict = _feed_dicts(batch, all_feedables, train=train)
+                # an executable can also give a list of feed dicts, one for
+                # each session
+                feed_dicts = [dict(batch_feed_dict) for _ in self.sessions]
                 for fdict in additional_feed_dicts:
-                    feed_dict.update(fdict)
+                    if isinstance(fdict, list):
+                        for feed_dict, session_fdict in zip(feed_dicts, fdict):
+                            feed_dict.update(session_fdict)
+                    else:
+                        for feed_dict in feed_dicts:
+                            feed_dict.update(fdict)
 
                 session_results = [sess.run(all_tensors_to_execute,
                                             feed_dict=feed_dict)
-                                   for sess in self.sessions]
+                                   for sess, feed_dict in zip(self.sessions,
+                                                              feed_dicts)]
 
                 for executable in executables:
                     if executable.result is None:
@@ -128,11 +221,7 @@ class TensorFlowManager(object):
             for script_list, executable in zip(batch_results, executables):
                 script_list.append(executable.result)
 
-        collected_results = []  # type: List[ExecutionResult]
-        for result_list in batch_results:
-            collected_results.append(reduce_execution_results(result_list))
-
-        return collected_results
+        return batch_results
 
     def save(self, variable_files: Union[str, List[str]]) -> None:
         if isinstance(variable_files, str) and len(self.sessions) == 1:
@@ -183,3 +272,110 @@ def _feed_dicts(dataset, coders, train=False):
         res.update(coder.feed_dict(dataset, train=train))
 
     return res
+
+
+class FeedDictPrefetcher(object):
+    """Iterator over batches whose feed dictionaries are prepared ahead.
+
+    A producer thread reads the batches and computes their feed dictionaries
+    one by one in the order of the batches, so the coders which keep a state
+    between the batches (e.g. the decoder schedule of the multi-decoder) get
+    the batches in the same order as without prefetching. A thread (and not
+    a process) is used because the feed dictionaries are keyed by the graph
+    placeholders.
+
+    The coders may draw random numbers (e.g. when sampling the unknown
+    words). Before the coders are used in another thread, e.g. for the
+    validation, ``wait_until_idle`` has to be called, so the producer draws
+    the same random numbers before and after the other computation in every
+    run.
+    """
+
+    def __init__(self, batches: Iterable[Dataset], coders: Set[Any],
+                 train: bool, queue_size: int) -> None:
+        """Start the producer thread.
+
+        Arguments:
+            batches: Iterable of batched datasets.
+            coders: Encoders and decoders which populate the feed
+                dictionaries.
+            train: Boolean flag telling whether it is training time.
+            queue_size: Maximum number of batches prepared ahead.
+        """
+        self._batches = iter(batches)
+        self._coders = coders
+        self._train = train
+        self._queue_size = queue_size
+
+        self._condition = threading.Condition()
+        self._prepared = collections.deque()  # type: collections.deque
+        self._produced = 0
+        self._consumed = 0
+        self._stopped = False
+        self._finished = False
+        self._error = None  # type: Optional[Exception]
+
+        self._producer = threading.Thread(
+            target=self._produce, name="feed-dict-producer", daemon=True)
+        self._producer.start()
+
+    def _may_produce(self) -> bool:
+        return self._produced < self._consumed + self._queue_size
+
+    def _produce(self) -> None:
+        try:
+            while True:
+                with self._condition:
+                    self._condition.wait_for(
+                        lambda: self._stopped or self._may_produce())
+                    if self._stopped:
+                        return
+
+                batch = next(self._batches, None)
+                if batch is None:
+                    return
+                feed_dict = _feed_dicts(batch, self._coders, self._train)
+
+                with self._condition:
+                    self._prepared.append((batch, feed_dict))
+                    self._produced += 1
+                    self._condition.notify_all()
+        # pylint: disable=broad-except
+        except Exception as exc:
+            self._error = exc
+        finally:
+            with self._condition:
+                self._finished = True
+                self._condition.notify_all()
+
+    def __iter__(self) -> Iterator[Tuple[Dataset, Dict]]:
+        return self
+
+    def __next__(self) -> Tuple[Dataset, Dict]:
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._prepared or self._finished)
+            if self._prepared:
+                self._consumed += 1
+                self._condition.notify_all()
+                return self._prepared.popleft()
+        if self._error is not None:
+            raise self._error
+        raise StopIteration
+
+    def wait_until_idle(self) -> None:
+        """Wait until the producer has prepared all batches it may prepare.
+
+        The producer does not call the coders again until the next batch is
+        read from the iterator.
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._finished or not self._may_produce())
+
+    def close(self) -> None:
+        """Stop the producer (e.g. when the execution is interrupted)."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._producer.join()
@@ -23,6 +23,8 @@ def create_config() -> Configuration:
     config.add_argument('epochs', cond=lambda x: x >= 0)
     config.add_argument('trainer')
     config.add_argument('batch_size', cond=lambda x: x > 0)
+    config.add_argument('bucket_window', required=False, default=None,
+                        cond=lambda x: x is None or x > 0)
     config.add_argument('train_dataset')
     config.add_argument('val_dataset')
     config.add_argument('output')
@@ -39,6 +41,10 @@ def create_config() -> Configuration:
                         required=False, default=15)
     config.add_argument('train_start_offset', required=False, default=0)
     config.add_argument('runners_batch_size', required=False, default=None)
+    config.add_argument('token_budget', required=False, default=None,
+                        cond=lambda x: x is None or x > 0)
+    config.add_argument('runners_token_budget', required=False, default=None,
+                        cond=lambda x: x is None or x > 0)
     config.add_argument('minimize', required=False, default=False)
     config.add_argument('postprocess')
     config.add_argument('name')
@@ -159,6 +165,7 @@ def main() -> None:
         epochs=cfg.model.epochs,
         trainer=cfg.model.trainer,
         batch_size=cfg.model.batch_size,
+        bucket_window=cfg.model.bucket_window,
         train_dataset=cfg.model.train_dataset,
         val_dataset=cfg.model.val_dataset,
         log_directory=cfg.model.output,
@@ -175,5 +182,7 @@ def main() -> None:
         postprocess=cfg.model.postprocess,
         train_start_offset=cfg.model.train_start_offset,
         runners_batch_size=cfg.model.runners_batch_size,
+        token_budget=cfg.model.token_budget,
+        runners_token_budget=cfg.model.runners_token_budget,
         initial_variables=cfg.model.initial_variables,
         minimize_metric=cfg.model.minimize)
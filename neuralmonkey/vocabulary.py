@@ -3,17 +3,21 @@ can be used to obtain a Vocabulary instance.
 """
 
 import collections
+import itertools
 import os
 import pickle as pickle
 import random
+import struct
 
-from typing import List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 from typeguard import check_argument_types
 
 from neuralmonkey.logging import log, warn
 from neuralmonkey.dataset import Dataset, LazyDataset
+from neuralmonkey.interned_series import InternedSeries
+from neuralmonkey.parallel import parallel_imap
 
 PAD_TOKEN = "<pad>"
 START_TOKEN = "<s>"
@@ -27,6 +31,14 @@ START_TOKEN_INDEX = 1
 END_TOKEN_INDEX = 2
 UNK_TOKEN_INDEX = 3
 
+# The binary vocabulary file starts with a header consisting of the magic
+# bytes, the number of words, the length of the word table in bytes and the
+# unk sampling probability. It is followed by the word counts as an int64
+# array and the word table, i.e. the UTF-8 encoded words separated by
+# newlines. All numbers are little-endian.
+_FILE_MAGIC = b"NMVOCAB1"
+_FILE_HEADER = struct.Struct("<8sqqd")
+
 
 def _is_special_token(word: str) -> bool:
     """Check whether word is a special token (such as <pad> or <s>).
@@ -44,10 +56,14 @@ def _is_special_token(word: str) -> bool:
 
 
 def from_file(path: str) -> 'Vocabulary':
-    """Loads vocabulary from a pickled file
+    """Loads vocabulary from a file.
+
+    The file is either in the binary format written by
+    ``Vocabulary.save_to_file`` or a pickled vocabulary saved by older
+    versions (these can be converted by ``scripts/convert_vocabulary.py``).
 
     Arguments:
-        path: The path to the pickle file
+        path: The path to the vocabulary file
 
     Returns:
         The newly created vocabulary.
@@ -55,15 +71,68 @@ def from_file(path: str) -> 'Vocabulary':
     if not os.path.exists(path):
         raise Exception("Vocabulary file does not exist: {}".format(path))
 
-    with open(path, 'rb') as f_pickle:
-        vocabulary = pickle.load(f_pickle)
-    assert isinstance(vocabulary, Vocabulary)
+    with open(path, 'rb') as f_vocab:
+        is_binary = f_vocab.read(len(_FILE_MAGIC)) == _FILE_MAGIC
+
+    if is_binary:
+        vocabulary = _from_binary(path)
+        log("Vocabulary loaded. Size: {} words".format(len(vocabulary)))
+    else:
+        with open(path, 'rb') as f_vocab:
+            vocabulary = pickle.load(f_vocab)
+        assert isinstance(vocabulary, Vocabulary)
+        log("Pickled vocabulary loaded. Size: {} words"
+            .format(len(vocabulary)))
 
-    log("Pickled vocabulary loaded. Size: {} words".format(len(vocabulary)))
     vocabulary.log_sample()
     return vocabulary
 
 
+def _from_binary(path: str) -> 'Vocabulary':
+    """Load a vocabulary from a binary vocabulary file.
+
+    The word counts are memory-mapped, so the processes loading the same
+    vocabulary share their pages. The dictionary of the counts is built from
+    them only when it is accessed (see ``Vocabulary.word_count``).
+
+    Arguments:
+        path: The path to the file.
+
+    Returns:
+        The vocabulary.
+
+    Raises:
+        ValueError if the file is truncated.
+    """
+    with open(path, 'rb') as f_vocab:
+        _, size, words_length, unk_sample_prob = _FILE_HEADER.unpack(
+            f_vocab.read(_FILE_HEADER.size))
+        counts_end = _FILE_HEADER.size + 8 * size
+        file_size = os.fstat(f_vocab.fileno()).st_size
+        if file_size != counts_end + words_length:
+            raise ValueError("Vocabulary file is corrupted, expected {} "
+                             "bytes, found {}.".format(
+                                 counts_end + words_length, file_size))
+
+        f_vocab.seek(counts_end)
+        words = f_vocab.read().decode("utf-8").split("\n") if size else []
+
+    if size:
+        counts = np.memmap(
+            path, dtype="<i8", mode="r", offset=_FILE_HEADER.size,
+            shape=(size,))  # type: np.ndarray
+    else:
+        counts = np.zeros(0, dtype="<i8")
+
+    vocabulary = Vocabulary(unk_sample_prob=unk_sample_prob)
+    vocabulary.index_to_word = words
+    vocabulary.word_to_index = dict(zip(words, range(size)))
+    # the dictionary of the counts is built on demand from the mapped array
+    vocabulary._word_count = None
+    vocabulary._mapped_counts = counts
+    return vocabulary
+
+
 def from_wordlist(path: str, encoding: str="utf-8") -> 'Vocabulary':
     """Loads vocabulary from a wordlist.
 
@@ -77,12 +146,9 @@ def from_wordlist(path: str, encoding: str="utf-8") -> 'Vocabulary':
     vocabulary = Vocabulary()
 
     with open(path, encoding=encoding) as wordlist:
-        for line in wordlist:
-            line = line.strip()
-            # check if line is empty
-            if not line:
-                continue
-            vocabulary.add_word(line)
+        # empty lines are skipped
+        vocabulary.add_word_counts(collections.Counter(
+            word for word in map(str.strip, wordlist) if word))
 
     log("Vocabulary from wordlist loaded, containing {} words"
         .format(len(vocabulary)))
@@ -94,9 +160,16 @@ def from_wordlist(path: str, encoding: str="utf-8") -> 'Vocabulary':
 # helper function, this number of parameters is needed
 def from_dataset(datasets: List[Dataset], series_ids: List[str], max_size: int,
                  save_file: str=None, overwrite: bool=False,
-                 unk_sample_prob: float=0.5) -> 'Vocabulary':
+                 unk_sample_prob: float=0.5,
+                 num_workers: int=0) -> 'Vocabulary':
     """Loads vocabulary from a dataset with an option to save it.
 
+    The tokens are counted while the series are streamed, so the datasets
+    can be lazy. With more workers, each of them counts the tokens in a shard
+    of every dataset (see ``Dataset.shard``) and the counts are merged. The
+    words are indexed in the alphabetical order, so the vocabulary does not
+    depend on the number of workers.
+
     Arguments:
         datasets: A list of datasets from which to create the vocabulary
         series_ids: A list of ids of series of the datasets that should be used
@@ -106,6 +179,8 @@ def from_dataset(datasets: List[Dataset], series_ids: List[str], max_size: int,
                    the vocabulary will not be saved.
         unk_sample_prob: The probability with which to sample unks out of
                          words with frequency 1. Defaults to 0.5.
+        num_workers: Number of processes counting the tokens. Defaults to 0
+                     (the tokens are counted in the main process).
 
     Returns:
         The new Vocabulary instance.
@@ -113,18 +188,13 @@ def from_dataset(datasets: List[Dataset], series_ids: List[str], max_size: int,
 
     assert check_argument_types()
 
+    # the words are added in the order of their first occurrence for any
+    # number of workers, so the indices are the same as of a vocabulary
+    # built word by word
     vocabulary = Vocabulary(unk_sample_prob=unk_sample_prob)
-
     for dataset in datasets:
-        if isinstance(dataset, LazyDataset):
-            warn("Inferring vocabulary from lazy dataset!")
-
-        for series_id in series_ids:
-            series = dataset.get_series(series_id, allow_none=True)
-            if series:
-                vocabulary.add_tokenized_text(
-                    [token for sent in series for token in sent])
-
+        vocabulary.add_word_counts(_count_dataset_tokens(
+            dataset, series_ids, num_workers))
     vocabulary.trunkate(max_size)
 
     log("Vocabulary for series {} initialized, containing {} words"
@@ -142,6 +212,129 @@ def from_dataset(datasets: List[Dataset], series_ids: List[str], max_size: int,
     return vocabulary
 
 
+# The counts of the tokens of a series in a dataset (shard), the first
+# occurrences of the tokens as the index of the sentence and the position in
+# it, and the number of the sentences.
+SeriesCounts = Tuple[collections.Counter, Dict[str, Tuple[int, int]], int]
+
+
+def _count_tokens(dataset: Dataset,
+                  series_ids: List[str]) -> List[SeriesCounts]:
+    """Count the tokens in the series of a dataset in a single pass."""
+    series_counts = []  # type: List[SeriesCounts]
+    for series_id in series_ids:
+        series = dataset.get_series(series_id, allow_none=True)
+        word_counts = collections.Counter()  # type: collections.Counter
+        first = {}  # type: Dict[str, Tuple[int, int]]
+        if isinstance(series, InternedSeries):
+            # the sentences of a series view are contiguous in the ids
+            offsets = series.offsets
+            ids = series.ids[offsets[0]:offsets[-1]]
+            table_counts = np.bincount(ids, minlength=len(series.table))
+            unique_ids, positions = np.unique(ids, return_index=True)
+            positions += offsets[0]
+            sentences = np.searchsorted(offsets, positions, side="right") - 1
+            for index, sentence, position in zip(
+                    unique_ids.tolist(), sentences.tolist(),
+                    (positions - offsets[sentences]).tolist()):
+                word = series.table.words[index]
+                word_counts[word] = table_counts[index]
+                first[word] = (sentence, position)
+            length = len(series)
+        else:
+            length = 0
+            for sentence in (series if series is not None else []):
+                word_counts.update(sentence)
+                # only the new words are looked up in the sentence
+                for word in set(sentence).difference(first):
+                    first[word] = (length, sentence.index(word))
+                length += 1
+        series_counts.append((word_counts, first, length))
+    return series_counts
+
+
+def _count_dataset_tokens(dataset: Dataset, series_ids: List[str],
+                          num_workers: int) -> Dict[str, int]:
+    """Count the tokens in the series of a dataset using worker processes.
+
+    The tokens are ordered by their first occurrence in the series (taken
+    one after another) regardless of the number of the workers, i.e. in the
+    order in which a single process adds them to the vocabulary.
+
+    Arguments:
+        dataset: The dataset.
+        series_ids: The ids of the series to count.
+        num_workers: Number of the worker processes and the dataset shards.
+
+    Returns:
+        The counts of the tokens.
+    """
+    if num_workers < 2:
+        return _merge_counts([_count_tokens(dataset, series_ids)], False)
+
+    try:
+        shards = [dataset.shard(i, num_workers) for i in range(num_workers)]
+    except ValueError as exc:
+        warn("Counting tokens of dataset '{}' in a single process: {}"
+             .format(dataset.name, exc))
+        return _merge_counts([_count_tokens(dataset, series_ids)], False)
+
+    # the shards are inherited by the forked workers, only their indices
+    # and the counts are sent between the processes
+    def count_shard(index: int) -> List[SeriesCounts]:
+        return _count_tokens(shards[index], series_ids)
+
+    # the lazy dataset which is not indexed is split into striding shards,
+    # the other ones into contiguous ranges of the instances
+    # pylint: disable=protected-access
+    strided = (isinstance(dataset, LazyDataset)
+               and dataset._line_indices is None)
+    # pylint: enable=protected-access
+
+    return _merge_counts(
+        list(parallel_imap(count_shard, range(num_workers), num_workers,
+                           chunk_size=1)), strided)
+
+
+def _merge_counts(shard_counts: List[List[SeriesCounts]],
+                  strided: bool) -> Dict[str, int]:
+    """Merge the token counts of the dataset shards.
+
+    Arguments:
+        shard_counts: The counts of the series of every shard.
+        strided: Whether the shards take every n-th sentence of the dataset
+            instead of contiguous ranges.
+
+    Returns:
+        The counts of the tokens ordered by their first occurrence in the
+        series of the whole dataset.
+    """
+    num_shards = len(shard_counts)
+    word_counts = collections.Counter()  # type: collections.Counter
+    # the first occurrence as (series, sentence, position in the sentence)
+    first_occurrence = {}  # type: Dict[str, Tuple[int, int, int]]
+
+    for series_index, all_counts in enumerate(zip(*shard_counts)):
+        shard_start = 0
+        for shard_index, (counts, first, length) in enumerate(all_counts):
+            for word, (sentence, position) in first.items():
+                if strided:
+                    sentence = shard_index + sentence * num_shards
+                else:
+                    sentence += shard_start
+                occurrence = (series_index, sentence, position)
+                if (word not in first_occurrence
+                        or occurrence < first_occurrence[word]):
+                    first_occurrence[word] = occurrence
+            word_counts.update(counts)
+            shard_start += length
+
+    ordered_words = sorted(first_occurrence,
+                           key=lambda word: first_occurrence[word])
+    return collections.OrderedDict(
+        (word, word_counts[word]) for word in ordered_words)
+
+
 def from_bpe(path: str, encoding: str="utf-8") -> 'Vocabulary':
     """Loads vocabulary from Byte-pair encoding merge list.
 
@@ -233,7 +426,14 @@ class Vocabulary(collections.Sized):
         """
         self.word_to_index = {}  # type: Dict[str, int]
         self.index_to_word = []  # type: List[str]
-        self.word_count = {}  # type: Dict[str, int]
+        self._word_count = {}  # type: Optional[Dict[str, int]]
+        # memory-mapped counts of a loaded vocabulary, used until the
+        # dictionary of the counts is needed
+        self._mapped_counts = None  # type: Optional[np.ndarray]
+        # cached mask of the words seen at most once (for unk sampling)
+        self._rare_word_mask = None  # type: Optional[np.ndarray]
+        # cached object array of the words (for decoding of index vectors)
+        self._index_to_word_array = None  # type: Optional[np.ndarray]
 
         self.unk_sample_prob = unk_sample_prob
 
@@ -275,6 +475,7 @@ class Vocabulary(collections.Sized):
             self.index_to_word.append(word)
             self.word_count[word] = 0
         self.word_count[word] += 1
+        self._rare_word_mask = None
 
     def add_tokenized_text(self, tokenized_text: List[str]) -> None:
         """Add words from a list to the vocabulary.
@@ -285,6 +486,21 @@ class Vocabulary(collections.Sized):
         for word in tokenized_text:
             self.add_word(word)
 
+    def add_word_counts(self, word_counts: Dict[str, int]) -> None:
+        """Add words with their counts to the vocabulary.
+
+        Arguments:
+            word_counts: Mapping from the words to the number of their
+                occurrences, e.g. a ``collections.Counter``.
+        """
+        for word, count in word_counts.items():
+            if word not in self:
+                self.word_to_index[word] = len(self.index_to_word)
+                self.index_to_word.append(word)
+                self.word_count[word] = 0
+            self.word_count[word] += count
+        self._rare_word_mask = None
+
     def get_word_index(self, word: str) -> int:
         """ Return index of the specified word.
 
@@ -314,10 +530,14 @@ class Vocabulary(collections.Sized):
             Index of the word, index of the unknown token if sampled, or index
             of the unknown token if the word is not present in the vocabulary.
         """
-        idx = self.word_to_index.get(word, self.get_word_index(UNK_TOKEN))
-        freq = self.word_count.get(word, 0)
+        idx = self.word_to_index.get(word)
+        if idx is None:
+            idx = self.get_word_index(UNK_TOKEN)
+            is_rare = True
+        else:
+            is_rare = self._rare_words()[idx]
 
-        if freq <= 1 and random.random() < self.unk_sample_prob:
+        if is_rare and random.random() < self.unk_sample_prob:
             return self.get_word_index(UNK_TOKEN)
 
         return idx
@@ -330,26 +550,23 @@ class Vocabulary(collections.Sized):
             size: The final size of the vocabulary
         """
         # sort by frequency
-        words_by_freq = sorted(list(self.word_count.keys()),
+        words_by_freq = sorted(self.index_to_word,
                                key=lambda w: self.word_count[w])
 
-        # keep the least frequent words which are not special symbols
-        words_to_delete = [w for w in words_by_freq[:-size]
-                           if not _is_special_token(w)]
-
-        # sort by index ... bigger indices needs to be removed first
-        # to keep the lists propertly shaped
-        delete_words_by_index = sorted(
-            [(w, self.word_to_index[w]) for w in words_to_delete],
-            key=lambda p: -p[1])
+        # delete the least frequent words which are not special symbols
+        words_to_delete = set(w for w in words_by_freq[:-size]
+                              if not _is_special_token(w))
 
-        for word, index in delete_words_by_index:
+        # keep the order of the remaining words
+        self.index_to_word = [w for w in self.index_to_word
+                              if w not in words_to_delete]
+        for word in words_to_delete:
             del self.word_count[word]
-            del self.index_to_word[index]
 
-        self.word_to_index = {}
-        for index, word in enumerate(self.index_to_word):
-            self.word_to_index[word] = index
+        self.word_to_index = {word: index for index, word
+                              in enumerate(self.index_to_word)}
+        self._rare_word_mask = None
+        self._index_to_word_array = None
 
     def sentences_to_tensor(
             self,
@@ -362,7 +579,10 @@ class Vocabulary(collections.Sized):
         """Generate the tensor representation for the provided sentences.
 
         Arguments:
-            sentences: List of sentences as lists of tokens.
+            sentences: Iterable of sentences as lists of tokens or as numpy
+                arrays of indices to this vocabulary (see
+                ``neuralmonkey.readers.compiled_reader``), or an interned
+                series (see ``neuralmonkey.interned_series``).
             max_len: If specified, all sentences will be truncated to this
                 length.
             pad_to_max_len: If True, the tensor will be padded to `max_len`,
@@ -393,62 +613,185 @@ class Vocabulary(collections.Sized):
             The shape of the padding vector is the same as of the sentence
             vector.
         """
+        if not isinstance(sentences, (list, InternedSeries)):
+            sentences = list(sentences)
+
+        if isinstance(sentences, InternedSeries):
+            sentence_lengths = sentences.lengths
+        else:
+            sentence_lengths = np.array([len(s) for s in sentences],
+                                        dtype=np.int64)
+
         if pad_to_max_len and max_len is not None:
             batch_max_len = max_len
         else:
-            batch_max_len = max(len(s) for s in sentences)
+            batch_max_len = int(sentence_lengths.max())
             if add_end_symbol:
                 batch_max_len += 1
             if max_len is not None:
                 batch_max_len = min(max_len, batch_max_len)
 
+        lengths = np.minimum(sentence_lengths, batch_max_len)
+        indices = self._token_indices(sentences, lengths)
+        if train_mode and self.unk_sample_prob > 0:
+            # words seen at most once are replaced by the unknown token with
+            # the given probability, using a single draw for the batch
+            sampled = np.random.random(len(indices)) < self.unk_sample_prob
+            sampled &= self._rare_words()[indices]
+            indices[sampled] = self.word_to_index[UNK_TOKEN]
+
+        # shift the sentences by one step if the start symbol is added
+        first_step = int(add_start_symbol)
         word_indices = np.full(
-            [batch_max_len, len(sentences)], self.get_word_index(PAD_TOKEN),
-            dtype=np.int32)
-        weights = np.zeros([batch_max_len, len(sentences)])
-
-        for i in range(batch_max_len):
-            for j, sent in enumerate(sentences):
-                if i < len(sent):
-                    w_idx = (self.get_unk_sampled_word_index(sent[i])
-                             if train_mode else self.get_word_index(sent[i]))
-                    word_indices[i, j] = w_idx
-                    weights[i, j] = 1
-
-                elif i == len(sent) and add_end_symbol:
-                    word_indices[i, j] = self.get_word_index(END_TOKEN)
-                    weights[i, j] = 1
+            [batch_max_len + first_step, len(sentences)],
+            self.word_to_index[PAD_TOKEN], dtype=np.int32)
+        weights = np.zeros([batch_max_len + first_step, len(sentences)],
+                           dtype=np.float32)
+
+        columns = np.repeat(np.arange(len(sentences)), lengths)
+        steps = np.arange(len(indices)) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths)
+        word_indices[steps + first_step, columns] = indices
+
+        if add_end_symbol:
+            ended = lengths < batch_max_len
+            word_indices[lengths[ended] + first_step,
+                         np.flatnonzero(ended)] = self.word_to_index[END_TOKEN]
+            lengths = lengths + ended
+
+        weights[first_step:] = (
+            np.arange(batch_max_len)[:, np.newaxis] < lengths[np.newaxis, :])
 
         if add_start_symbol:
-            word_indices = np.insert(word_indices, 0,
-                                     self.get_word_index(START_TOKEN), axis=0)
-            weights = np.insert(weights, 0, 1, axis=0)
+            word_indices[0] = self.word_to_index[START_TOKEN]
+            weights[0] = 1
 
         return word_indices, weights
 
-    def vectors_to_sentences(self,
-                             vectors: List[np.ndarray]) -> List[List[str]]:
+    def _token_indices(self, sentences: List[Any],
+                       lengths: np.ndarray) -> np.ndarray:
+        """Map the truncated sentences to a flat array of word indices.
+
+        Arguments:
+            sentences: List of sentences as lists of tokens or as numpy
+                arrays of indices, or an interned series.
+            lengths: Lengths to which the sentences are truncated.
+
+        Returns:
+            One-dimensional int32 array of the indices of all tokens.
+        """
+        word_to_index = self.word_to_index
+        unk_index = word_to_index[UNK_TOKEN]
+
+        if isinstance(sentences, InternedSeries):
+            # the token table is mapped to the vocabulary only once
+            table_indices = sentences.table.lookup(word_to_index, unk_index)
+            return table_indices[
+                sentences.ids[sentences.token_positions(lengths)]]
+
+        if not any(isinstance(s, np.ndarray) for s in sentences):
+            return np.array(
+                [word_to_index.get(word, unk_index)
+                 for sent, length in zip(sentences, lengths.tolist())
+                 for word in sent[:length]], dtype=np.int32)
+
+        # sentences already compiled to vocabulary indices
+        return np.concatenate(
+            [np.zeros(0, dtype=np.int32)] +
+            [sent[:length] if isinstance(sent, np.ndarray)
+             else [word_to_index.get(word, unk_index)
+                   for word in sent[:length]]
+             for sent, length in zip(sentences, lengths.tolist())]
+        ).astype(np.int32, copy=False)
+
+    def _rare_words(self) -> np.ndarray:
+        """Get the mask of the words seen at most once.
+
+        The mask is computed once and cached until the vocabulary changes.
+
+        Returns:
+            Boolean array indexed by the word indices.
+        """
+        rare_words = getattr(self, "_rare_word_mask", None)
+        if rare_words is None or len(rare_words) != len(self):
+            if self._mapped_counts is not None:
+                rare_words = np.asarray(self._mapped_counts <= 1)
+            else:
+                rare_words = np.array(
+                    [self.word_count.get(word, 0) <= 1
+                     for word in self.index_to_word], dtype=np.bool_)
+            self._rare_word_mask = rare_words
+        return rare_words
+
+    def vectors_to_sentences(
+            self, vectors: Union[List[np.ndarray], np.ndarray],
+            return_indices: bool=False) -> List[Any]:
         """Convert vectors of indexes of vocabulary items to lists of words.
 
+        Each sentence is truncated before the first end token. The end
+        positions are found for the whole batch at once and the indices are
+        translated to words through an array of the vocabulary words.
+
         Arguments:
-            vectors: List of vectors of vocabulary indices.
+            vectors: List of vectors of vocabulary indices (one for each time
+                step) or a matrix of shape (time, batch).
+            return_indices: If True, the truncated vectors of indices are
+                returned instead of the words.
 
         Returns:
-            List of lists of words.
+            List of lists of words, or of index arrays if ``return_indices``
+            is True.
         """
-        sentences = [[] for _ in range(vectors[0].shape[0])]
-        # type: List[List[str]]
+        matrix = np.asarray(vectors)
+        is_end = matrix == self.word_to_index[END_TOKEN]
+        lengths = np.where(is_end.any(axis=0), is_end.argmax(axis=0),
+                           matrix.shape[0]).tolist()
+        rows = matrix.T
+
+        if return_indices:
+            return [row[:length] for row, length in zip(rows, lengths)]
 
-        for vec in vectors:
-            for sentence, word_i in zip(sentences, vec):
-                if not sentence or sentence[-1] != END_TOKEN:
-                    sentence.append(self.index_to_word[word_i])
+        words = self._word_array()[rows[:, :max(lengths, default=0)]]
+        return [row[:length].tolist() for row, length in zip(words, lengths)]
 
-        return [s[:-1] if s[-1] == END_TOKEN else s for s in sentences]
+    def _word_array(self) -> np.ndarray:
+        """Get the vocabulary words as a numpy object array.
+
+        The array is computed once and cached until the vocabulary changes.
+        """
+        word_array = getattr(self, "_index_to_word_array", None)
+        if word_array is None or len(word_array) != len(self):
+            word_array = np.empty(len(self), dtype=object)
+            word_array[:] = self.index_to_word
+            self._index_to_word_array = word_array
+        return word_array
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        # vocabularies pickled by older versions keep the counts directly
+        if "word_count" in state:
+            state["_word_count"] = state.pop("word_count")
+        state.setdefault("_mapped_counts", None)
+        self.__dict__.update(state)
+
+    @property
+    def word_count(self) -> Dict[str, int]:
+        """Get the mapping from the words to the number of occurrences.
+
+        For a vocabulary loaded from a binary file, the mapping is built from
+        the memory-mapped counts when it is first accessed.
+        """
+        if self._word_count is None:
+            self._word_count = dict(zip(self.index_to_word,
+                                        self._mapped_counts.tolist()))
+            self._mapped_counts = None
+        return self._word_count
 
     def save_to_file(self, path: str, overwrite: bool=False) -> None:
         """Save the vocabulary to a file.
 
+        The vocabulary is stored in a binary format which is loaded without
+        unpickling (see ``from_file``).
+
         Arguments:
             path: The path to save the file to.
             overwrite: Flag whether to overwrite existing file.
@@ -456,13 +799,25 @@ class Vocabulary(collections.Sized):
         Raises:
             FileExistsError if the file exists and overwrite flag is
             disabled.
+            ValueError if some of the words contains a newline.
         """
         if os.path.exists(path) and not overwrite:
             raise FileExistsError("Cannot save vocabulary: File exists and "
                                   "overwrite is disabled. {}".format(path))
 
-        with open(path, 'wb') as f_pickle:
-            pickle.dump(self, f_pickle)
+        if any("\n" in word for word in self.index_to_word):
+            raise ValueError("Cannot save vocabulary with words containing "
+                             "newlines.")
+
+        words = "\n".join(self.index_to_word).encode("utf-8")
+        counts = np.array([self.word_count[word]
+                           for word in self.index_to_word], dtype="<i8")
+
+        with open(path, 'wb') as f_vocab:
+            f_vocab.write(_FILE_HEADER.pack(_FILE_MAGIC, len(self),
+                                            len(words), self.unk_sample_prob))
+            f_vocab.write(counts.tobytes())
+            f_vocab.write(words)
 
     def log_sample(self, size: int=5):
         """Logs a sample of the vocabulary
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+"""
+
+A script converting pickled vocabularies saved by older versions of Neural
+Monkey to the binary vocabulary format. The converted file can be used in
+place of the pickled one, it is loaded by ``vocabulary.from_file`` as well.
+
+"""
+
+import argparse
+
+from neuralmonkey.vocabulary import from_file
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Converts a pickled vocabulary to the binary format.")
+    parser.add_argument("input", type=str,
+                        help="The pickled vocabulary file.")
+    parser.add_argument("output", type=str,
+                        help="The path of the converted vocabulary.")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="Overwrite the output file if it exists.")
+    args = parser.parse_args()
+
+    vocabulary = from_file(args.input)
+    vocabulary.save_to_file(args.output, overwrite=args.overwrite)
+
+
+if __name__ == "__main__":
+    main()